@@ -1,5 +1,17 @@
 from __future__ import print_function
-from .utils import *
-from .database import *
-from .interfaces import *
-from .plotter import *
+import importlib
+
+# Subpackages and constants are loaded on first access, so that importing the package
+# does not import scipy, abipy, ase or matplotlib
+subpackages = ['database', 'diffusion', 'interfaces', 'neb', 'plotter', 'trainer', 'utils']
+
+
+def __getattr__(name):
+
+    if name in subpackages:
+        return importlib.import_module('.{}'.format(name), __name__)
+
+    from .utils import constants
+    if name in constants.__all__:
+        return getattr(constants, name)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
@@ -107,6 +107,7 @@ class DbConverter:
 
             # ASE : will need to check. Get the number of configs and find how to loop on them
             # MTP : easier to break the text into single configs? (as a text object or a rewritten temp text file?)
-        for idx, struct in enumerate(data.structures[self.start::self.every]):
-            atoms = newdb.convert_structure(struct)
+        # Configurations may have different numbers of atoms: data.forces[idx] is the (natom, 3) array of configuration idx
+        for idx in range(self.start, data.nconfig, self.every):
+            atoms = newdb.convert_structure(data.structure(idx))
             newdb.add_to_database(out, atoms, data.energy[idx], data.forces[idx], data.stresses[idx])
@@ -1,16 +1,19 @@
 #! /usr/bin/env/python
 
 import os
-from abipy.dynamics.hist import HistFile
-from abipy.abilab import abiopen
-from ase.db import connect
 import numpy as np
 from scripts_electrolytes.interfaces.ase_interface import abistruct_to_ase
 from scripts_electrolytes.interfaces.mtp_interface import abistruct_to_cfg
 from scripts_electrolytes.interfaces.lammps_interface import abistruct_to_xyz
-from scripts_electrolytes.utils.constants import ha_to_ev, bohr_to_ang, gpa_to_evang3
+from scripts_electrolytes.utils import constants
+from scripts_electrolytes.utils.lazy import lazy_import
 import glob
 
+abihist = lazy_import('abipy.dynamics.hist')
+abilab = lazy_import('abipy.abilab')
+ase_db = lazy_import('ase.db')
+ase_singlepoint = lazy_import('ase.calculators.singlepoint')
+
 '''
     These classes create a databse of atomic configurations extracted from Abinit HIST.nc files
     or from a directory containing multiple GSR.nc files,
@@ -67,13 +70,13 @@ class DbCreator:
 
     def db_from_hist(self, fname):
 
-        hist = HistFile(fname)
+        hist = abihist.HistFile(fname)
 
         structures = hist.structures
 
         if self.remove_ekin:
             print('Removing ionic kinetic energy from total energy')
-            energies = hist.etotals - hist.reader.read_value('ekin')*ha_to_ev
+            energies = hist.etotals - hist.reader.read_value('ekin')*constants.ha_to_ev
         else:
             energies = hist.etotals
         forces = hist.reader.read_value('fcart')
@@ -84,8 +87,8 @@ class DbCreator:
         for i in dblst:
             atoms = self.convert_structure(structures[i])
             energy = energies[i]  # in eV
-            current_forces = forces[i, :, :] * ha_to_ev/bohr_to_ang  # in eV/ang
-            current_stress = stresses[i, :] * ha_to_ev/(bohr_to_ang**3)  # in eV/ang^3
+            current_forces = forces[i, :, :] * constants.ha_to_ev/constants.bohr_to_ang  # in eV/ang
+            current_stress = stresses[i, :] * constants.ha_to_ev/(constants.bohr_to_ang**3)  # in eV/ang^3
             self.add_to_database(db, atoms, energy, current_forces, current_stress)
 
 
@@ -96,14 +99,23 @@ class DbCreator:
 
         db = self.create_database()
         for fname in gsr_list:
-            gsr = abiopen(fname)
+            gsr = abilab.abiopen(fname)
             structure = gsr.structure
             atoms = self.convert_structure(structure)
             # GSR files are T=0K, no ionic ekin
             energy = gsr.energy
             current_forces = gsr.cart_forces  # already in eV/ang
-            current_stress = gsr.reader.read_value('cartesian_stress_tensor') * ha_to_ev/(bohr_to_ang**3) # convert from ha_bohr3 to eV/ang^3 
+            current_stress = gsr.reader.read_value('cartesian_stress_tensor') * constants.ha_to_ev/(constants.bohr_to_ang**3) # convert from ha_bohr3 to eV/ang^3 
             self.add_to_database(db, atoms, energy, current_forces, current_stress)
+            gsr.close()
+
+        self.close_database(db)
+
+
+    def close_database(self, db):
+        # Flush text databases, so that successive calls can append to the same file
+        if hasattr(db, 'close'):
+            db.close()
 
 
 class MtpDbCreator(DbCreator):
@@ -169,7 +181,7 @@ class AseDbCreator(DbCreator):
 
     
     def create_database(self):
-        return connect(self.dbname)
+        return ase_db.connect(self.dbname)
 
 
     def convert_structure(self, struct):
@@ -179,6 +191,10 @@ class AseDbCreator(DbCreator):
     def add_to_database(self, db, atoms, energy, forces, stresses):
         if isinstance(energy, float):
             energy = np.array([energy])
+        if energy is not None:
+            # The energy is also stored in the energy column, so that it can be read or used in selections
+            # without decoding the data of each row (see AseDbReader)
+            atoms.calc = ase_singlepoint.SinglePointCalculator(atoms, energy=float(np.ravel(energy)[0]))
         db.write(atoms, data={'energy': energy, 'forces': forces, 'stress': stresses})
 
 
@@ -2,12 +2,13 @@
 
 import os
 import numpy as np
-from ase.db import connect
 from scripts_electrolytes.interfaces.ase_interface import abistruct_to_ase
 from scripts_electrolytes.interfaces.mtp_interface import abistruct_to_cfg
 from scripts_electrolytes.interfaces.lammps_interface import abistruct_to_xyz
-from scripts_electrolytes.utils.constants import ha_to_ev, bohr_to_ang, gpa_to_evang3
 from scripts_electrolytes.database.db_reader import MtpDbReader, AseDbReader, XyzDbReader
+from scripts_electrolytes.utils.lazy import lazy_import
+
+ase_db = lazy_import('ase.db')
 
 '''
     These classes merge databases of atomic configurations previously created with DbCreator.
@@ -55,8 +56,8 @@ class DbMerger:
             data = self.read_database(db)
             data.load_database()
 
-            for idx, struct in enumerate(data.structures):
-                atoms = self.convert_structure(struct)
+            for idx in range(data.nconfig):
+                atoms = self.convert_structure(data.structure(idx))
                 self.add_to_database(newdb, atoms, data.energy[idx], data.forces[idx], data.stresses[idx])
 
 
@@ -126,7 +127,7 @@ class AseDbMerger(DbMerger):
     
     def open_database(self):
         # FIX ME: test if this appends to the db.
-        return connect(self.dbname)
+        return ase_db.connect(self.dbname)
 
 
     def read_database(self, fname):
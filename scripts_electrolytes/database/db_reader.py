@@ -1,20 +1,43 @@
 from ..interfaces.lammps_interface import read_traj_from_dump, read_traj_from_ncdump
-from ..interfaces.ase_interface import ase_to_abistruct
-from ..interfaces.mtp_interface import split_cfg_configs, convert_chunk_to_abivars
+from ..interfaces.mtp_interface import split_cfg_configs, convert_chunk_to_abivars, read_natom
 from ..interfaces.abinit_interface import abivars_to_abistruct
 from ..interfaces.partn_interface import fix_species_in_xyz_mlip
+from ..utils.lazy import lazy_import
+from .ragged import RaggedArray
 import numpy as np
-from ase.io import read as ase_read
-from ase.db import connect as ase_connect
+
+ase_io = lazy_import('ase.io')
+ase_db = lazy_import('ase.db')
+abistructure = lazy_import('abipy.core.structure')
 
 class DbReader:
 
     def __init__(self, fname):
 
+        '''
+            Base class for the database readers. After load_database, configurations may have different numbers of atoms:
+
+                natoms: (nconfig) array of the number of atoms of each configuration
+                energy: (nconfig) array, in eV
+                stresses: (nconfig, 6) array, in eV/Ang^3
+                cells: (nconfig, 3, 3) array of lattice vectors, in Ang
+                positions, forces (in Ang, eV/Ang) and numbers (atomic numbers): RaggedArray objects (see ragged.py),
+                    storing the atoms of all configurations in a flat (total number of atoms, 3) array.
+                    forces[i] is the (natom_i, 3) array of configuration i.
+
+            energy, forces and stresses are lists of None if the database does not contain them.
+            Structures are not stored: structure(i) builds the abipy Structure of configuration i when needed.
+        '''
+
         self.fname = fname
 
 
-    def initialize_arrays(self, nconfig, natom):
+    def initialize_arrays(self, natoms):
+
+        ''' natoms: number of atoms of each configuration '''
+
+        nconfig = len(natoms)
+        self.natoms = np.asarray(natoms, dtype=int)
 
         if self.has_energy:
             self.energy = np.zeros((nconfig))
@@ -22,7 +45,7 @@ class DbReader:
             self.energy = [None] * nconfig
 
         if self.has_forces:
-            self.forces = np.zeros((nconfig, natom, 3))
+            self.forces = RaggedArray(natoms, shape=(3,))
         else:
             self.forces = [None] * nconfig
 
@@ -31,62 +54,183 @@ class DbReader:
         else:
             self.stresses = [None] * nconfig
 
-        self.structures = []
+        self.positions = RaggedArray(natoms, shape=(3,))
+        self.numbers = RaggedArray(natoms, dtype=int)
+        self.cells = np.zeros((nconfig, 3, 3))
+
+
+    def add_structure(self, i, struct):
+
+        ''' Stores the positions, atomic numbers and cell of an abipy Structure as configuration i '''
+
+        self.positions[i] = struct.cart_coords
+        self.numbers[i] = struct.atomic_numbers
+        self.cells[i] = struct.lattice.matrix
+
+
+    def add_atoms(self, i, atoms):
+
+        ''' Stores the positions, atomic numbers and cell of an ASE Atoms object as configuration i '''
+
+        self.positions[i] = atoms.get_positions()
+        self.numbers[i] = atoms.get_atomic_numbers()
+        self.cells[i] = atoms.get_cell()[:]
+
+
+    def structure(self, i):
+
+        ''' abipy Structure of configuration i, built from the stored arrays '''
+
+        return abistructure.Structure(self.cells[i], self.numbers[i], self.positions[i], coords_are_cartesian=True)
+
+
+    @property
+    def nconfig(self):
+        return len(self.natoms)
+
+
+    def take(self, indices):
+
+        ''' New reader containing the configurations of the given indices, in that order '''
+
+        indices = np.asarray(indices, dtype=int)
+        data = DbReader(self.fname)
+        for name in ['has_energy', 'has_forces', 'has_stress']:
+            setattr(data, name, getattr(self, name))
+
+        data.natoms = self.natoms[indices]
+        data.positions = self.positions.take(indices)
+        data.numbers = self.numbers.take(indices)
+        data.cells = self.cells[indices]
+        data.energy = self.energy[indices] if self.has_energy else [None] * len(indices)
+        data.forces = self.forces.take(indices) if self.has_forces else [None] * len(indices)
+        data.stresses = self.stresses[indices] if self.has_stress else [None] * len(indices)
+
+        return data
 
 
 class AseDbReader(DbReader):
 
-    def __init__(self, fname):
+    # Fields which can be read, and the ASE database columns they are read from.
+    # Energy, forces and stress are read from the data dictionnary when the database does not contain these columns.
+    field_columns = {'structures': ['numbers', 'positions', 'cell', 'pbc'],
+                     'energy': ['energy'],
+                     'forces': ['forces'],
+                     'stresses': ['stress']}
+    data_keys = {'energy': 'energy', 'forces': 'forces', 'stresses': 'stress'}
+
+    def __init__(self, fname, selection=None, fields=None, **query):
+
+        '''
+            Reader for ASE .db databases. Rows are streamed from the database, and only the requested columns are read,
+            so that reading the energies of a large database, or the configurations matching a selection, stays fast.
+
+            Input:
+                selection: ASE database selection, i.e. "natoms<100", "Li>10" or "energy<-300", passed to db.select
+                           with the keyword arguments in query (i.e. AseDbReader(fname, "natoms<100", config="md"))
+                           Default: None (all rows)
+
+                fields: list of the fields to read, among "structures", "energy", "forces" and "stresses".
+                        Fields which are not requested are never decoded: their arrays are lists of None.
+                        Without "structures", positions, numbers and cells stay zero (natoms is still read),
+                        so structure(i) should not be used.
+                        Default: None (all fields)
+        '''
 
         super(AseDbReader, self).__init__(fname)
 
+        if fields is None:
+            fields = list(self.field_columns.keys())
+        unknown = [field for field in fields if field not in self.field_columns]
+        if unknown:
+            raise ValueError('fields should be in {}, but I got {}'.format(list(self.field_columns.keys()), unknown))
+
+        self.selection = selection
+        self.query = query
+        self.fields = list(fields)
+
+
+    def select(self, db, columns, include_data):
+        return db.select(self.selection, columns=['id'] + columns, include_data=include_data, **self.query)
+
+
+    def iter_rows(self, db=None):
+
+        '''
+            Yields the selected rows as dictionnaries containing the row id, the number of atoms and the requested fields
+            (an ASE Atoms object for "structures"), without storing them. Only the requested columns are read.
+        '''
+
+        if db is None:
+            db = ase_db.connect(self.fname)
+        if not hasattr(self, 'sources'):
+            self.set_properties(db)
+
+        columns = ['numbers']
+        for field, source in self.sources.items():
+            if source == 'column':
+                columns += self.field_columns[field]
+        include_data = 'data' in self.sources.values()
+
+        for row in self.select(db, sorted(set(columns)), include_data):
+            config = {'id': row.id, 'natoms': row.natoms}
+            for field, source in self.sources.items():
+                if field == 'structures':
+                    config[field] = row.toatoms()
+                elif source == 'column':
+                    config[field] = row.get(self.field_columns[field][0])
+                else:
+                    config[field] = row.data[self.data_keys[field]]
+            yield config
+
 
     def load_database(self):
 
-        db = ase_connect(self.fname)
-        traj = [row for row in db.select()]  # This creates a list of AtomsRow objects
-        
-        self.set_properties(traj)
-        nconfig = len(traj)
-        natom = traj[0].natoms
+        db = ase_db.connect(self.fname)
+        self.set_properties(db)
 
-        self.initialize_arrays(nconfig, natom)
+        # First pass on the atomic numbers only, to allocate the arrays of configurations with different sizes.
+        # Only the id and number of atoms of each row are kept, the atomic numbers are stored by the second pass.
+        ids, natoms = [], []
+        for row in self.select(db, ['numbers'], include_data=False):
+            ids.append(row.id)
+            natoms.append(row.natoms)
+        self.ids = np.asarray(ids, dtype=int)
+        self.initialize_arrays(natoms)
 
         # they should already be in the correct units (eV, eV/ang, eV/ang^3)
-        for i in range(nconfig):
-            struct = traj[i].toatoms() # Convert AtomsRow object to Atoms object
-            self.structures.append(ase_to_abistruct(struct))
-
+        for i, config in enumerate(self.iter_rows(db)):
+            if 'structures' in self.sources:
+                self.add_atoms(i, config['structures'])
             if self.has_energy:
-                self.energy[i] = float(traj[i].data['energy'])
+                self.energy[i] = float(config['energy'])
             if self.has_forces:
-                self.forces[i, :, :] = traj[i].data['forces']
+                self.forces[i] = config['forces']
             if self.has_stress:
-                self.stresses[i, :] = traj[i].data['stress']
+                self.stresses[i] = config['stresses']
 
-#    
-    def set_properties(self, traj):
 
-        info = list(traj[0].data.keys())
+    def set_properties(self, db):
 
-        # Here we assume that all database entries contain the same properties. 
-        # check if traj contains energies
-        if 'energy' in info and traj[0].data['energy'] is not None:
-            self.has_energy = True
-        else:
-            self.has_energy = False
+        '''
+            Finds where each requested field is stored ("column" or "data"), from the first selected row.
+            Here we assume that all database entries contain the same properties.
+        '''
 
-        # check if traj contains forces
-        if 'forces' in info and traj[0].data['forces'] is not None:
-            self.has_forces = True
-        else:
-            self.has_forces = False
+        first = next(iter(db.select(self.selection, limit=1, **self.query)), None)
+        if first is None:
+            raise ValueError('No configuration in database {} matches selection {} {}'.format(self.fname, self.selection, self.query))
 
-        # check if traj contains stresses
-        if 'stress' in info and traj[0].data['stress'] is not None:
-            self.has_stress = True
-        else:
-            self.has_stress = False
+        self.sources = {}
+        for field in self.fields:
+            if field == 'structures' or first.get(self.field_columns[field][0]) is not None:
+                self.sources[field] = 'column'
+            elif first.data.get(self.data_keys[field]) is not None:
+                self.sources[field] = 'data'
+
+        self.has_energy = 'energy' in self.sources
+        self.has_forces = 'forces' in self.sources
+        self.has_stress = 'stresses' in self.sources
 
 
 class MtpDbReader(DbReader):
@@ -103,7 +247,7 @@ class MtpDbReader(DbReader):
     def load_database(self):
 
         configs = split_cfg_configs(self.fname)
-        nconfig = len(configs)
+        natoms = [read_natom(chunk) for chunk in configs]
 
         #now, convert each chunk to abivars and define a Structure object
         for i, chunk in enumerate(configs):
@@ -111,14 +255,14 @@ class MtpDbReader(DbReader):
 
             if i == 0:
                 self.set_properties(energy, forces, stresses)
-                self.initialize_arrays(nconfig, abivars['natom'])
+                self.initialize_arrays(natoms)
 
-            self.structures.append(abivars_to_abistruct(abivars))
+            self.add_structure(i, abivars_to_abistruct(abivars))
 
             if self.has_energy:
                 self.energy[i] = energy
             if self.has_forces:
-                self.forces[i, :, :] = forces
+                self.forces[i] = forces
             if self.has_stress:
                 self.stresses[i, :] = stresses
 
@@ -159,22 +303,21 @@ class XyzDbReader(DbReader):
 
     def load_database(self):
 
-        traj = ase_read(filename=self.fname, index=':')
+        traj = ase_io.read(filename=self.fname, index=':')
         
         self.set_properties(traj)
         nconfig = len(traj)
-        natom = np.shape(traj[0].get_positions())[0]
 
-        self.initialize_arrays(nconfig, natom)
+        self.initialize_arrays([len(atoms) for atoms in traj])
 
         # they should already be in the correct units (eV, eV/ang, eV/ang^3)
         for i in range(nconfig):
-            self.structures.append(ase_to_abistruct(traj[i]))
+            self.add_atoms(i, traj[i])
 
             if self.has_energy:
                 self.energy[i] = traj[i].info['energy']
             if self.has_forces:
-                self.forces[i, :, :] = traj[i].calc.get_forces()
+                self.forces[i] = traj[i].calc.get_forces()
             if self.has_stress:
                 strs = traj[i].info['stress']
                 self.stresses[i, :] = strs[0,0], strs[1,1], strs[2,2], strs[1,2], strs[0,2], strs[0,1]
@@ -224,18 +367,17 @@ class DumpDbReader(DbReader):
 
         self.set_properties(traj)
         nconfig = len(traj)
-        natom = np.shape(traj[0].get_positions())[0]
 
-        self.initialize_arrays(nconfig, natom)
+        self.initialize_arrays([len(atoms) for atoms in traj])
 
         # they should already be in the correct units (eV, eV/ang, eV/ang^3)
         for i in range(nconfig):
-            self.structures.append(ase_to_abistruct(traj[i]))
+            self.add_atoms(i, traj[i])
 
             # There should NOT be total energy and stress data in the dump file. 
             # Treating only the forces. 
             if self.has_forces:
-                self.forces[i, :, :] = traj[i].calc.get_forces()
+                self.forces[i] = traj[i].calc.get_forces()
 
 
     def set_properties(self, traj):
@@ -274,18 +416,17 @@ class NcDumpDbReader(DbReader):
 
         self.set_properties(traj)
         nconfig = len(traj)
-        natom = np.shape(traj[0].get_positions())[0]
 
-        self.initialize_arrays(nconfig, natom)
+        self.initialize_arrays([len(atoms) for atoms in traj])
 
         # they should already be in the correct units (eV, eV/ang, eV/ang^3)
         for i in range(nconfig):
-            self.structures.append(ase_to_abistruct(traj[i]))
+            self.add_atoms(i, traj[i])
 
             # There should NOT be total energy and stress data in the dump file. 
             # Treating only the forces. 
             if self.has_forces:
-                self.forces[i, :, :] = traj[i].calc.get_forces()
+                self.forces[i] = traj[i].calc.get_forces()
 
 
     def set_properties(self, traj):
@@ -1,9 +1,11 @@
 import numpy as np
 import os
-from ase.db import connect
 from copy import deepcopy
 from ..interfaces.mtp_interface import split_cfg_configs
 from ..interfaces.partn_interface import split_xyz_configs
+from ..utils.lazy import lazy_import
+
+ase_db = lazy_import('ase.db')
 
 '''
     These classes split a given database in ASE .db or MTP .cfg format in two distinct databases.
@@ -47,6 +49,32 @@ class DbSplitter:
             self.seed = seed
 
 
+    def split_indices(self, nconfig, start=0):
+
+        ''' Shuffled indices of the configurations in the first and second databases '''
+
+        if self.split_fraction:
+            ndata = int(np.floor(self.split_fraction*nconfig))
+        else:
+            ndata = self.nsplit
+
+        idx = np.arange(start, nconfig + start)
+        if self.seed:
+            np.random.seed(self.seed)
+        np.random.shuffle(idx)
+
+        return idx[:ndata], idx[ndata:]
+
+
+    def split_reader(self, data):
+
+        ''' Splits a loaded DbReader (see db_reader.py) in memory. Returns two DbReader objects,
+            which keep the ragged storage of configurations with different numbers of atoms. '''
+
+        idx1, idx2 = self.split_indices(data.nconfig)
+        return data.take(idx1), data.take(idx2)
+
+
 class AseDbSplitter(DbSplitter):
 
     def __init__(self, dbname, nsplit, split_fraction, appendtxt, seed):
@@ -60,22 +88,14 @@ class AseDbSplitter(DbSplitter):
         out_db1, out_db2 = (self.dbname.split('.db')[0] + '_{}.db'.format(split[0]), 
                             self.dbname.split('.db')[0] + '_{}.db'.format(split[1]))
 
-        with connect(self.dbname) as db, connect(out_db1) as db1, connect(out_db2) as db2:
+        with ase_db.connect(self.dbname) as db, ase_db.connect(out_db1) as db1, ase_db.connect(out_db2) as db2:
 
             meta = deepcopy(db.metadata)
             db1.metadata = meta
             db2.metadata = meta
 
-            if self.split_fraction:
-                ndata = int(np.floor(self.split_fraction*db.count()))
-            else:
-                ndata = self.nsplit
-            idx = np.arange(1, db.count() + 1)
-
-            if self.seed:
-                np.random.seed(self.seed)
-            np.random.shuffle(idx)
-            idx1, idx2 = idx[:ndata], idx[ndata:]
+            # ASE database ids start at 1
+            idx1, idx2 = self.split_indices(db.count(), start=1)
 
             for idx in idx1:
                 row = db.get(id=idx.item())
@@ -100,17 +120,7 @@ class MtpDbSplitter(DbSplitter):
 
         configs = split_cfg_configs(self.dbname)
 
-        if self.split_fraction:
-            ndata = int(np.floor(self.split_fraction*len(configs)))
-        else:
-            ndata = self.nsplit
-
-        idx = np.arange(0, len(configs))
-
-        if self.seed:
-            np.random.seed(self.seed)
-        np.random.shuffle(idx)
-        idx1, idx2 = idx[:ndata], idx[ndata:]
+        idx1, idx2 = self.split_indices(len(configs))
 
         cfg1, cfg2 = (open(out_db1, 'w'), 
                       open(out_db2, 'w'))
@@ -147,17 +157,7 @@ class XyzDbSplitter(DbSplitter):
 
         configs = split_xyz_configs(self.dbname)
 
-        if self.split_fraction:
-            ndata = int(np.floor(self.split_fraction*len(configs)))
-        else:
-            ndata = self.nsplit
-
-        idx = np.arange(0, len(configs))
-
-        if self.seed:
-            np.random.seed(self.seed)
-        np.random.shuffle(idx)
-        idx1, idx2 = idx[:ndata], idx[ndata:]
+        idx1, idx2 = self.split_indices(len(configs))
 
         cfg1, cfg2 = (open(out_db1, 'w'), 
                       open(out_db2, 'w'))
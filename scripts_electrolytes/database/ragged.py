@@ -0,0 +1,96 @@
+import numpy as np
+
+''' Ragged (CSR-style) storage of per-atom data for databases mixing configurations of different sizes '''
+
+
+class RaggedArray:
+
+    def __init__(self, counts, shape=(), dtype=float):
+
+        '''
+            Per-atom data of several configurations stored in a single flat array of shape (total number of atoms, *shape),
+            with the offsets of each configuration, so that memory scales with the actual number of atoms
+            instead of nconfig*max(natom).
+
+            self[i] returns the (natom_i, *shape) view of configuration i, and self[i] = value fills it.
+            Indexing with a slice, a list or an array of indices returns a new RaggedArray.
+
+            Input:
+                counts: number of atoms of each configuration
+
+                shape: shape of the data of each atom, i.e. (3,) for positions and forces, () for atomic numbers
+                       Default: ()
+
+                dtype: data type
+                       Default: float
+        '''
+
+        self.counts = np.asarray(counts, dtype=int)
+        self.offsets = np.zeros(len(self.counts)+1, dtype=int)
+        np.cumsum(self.counts, out=self.offsets[1:])
+        self.data = np.zeros((self.offsets[-1],) + tuple(shape), dtype=dtype)
+
+
+    @classmethod
+    def from_arrays(cls, arrays):
+
+        ''' Builds a RaggedArray from a list of per-configuration arrays '''
+
+        arrays = [np.asarray(array) for array in arrays]
+        if not arrays:
+            return cls([])
+        ragged = cls([len(array) for array in arrays], shape=arrays[0].shape[1:], dtype=arrays[0].dtype)
+        if ragged.data.size:
+            ragged.data[:] = np.concatenate(arrays)
+        return ragged
+
+
+    def __len__(self):
+        return len(self.counts)
+
+
+    def check_index(self, i):
+
+        nconfig = len(self.counts)
+        if i < -nconfig or i >= nconfig:
+            raise IndexError('Configuration index {} out of range for {} configurations'.format(i, nconfig))
+        return i % nconfig
+
+
+    def __getitem__(self, key):
+
+        if isinstance(key, (int, np.integer)):
+            i = self.check_index(key)
+            return self.data[self.offsets[i]:self.offsets[i+1]]
+        return self.take(np.arange(len(self))[key])
+
+
+    def __setitem__(self, key, value):
+
+        if not isinstance(key, (int, np.integer)):
+            raise TypeError('RaggedArray configurations should be set one at a time, but I got index {}'.format(key))
+        i = self.check_index(key)
+        self.data[self.offsets[i]:self.offsets[i+1]] = value
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def take(self, indices):
+
+        ''' New RaggedArray containing the configurations of the given indices, in that order '''
+
+        indices = np.asarray(indices, dtype=int)
+        ragged = RaggedArray(self.counts[indices], shape=self.data.shape[1:], dtype=self.data.dtype)
+        if len(indices) and ragged.data.size:
+            # Flat indices of all the atoms of the selected configurations
+            starts = np.repeat(self.offsets[indices] - ragged.offsets[:-1], ragged.counts)
+            ragged.data[:] = self.data[starts + np.arange(len(ragged.data))]
+        return ragged
+
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes + self.counts.nbytes
@@ -1,29 +1,35 @@
 from .msd import MsdData
-from abipy.dynamics.hist import HistFile
-from ..utils.constants import atomic_timeunit, bohr_to_ang
+from ..utils import constants
+from ..utils.lazy import lazy_import
 import numpy as np
 import logging
 import os
 
+abihist = lazy_import('abipy.dynamics.hist')
+
 class HistMsdData(MsdData):
 
-    def __init__(self, fname, rootname='MsdData'):
+    def __init__(self, fname, rootname='MsdData', precision='double'):
 
         '''
             Input:
                 fname: name of the netCDF HIST.nc file containing atomic positions information
 
                 rootname: rootname for the .dat and .nc output files containing the computed information
+
+                precision: floating point precision of the individual atoms MSD in the netCDF output,
+                           "double" or "single" (halves the file size)
+                           Default: "double"
         '''
 
-        super(HistMsdData, self).__init__(fname, rootname)
-        self.data = HistFile(fname)
+        super(HistMsdData, self).__init__(fname, rootname, precision)
+        self.data = abihist.HistFile(fname)
         self.data_source = 'Abinit HIST file'
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
     @property
     def read_timestep(self):
-        timestep_ps = self.data.reader.read_value('dtion')*atomic_timeunit/1E-12
+        timestep_ps = self.data.reader.read_value('dtion')*constants.atomic_timeunit/1E-12
         return timestep_ps
 
     @property
@@ -32,7 +38,12 @@ class HistMsdData(MsdData):
 
     @property
     def read_positions(self):
-        return self.data.reader.read_value('xcart')[:, self.atom_indices, :]*bohr_to_ang
+        return self.data.reader.read_value('xcart')*constants.bohr_to_ang
+
+    @property
+    def read_volume(self):
+        rprimd = self.data.reader.read_value('rprimd')*constants.bohr_to_ang
+        return np.mean(np.abs(np.linalg.det(rprimd)))
 
     def get_atoms_for_diffusion(self):
         if self.atom_type == 'all':
@@ -52,9 +63,12 @@ class HistMsdData(MsdData):
         self.msd_atoms = self.compute_atoms_msd(displacements)
         self.msd = np.mean(self.msd_atoms, axis=1)
 
+        if self.charges is not None:
+            self.compute_charge_msd(self.charge_traj - self.charge_traj[0, :, :])
+
     def compute_diffusion_coefficient(self, atom_type='all', msd_type='bare', discard_init_steps=0, discard_init_time_ps=None,
-                                      discard_final_steps=None,
-                                      plot=False, plot_errors=False, plot_verbose=True, plot_all_atoms=False, **kwargs):
+                                      discard_final_steps=None, charges=None,
+                                      lag_grid=None, nlags=100, cache=None, plot=False, plot_errors=False, plot_verbose=True, plot_all_atoms=False, **kwargs):
 
         '''
             atom_type: for which atoms the MSD must be computed. Currently, possible options 
@@ -76,6 +90,24 @@ class HistMsdData(MsdData):
                                 diffusion coefficient.
                                 Default: None
 
+            charges: dictionnary of formal charges (in units of e) for each atomic species, i.e. {'Li': 1, 'P': 5, 'S': -2}.
+                     If provided, the collective (center of charge) MSD is accumulated from the same trajectory,
+                     and the ionic conductivity and Haven ratio are computed and written to the output files.
+                     Default: None (only the diffusion coefficient is computed)
+
+            lag_grid: time lags (in number of frames) at which the MSD is computed and stored.
+                      None: all lags (one per frame)
+                      "log": nlags logarithmically spaced lags, which strongly reduces the cost and the output size of long runs
+                      list of integers: user-defined lags
+                      Default: None
+
+            nlags: number of lags for lag_grid="log"
+                   Default: 100
+
+            cache: MsdCache instance (see diffusion/msd_cache.py). If the same trajectory was already processed with the
+                   same MSD parameters, the MSD arrays are retrieved from the cache instead of reading the trajectory again.
+                   Default: None (no caching)
+
             plot: activate plotting of MSD vs t
 
             plot_errors: plot MSD(T) +- standard deviation on all atoms at each timestep, if available
@@ -104,36 +136,51 @@ class HistMsdData(MsdData):
                 raise TypeError('discard_final_steps should be an integer, but I got {} which is a {}'.format(discard_final_steps, type(discard_final_steps)))
 
         self.read_temperature
-        self.get_atoms_for_diffusion()
-        logging.info('Extracting trajectories...')
-        self.traj = self.read_positions
-        if discard_final_steps is not None:
-            self.traj = self.traj[:-discard_final_steps]
-        self.nframes, self.natoms = np.shape(self.traj)[:2]
-        # check if the positions are wrapped or unwrapped, with condition like dx larger than half the unit cell?
-#        for i, frame in enumerate(self.traj):
-#            if np.any(frame > 12):
-#                #print('found atoms outside the box in frame {}'.format(i))
-#                #print(frame)
-#                here = np.where(frame>12)[:][0]
-#                if np.any(here>71):
-#                    print('found non-Li diffusing atoms in frame {}!!!'.format(i))
-        # From this test, positions seem to be unwrapped as at some points some atoms move outside the unit cell
-    
-        self.time = self.timestep*np.arange(self.nframes)
+
+        msd_params = {'atom_type': atom_type, 'msd_type': msd_type, 'discard_final_steps': discard_final_steps,
+                      'charges': charges, 'lag_grid': lag_grid, 'nlags': nlags}
+
+        if cache is not None and self.load_from_cache(cache, msd_params):
+            logging.info('MSD loaded from cache')
+        else:
+            self.get_atoms_for_diffusion()
+            logging.info('Extracting trajectories...')
+            positions = self.read_positions
+            if discard_final_steps is not None:
+                positions = positions[:-discard_final_steps]
+            self.traj = positions[:, self.atom_indices, :]
+            if charges is not None:
+                symbols = [site.specie.symbol for site in self.data.initial_structure]
+                self.get_charged_atoms(symbols, charges)
+                self.charge_traj = positions[:, self.charge_indices, :]
+                self.volume = self.read_volume
+            self.nframes, self.natoms = np.shape(self.traj)[:2]
+            # check if the positions are wrapped or unwrapped, with condition like dx larger than half the unit cell?
+            # From this test, positions seem to be unwrapped as at some points some atoms move outside the unit cell
+
+            self.set_lag_grid(lag_grid, nlags)
+            self.time = self.timestep*self.lags
+
+            logging.info('Computing MSD from atomic positions...') 
+            self.compute_msd_from_positions()
+            logging.info('... done!')
+
+            if cache is not None:
+                self.save_to_cache(cache)
 
         if discard_init_time_ps:
             self.discard_init_steps = np.asarray([self.time>=discard_init_time_ps]).nonzero()[1][0]
         else:
-            self.discard_init_steps = discard_init_steps
-
-        logging.info('Computing MSD from atomic positions...') 
-        self.compute_msd_from_positions()
-        logging.info('... done!')
+            # discard_init_steps is now an index in the lag grid
+            self.discard_init_steps = int(np.searchsorted(self.lags, discard_init_steps))
 
         self.diffusion = self.extract_diffusion_coefficient()
         self.msd_std = self.extract_msd_errors()
         logging.info(f'Diffusion coefficient: {self.diffusion:.3e}+-{self.diffusion_std:.3e} cm^2/s')
+        if self.charges is not None:
+            self.extract_conductivity()
+            logging.info(f'Ionic conductivity: {self.conductivity:.3e}+-{self.conductivity_std:.3e} S/cm')
+            logging.info(f'Haven ratio: {self.haven_ratio:.3f}+-{self.haven_ratio_std:.3f}')
 
         self.write_data()
 
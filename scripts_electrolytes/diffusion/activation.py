@@ -1,6 +1,6 @@
 import numpy as np
 from .msd_output import MsdOutput
-from ..utils.constants import boltzmann_evK
+from ..utils import constants
 from ..plotter.ea_plotter import EaPlotter
 from ..plotter.colorpalettes import bright
 
@@ -35,9 +35,9 @@ class ActivationEnergyData:
 
         # Linear fit of ln(D(T)) vs 1/T. 
         fit, cov = np.polyfit(self.inverse_temperature, np.log(self.diffusion_coefficient), 1, cov=True)
-        self.activation_energy = -fit[0]*boltzmann_evK
+        self.activation_energy = -fit[0]*constants.boltzmann_evK
         self.d0 = np.exp(fit[1])
-        self.ea_std = np.sqrt(np.diag(cov))[0]*boltzmann_evK
+        self.ea_std = np.sqrt(np.diag(cov))[0]*constants.boltzmann_evK
         print('Activation energy = {:.3f}+-{:.3f} eV'.format(self.activation_energy, self.ea_std))
         
         if plot:
@@ -50,7 +50,7 @@ class ActivationEnergyData:
         myplot.set_line2d_params(**kwargs)
 
         myplot.ax.semilogy(1000*self.inverse_temperature, self.diffusion_coefficient, marker='o', color=bright['blue'], linestyle='None')
-        y = self.d0*np.exp(-self.activation_energy/boltzmann_evK*self.inverse_temperature)
+        y = self.d0*np.exp(-self.activation_energy/constants.boltzmann_evK*self.inverse_temperature)
         myplot.ax.semilogy(1000*self.inverse_temperature, y, color=bright['red'])
 
         if verbose:
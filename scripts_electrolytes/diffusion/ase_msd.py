@@ -1,15 +1,17 @@
 import numpy as np
-from ase.io import read as ase_read
-from ase import units
 from .msd import MsdData
-from ase.md.analysis import DiffusionCoefficient
+from ..utils.lazy import lazy_import
 import logging
 import os
 import warnings
 
+ase_io = lazy_import('ase.io')
+ase_units = lazy_import('ase.units')
+ase_analysis = lazy_import('ase.md.analysis')
+
 class AseMsdData(MsdData):
 
-    def __init__(self, fname, rootname='MsdData'):
+    def __init__(self, fname, rootname='MsdData', precision='double'):
 
         '''
             Input:
@@ -17,6 +19,10 @@ class AseMsdData(MsdData):
 
                 rootname: rootname for the .dat and .nc output files containing the computed information
 
+                precision: floating point precision of the individual atoms MSD in the netCDF output,
+                           "double" or "single" (halves the file size)
+                           Default: "double"
+
         '''
 
         fileext = os.path.splitext(fname)[-1]
@@ -24,14 +30,14 @@ class AseMsdData(MsdData):
             raise Exception('''ASE trajectory file should have one of the following extensions: ".traj", ".trj",
                                but I got "{}"'''.format(fileext))
 
-        super(AseMsdData, self).__init__(fname, rootname)
+        super(AseMsdData, self).__init__(fname, rootname, precision)
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
     
     def compute_diffusion_coefficient(self, timestep=None, atom_type='all', msd_type='bare', input_temperature=None,
                                       discard_init_steps=0, discard_init_time_ps=None, plot=False, plot_errors=False,
-                                      discard_final_steps=None,
-                                      plot_verbose=True, plot_all_atoms=False, **kwargs):
+                                      discard_final_steps=None, charges=None, unwrap=False,
+                                      lag_grid=None, nlags=100, cache=None, plot_verbose=True, plot_all_atoms=False, **kwargs):
 
         '''
             timestep: MD timestep, in picosecond. DO NOT USE ASE UNITS MODULE!
@@ -58,6 +64,28 @@ class AseMsdData(MsdData):
                                 coefficient fromthe MSD.
                                 Default: None
 
+            charges: dictionnary of formal charges (in units of e) for each atomic species, i.e. {'Li': 1, 'P': 5, 'S': -2}.
+                     If provided, the collective (center of charge) MSD is accumulated from the same trajectory,
+                     and the ionic conductivity and Haven ratio are computed and written to the output files.
+                     Default: None (only the diffusion coefficient is computed)
+
+            unwrap: reconstruct continuous trajectories from wrapped positions, using the (possibly triclinic and 
+                    time-dependent) cell of each frame. Requires that atoms move by less than half a cell vector between frames.
+                    Default: False (positions are assumed to be unwrapped)
+
+            lag_grid: time lags (in number of frames) at which the MSD is computed and stored.
+                      None: all lags (one per frame)
+                      "log": nlags logarithmically spaced lags, which strongly reduces the cost and the output size of long runs
+                      list of integers: user-defined lags
+                      Default: None
+
+            nlags: number of lags for lag_grid="log"
+                   Default: 100
+
+            cache: MsdCache instance (see diffusion/msd_cache.py). If the same trajectory was already processed with the
+                   same MSD parameters, the MSD arrays are retrieved from the cache instead of reading the trajectory again.
+                   Default: None (no caching)
+
             plot: activate plotting of MSD vs t
 
             plot_errors: plot MSD(t) +- standard deviation on all atoms at each timestep, if available
@@ -102,35 +130,58 @@ class AseMsdData(MsdData):
         self.atom_type = atom_type
         logging.info('Will average MSD(T) on {} atoms'.format(self.atom_type))
 
-        logging.info('Extracting trajectories...')
-
         self.data_source = 'ASE trajectory file'
-        ### check if I can have unwrapped positions!!!
-        ## Idea: do it assuming they are wrapped, then use ase's built-in DiffusionCoefficient class and compare.
-        self.traj = ase_read(self.fname, index=':')
-        if discard_final_steps:
-            self.traj = self.traj[:-discard_final_steps]
 
-        self.get_atoms_for_diffusion()
-        self.nframes = len(self.traj)
-        self.natoms = len(self.atom_indices)
-        logging.info('Computing MSD from atomic positions...')
-        self.compute_msd_from_positions()
-        logging.info('... done!')
+        msd_params = {'atom_type': atom_type, 'msd_type': msd_type, 'timestep': timestep, 'discard_final_steps': discard_final_steps,
+                      'charges': charges, 'unwrap': unwrap, 'lag_grid': lag_grid, 'nlags': nlags}
 
-        self.time = timestep*np.arange(len(self.msd))
+        from_cache = cache is not None and self.load_from_cache(cache, msd_params)
+        if from_cache:
+            logging.info('MSD loaded from cache')
+        else:
+            logging.info('Extracting trajectories...')
+
+            self.traj = ase_io.read(self.fname, index=':')
+            if discard_final_steps:
+                self.traj = self.traj[:-discard_final_steps]
+
+            if unwrap:
+                logging.info('Unwrapping trajectories...')
+                self.unwrap_trajectory()
+
+            self.get_atoms_for_diffusion()
+            if charges is not None:
+                self.get_charged_atoms(self.traj[0].get_chemical_symbols(), charges)
+                self.volume = np.mean([frame.get_volume() for frame in self.traj])
+            self.nframes = len(self.traj)
+            self.natoms = len(self.atom_indices)
+            self.set_lag_grid(lag_grid, nlags)
+            logging.info('Computing MSD from atomic positions...')
+            self.compute_msd_from_positions()
+            logging.info('... done!')
+
+            self.time = timestep*self.lags
+
+            if cache is not None:
+                self.save_to_cache(cache)
 
         if discard_init_time_ps:
             self.discard_init_steps = np.asarray([self.time>=discard_init_time_ps]).nonzero()[1][0]
         else:
-            self.discard_init_steps = discard_init_steps
+            # discard_init_steps is now an index in the lag grid
+            self.discard_init_steps = int(np.searchsorted(self.lags, discard_init_steps))
 
         # For sanity check, compare with ASE class
-        self.coeff_from_ase = self.get_diffusion_ase(timestep)
+        if not from_cache:
+            self.coeff_from_ase = self.get_diffusion_ase(timestep)
 
         self.diffusion = self.extract_diffusion_coefficient()
         self.msd_std = self.extract_msd_errors()
         logging.info(f'Diffusion coefficient: {self.diffusion:.3e}+-{self.diffusion_std:.3e} cm^2/s')
+        if self.charges is not None:
+            self.extract_conductivity()
+            logging.info(f'Ionic conductivity: {self.conductivity:.3e}+-{self.conductivity_std:.3e} S/cm')
+            logging.info(f'Haven ratio: {self.haven_ratio:.3f}+-{self.haven_ratio_std:.3f}')
 
         if plot:
             self.plot_errors = plot_errors
@@ -150,13 +201,13 @@ class AseMsdData(MsdData):
     def get_diffusion_ase(self, timestep):
 
         # convert timesteps in ASE units
-        ase_timestep = timestep*1E3*units.fs
+        ase_timestep = timestep*1E3*ase_units.fs
         # This is mostly for sanity check
-        coeff = DiffusionCoefficient(self.traj, ase_timestep, atom_indices=self.atom_indices)
-        coeff.calculate(ignore_n_images=self.discard_init_steps)
+        coeff = ase_analysis.DiffusionCoefficient(self.traj, ase_timestep, atom_indices=self.atom_indices)
+        coeff.calculate(ignore_n_images=self.lags[self.discard_init_steps])
         slopes, std = coeff.get_diffusion_coefficients()
 
-        conversion_slope = units.fs*1e-1
+        conversion_slope = ase_units.fs*1e-1
         for sym_index in range(coeff.no_of_types_of_atoms):
             print('Mean Diffusion Coefficient (from ASE) : %s = %.3e Å^2/cm; Std. Dev. = %.3e Å^2/cm' %
                   (coeff.types_of_atoms[sym_index], slopes[sym_index] * conversion_slope, std[sym_index] * conversion_slope))
@@ -164,11 +215,19 @@ class AseMsdData(MsdData):
     def compute_msd_from_positions(self):
 
         displacements = np.zeros((self.nframes, self.natoms, 3))
+        if self.charges is not None:
+            charge_displacements = np.zeros((self.nframes, len(self.charge_indices), 3))
+
         for i, frame in enumerate(self.traj):
             displacements[i, :, :] = self.traj[i].get_positions()[self.atom_indices] - self.traj[0].get_positions()[self.atom_indices]
+            if self.charges is not None:
+                charge_displacements[i, :, :] = self.traj[i].get_positions()[self.charge_indices] - self.traj[0].get_positions()[self.charge_indices]
 
         self.msd_atoms = self.compute_atoms_msd(displacements)
         self.msd = np.mean(self.msd_atoms, axis=1)
 
+        if self.charges is not None:
+            self.compute_charge_msd(charge_displacements)
+
 
 
@@ -0,0 +1,163 @@
+import os
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .activation import ActivationEnergyData
+from .lammps_msd import LammpsMsdData
+from .ase_msd import AseMsdData
+from .abinit_msd import HistMsdData
+from ..utils.time import when_is_now
+
+
+class BatchMsdData:
+
+    def __init__(self, manifest, rootname='MsdData', nprocs=None):
+
+        '''
+            Computes the diffusion coefficient for a series of MD runs (typically one per temperature)
+            in parallel, then feeds the results to ActivationEnergyData.
+
+            Input:
+                manifest: list of dictionnaries, or path to a json file containing such a list. One entry per MD run:
+                          "fname" (required): trajectory file
+                          "source": "lammps", "ase" or "hist" (selects LammpsMsdData, AseMsdData or HistMsdData)
+                                    Default: "lammps"
+                          "filetype": LammpsMsdData filetype ("thermo", "dump" or "dump-netcdf")
+                                      Default: "dump-netcdf"
+                          "temperature": MD running temperature (int), passed as input_temperature
+                          "atom_type": diffusing species
+                                       Default: "all"
+                          "rootname": rootname of the output files.
+                                      Default: <rootname>_<index>_<temperature>K, or <rootname>_<index> if there is no temperature.
+                                      Rootnames should be unique.
+                          "options": dictionnary of other arguments for compute_diffusion_coefficient
+                                     (timestep, atomic_numbers, msd_type, discard_init_steps, lag_grid...)
+
+                rootname: rootname used to build the default output names of each job
+                          Default: "MsdData"
+
+                nprocs: number of worker processes
+                        Default: None (one per available core)
+        '''
+
+        if isinstance(manifest, str):
+            if not os.path.exists(manifest):
+                raise FileNotFoundError(f'manifest file {manifest} not found')
+            with open(manifest, 'r') as f:
+                manifest = json.load(f)
+
+        if not manifest:
+            raise ValueError('manifest should not be empty. Please provide a list of MD runs.')
+
+        self.jobs = []
+        for i, entry in enumerate(manifest):
+            self.jobs.append(self.set_job(i, entry, rootname))
+
+        rootnames = [job['rootname'] for job in self.jobs]
+        duplicates = sorted(set(name for name in rootnames if rootnames.count(name) > 1))
+        if duplicates:
+            raise ValueError('Manifest entries should have different rootnames, but I got {} more than once'.format(duplicates))
+
+        self.nprocs = nprocs
+        self.nc_files = [None] * len(self.jobs)
+        self.diffusion_coefficient = [None] * len(self.jobs)
+        self.failed = {}
+
+        logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+
+    def set_job(self, index, entry, rootname):
+
+        if 'fname' not in entry:
+            raise ValueError('Manifest entry {} does not define "fname"'.format(index))
+        if not os.path.exists(entry['fname']):
+            raise FileNotFoundError('Trajectory file {} not found'.format(entry['fname']))
+
+        source = entry.get('source', 'lammps')
+        if source not in ['lammps', 'ase', 'hist']:
+            raise ValueError('source should be "lammps", "ase" or "hist", but I got {}'.format(source))
+
+        job = dict(entry)
+        job['source'] = source
+        job['options'] = dict(entry.get('options', {}))
+
+        if 'rootname' not in job:
+            if 'temperature' in job:
+                job['rootname'] = '{}_{}_{}K'.format(rootname, index, job['temperature'])
+            else:
+                job['rootname'] = '{}_{}'.format(rootname, index)
+
+        return job
+
+
+    def compute_diffusion_coefficients(self):
+
+        ''' Runs all the MSD computations in a process pool and reports progress as jobs complete '''
+
+        njobs = len(self.jobs)
+        logging.info('{}: Launching {} MSD computations...'.format(when_is_now(), njobs))
+
+        with ProcessPoolExecutor(max_workers=self.nprocs) as executor:
+            futures = {executor.submit(run_msd_job, job): i for i, job in enumerate(self.jobs)}
+
+            ndone = 0
+            for future in as_completed(futures):
+                i = futures[future]
+                ndone += 1
+                try:
+                    self.nc_files[i], self.diffusion_coefficient[i] = future.result()
+                except Exception as err:
+                    self.failed[i] = err
+                    logging.warning('{}: [{}/{}] {} failed: {}'.format(when_is_now(), ndone, njobs, self.jobs[i]['fname'], err))
+                else:
+                    logging.info('{}: [{}/{}] {}: D={:.3e} cm^2/s'.format(when_is_now(), ndone, njobs, self.jobs[i]['fname'],
+                                                                           self.diffusion_coefficient[i]))
+
+        if self.failed:
+            logging.warning('{} of {} MSD computations failed: {}'.format(len(self.failed), njobs,
+                            [self.jobs[i]['fname'] for i in sorted(self.failed)]))
+
+        return [fname for fname in self.nc_files if fname is not None]
+
+
+    def compute_activation_energy(self, plot=False, plot_verbose=True, **kwargs):
+
+        ''' Arrhenius fit on the successfully computed diffusion coefficients.
+            Runs the MSD computations first if needed. '''
+
+        if all(fname is None for fname in self.nc_files):
+            self.compute_diffusion_coefficients()
+
+        flist = [fname for fname in self.nc_files if fname is not None]
+        if len(flist) < 2:
+            raise Exception('At least two temperatures are required for the Arrhenius fit, but I got {}'.format(len(flist)))
+
+        self.activation = ActivationEnergyData(flist)
+        self.activation.compute_activation_energy(plot=plot, plot_verbose=plot_verbose, **kwargs)
+
+        return self.activation
+
+
+def run_msd_job(job):
+
+    ''' Worker function for BatchMsdData: computes the diffusion coefficient for a single manifest entry.
+        Defined at module level so that it can be sent to the process pool. '''
+
+    options = dict(job['options'])
+    options.setdefault('atom_type', job.get('atom_type', 'all'))
+    options.setdefault('plot', False)
+
+    if job['source'] == 'lammps':
+        data = LammpsMsdData(job['fname'], job.get('filetype', 'dump-netcdf'), rootname=job['rootname'])
+        if 'temperature' in job and data.filetype != 'thermo':
+            options.setdefault('input_temperature', job['temperature'])
+    elif job['source'] == 'ase':
+        data = AseMsdData(job['fname'], rootname=job['rootname'])
+        if 'temperature' in job:
+            options.setdefault('input_temperature', job['temperature'])
+    elif job['source'] == 'hist':
+        data = HistMsdData(job['fname'], rootname=job['rootname'])
+
+    data.compute_diffusion_coefficient(**options)
+
+    return data.nc_output, data.diffusion
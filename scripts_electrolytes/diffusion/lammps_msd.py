@@ -7,14 +7,16 @@ from ..interfaces.lammps_interface import (
         read_traj_from_ncdump
         )
 from .msd import MsdData
-from ase.md.analysis import DiffusionCoefficient
+from ..utils.lazy import lazy_import
 import logging
 import os
 import warnings
 
+ase_analysis = lazy_import('ase.md.analysis')
+
 class LammpsMsdData(MsdData):
 
-    def __init__(self, fname, filetype, rootname='MsdData'):
+    def __init__(self, fname, filetype, rootname='MsdData', precision='double'):
 
         '''
             Input:
@@ -22,11 +24,16 @@ class LammpsMsdData(MsdData):
 
                 filetype: type of file from which the MSD has to be extracted.
                             "thermo": output of LAMMPS thermo command which includes MSD
-                            "dump": UNWRAPPED LAMMPS trajectory file
-                            "dump-netcdf": similar to "dump" but in netCDF format
+                            "dump": LAMMPS trajectory file (unwrapped positions, or use unwrap=True)
+                            "dump-netcdf": similar to "dump" but in netCDF format. If the file contains only
+                                           wrapped coordinates, they are unwrapped automatically.
 
                 rootname: rootname for the .dat and .nc output files containing the computed information
 
+                precision: floating point precision of the individual atoms MSD in the netCDF output,
+                           "double" or "single" (halves the file size)
+                           Default: "double"
+
         '''
 
         if filetype not in ['thermo', 'dump', 'dump-netcdf']:
@@ -34,14 +41,14 @@ class LammpsMsdData(MsdData):
                                "dump-netcdf", but I got {}'''.format(filetype))
 
         self.filetype = filetype
-        super(LammpsMsdData, self).__init__(fname, rootname)
+        super(LammpsMsdData, self).__init__(fname, rootname, precision)
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
     
     def compute_diffusion_coefficient(self, thermo_fname=None, timestep=None, atom_type='all', atomic_numbers=None, 
                                       msd_type='bare', input_temperature=None, discard_init_steps=0, discard_init_time_ps=None,
-                                      discard_final_steps=None,
-                                      plot=False, plot_errors=False, plot_verbose=True, plot_all_atoms=False, **kwargs):
+                                      discard_final_steps=None, charges=None, unwrap=False,
+                                      lag_grid=None, nlags=100, cache=None, plot=False, plot_errors=False, plot_verbose=True, plot_all_atoms=False, **kwargs):
 
         '''
             thermo_fname: path to the thermo.dat file is already extracted from lammps.log
@@ -72,6 +79,31 @@ class LammpsMsdData(MsdData):
                                 coefficient from the MSD.
                                 Default: None (all steps considered)
 
+            charges: dictionnary of formal charges (in units of e) for each atomic species, i.e. {'Li': 1, 'P': 5, 'S': -2}.
+                     If provided, the collective (center of charge) MSD is accumulated from the same trajectory,
+                     and the ionic conductivity and Haven ratio are computed and written to the output files.
+                     For "dump" and "dump-netcdf" filetypes only.
+                     Default: None (only the diffusion coefficient is computed)
+
+            unwrap: reconstruct continuous trajectories from wrapped positions, using the (possibly triclinic and 
+                    time-dependent) cell of each frame. Requires that atoms move by less than half a cell vector between frames.
+                    For "dump" and "dump-netcdf" filetypes only.
+                    Default: False (positions are assumed to be unwrapped)
+
+            lag_grid: time lags (in number of frames) at which the MSD is computed and stored. For "dump" and "dump-netcdf" filetypes only.
+                      None: all lags (one per frame)
+                      "log": nlags logarithmically spaced lags, which strongly reduces the cost and the output size of long runs
+                      list of integers: user-defined lags
+                      Default: None
+
+            nlags: number of lags for lag_grid="log"
+                   Default: 100
+
+            cache: MsdCache instance (see diffusion/msd_cache.py). If the same trajectory was already processed with the
+                   same MSD parameters, the MSD arrays are retrieved from the cache instead of reading the trajectory again.
+                   For "dump" and "dump-netcdf" filetypes only.
+                   Default: None (no caching)
+
             plot: activate plotting of MSD vs t
 
             plot_errors: plot MSD(T) +- standard deviation on all atoms at each timestep, if available
@@ -95,6 +127,10 @@ class LammpsMsdData(MsdData):
                 raise TypeError('discard_final_steps should be an integer, but I got {} which is a {}'.format(discard_final_steps, type(discard_final_steps)))
 
         if self.filetype == 'thermo':
+            if charges is not None:
+                raise ValueError('Ionic conductivity requires atomic positions, charges can only be used with "dump" or "dump-netcdf" filetypes')
+            if lag_grid is not None:
+                raise ValueError('The MSD from thermo data is already computed by LAMMPS, lag_grid can only be used with "dump" or "dump-netcdf" filetypes')
             if not thermo_fname:
                 thermo_fname = extract_thermo(self.fname)
             self.data_source = 'LAMMPS thermo data'
@@ -106,6 +142,7 @@ class LammpsMsdData(MsdData):
             self.nframes = len(self.msd)
             self.natoms = None
             self.atom_type = 'See lammps input file'
+            self.set_lag_grid()
 
             if plot_all_atoms:
                 warnings.warn('The plot_all_atoms is not available when MSD is retreived from thermo data. Setting to  False')
@@ -153,49 +190,78 @@ class LammpsMsdData(MsdData):
             self.atom_type = atom_type
             logging.info('Will average MSD(T) on {} atoms'.format(self.atom_type))
 
-            logging.info('Extracting trajectories...')
-
             if self.filetype == 'dump':
                 self.data_source = 'LAMMPS .dump file'
-                warnings.warn('Computing diffusion from a LAMMPS text dump file. Make sure the positions are unwrapped.')
-                if discard_final_steps is not None:
-                    self.traj = read_traj_from_dump(self.fname, atomic_numbers, skip_nlast=discard_final_steps)
-                else:
-                    self.traj = read_traj_from_dump(self.fname, atomic_numbers)
-
             elif self.filetype == 'dump-netcdf':
                 self.data_source = 'LAMMPS .dump netCDF file'
-                if discard_final_steps is not None:
-                    self.time, self.traj = read_traj_from_ncdump(self.fname, atomic_numbers, skip_nlast=discard_final_steps)
-                else:
-                    self.time, self.traj = read_traj_from_ncdump(self.fname, atomic_numbers)
-
-            # Discard some initial timesteps
-            #self.traj = self.traj[discard_init_steps:]
-            self.get_atoms_for_diffusion()
 
-            self.nframes = len(self.traj)
-            self.natoms = len(self.atom_indices)
-            logging.info('Computing MSD from atomic positions...')
-            self.compute_msd_from_positions()
-            logging.info('... done!')
+            msd_params = {'atom_type': atom_type, 'atomic_numbers': atomic_numbers, 'msd_type': msd_type, 'timestep': timestep,
+                          'discard_final_steps': discard_final_steps, 'charges': charges, 'unwrap': unwrap,
+                          'lag_grid': lag_grid, 'nlags': nlags}
 
-            if self.filetype == 'dump':
-                self.time = timestep*np.arange(len(self.msd))
-            #elif self.filetype == 'dump-netcdf':
-            #    self.time = self.time[discard_init_steps:]
-            #    self.time -= self.time[0]
+            if cache is not None and self.load_from_cache(cache, msd_params):
+                logging.info('MSD loaded from cache')
+            else:
+                logging.info('Extracting trajectories...')
+
+                if self.filetype == 'dump':
+                    if not unwrap:
+                        warnings.warn('Computing diffusion from a LAMMPS text dump file. Make sure the positions are unwrapped, or use unwrap=True.')
+                    if discard_final_steps is not None:
+                        self.traj = read_traj_from_dump(self.fname, atomic_numbers, skip_nlast=discard_final_steps)
+                    else:
+                        self.traj = read_traj_from_dump(self.fname, atomic_numbers)
+
+                elif self.filetype == 'dump-netcdf':
+                    if discard_final_steps is not None:
+                        self.time, self.traj = read_traj_from_ncdump(self.fname, atomic_numbers, skip_nlast=discard_final_steps)
+                    else:
+                        self.time, self.traj = read_traj_from_ncdump(self.fname, atomic_numbers)
+
+                if unwrap:
+                    logging.info('Unwrapping trajectories...')
+                    self.unwrap_trajectory()
+
+                # Discard some initial timesteps
+                #self.traj = self.traj[discard_init_steps:]
+                self.get_atoms_for_diffusion()
+                if charges is not None:
+                    self.get_charged_atoms(self.traj[0].get_chemical_symbols(), charges)
+                    self.volume = np.mean([frame.get_volume() for frame in self.traj])
+
+                self.nframes = len(self.traj)
+                self.natoms = len(self.atom_indices)
+                self.set_lag_grid(lag_grid, nlags)
+                logging.info('Computing MSD from atomic positions...')
+                self.compute_msd_from_positions()
+                logging.info('... done!')
+
+                if self.filetype == 'dump':
+                    self.time = timestep*self.lags
+                elif self.filetype == 'dump-netcdf':
+                    self.time = self.time[self.lags]
+                #elif self.filetype == 'dump-netcdf':
+                #    self.time = self.time[discard_init_steps:]
+                #    self.time -= self.time[0]
+
+                if cache is not None:
+                    self.save_to_cache(cache)
 
             if discard_init_time_ps:
                 self.discard_init_steps = np.asarray([self.time>=discard_init_time_ps]).nonzero()[1][0]
             else:
-                self.discard_init_steps = discard_init_steps
+                # discard_init_steps is now an index in the lag grid
+                self.discard_init_steps = int(np.searchsorted(self.lags, discard_init_steps))
             # Just curious, does this work?!?
 #            self.coeff = self.get_diffusion_ase(timestep)
 
         self.diffusion = self.extract_diffusion_coefficient()
         self.msd_std = self.extract_msd_errors()
         logging.info(f'Diffusion coefficient: {self.diffusion:.3e}+-{self.diffusion_std:.3e} cm^2/s')
+        if self.charges is not None:
+            self.extract_conductivity()
+            logging.info(f'Ionic conductivity: {self.conductivity:.3e}+-{self.conductivity_std:.3e} S/cm')
+            logging.info(f'Haven ratio: {self.haven_ratio:.3f}+-{self.haven_ratio_std:.3f}')
 
         if plot:
             self.plot_errors = plot_errors
@@ -216,16 +282,24 @@ class LammpsMsdData(MsdData):
 
         # Did not check if this works...
         # It's mostly for sanity check
-        coeff = DiffusionCoefficient(self.traj, timestep)
+        coeff = ase_analysis.DiffusionCoefficient(self.traj, timestep)
 
     def compute_msd_from_positions(self):
 
         displacements = np.zeros((self.nframes, self.natoms, 3))
+        if self.charges is not None:
+            charge_displacements = np.zeros((self.nframes, len(self.charge_indices), 3))
+
         for i, frame in enumerate(self.traj):
             displacements[i, :, :] = self.traj[i].get_positions()[self.atom_indices] - self.traj[0].get_positions()[self.atom_indices]
+            if self.charges is not None:
+                charge_displacements[i, :, :] = self.traj[i].get_positions()[self.charge_indices] - self.traj[0].get_positions()[self.charge_indices]
 
         self.msd_atoms = self.compute_atoms_msd(displacements)
         self.msd = np.mean(self.msd_atoms, axis=1)
 
+        if self.charges is not None:
+            self.compute_charge_msd(charge_displacements)
+
 
 
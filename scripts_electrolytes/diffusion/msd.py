@@ -1,16 +1,24 @@
 import numpy as np
 from ..plotter.colorpalettes import bright
 from ..plotter.msd_plotter import MsdPlotter
-import netCDF4 as nc
+from ..utils import constants
+from ..utils.unwrap import TrajectoryUnwrapper
+from ..utils.lazy import lazy_import
 import os
 
+nc = lazy_import('netCDF4')
+
 class MsdData:
 
     ''' Base class for calculating diffusion coefficient using MSD'''
 
-    def __init__(self, fname, rootname):
+    def __init__(self, fname, rootname, precision='double'):
+
+        if precision not in ['double', 'single']:
+            raise ValueError('precision should be either "double" or "single", but I got {}'.format(precision))
 
         self.fname = fname
+        self.precision = precision
         self.nc_output = str('OUT/'+rootname+'.nc')
         self.output = str('OUT/'+rootname+'.dat')
         try:
@@ -19,30 +27,113 @@ class MsdData:
             pass
 
         self.my_atoms = []
+        self.charges = None
+
+
+    def set_lag_grid(self, lag_grid=None, nlags=100):
+        '''
+            Define the time lags (in number of frames) at which the MSD is evaluated and stored.
+
+            lag_grid: None: all lags from 0 to nframes-1
+                      "log": nlags logarithmically spaced lags between 1 and nframes-1, plus lag 0
+                      list of integers: user-defined lags
+        '''
+        if lag_grid is None:
+            self.lag_grid = 'full'
+            self.lags = np.arange(self.nframes)
+        elif isinstance(lag_grid, str):
+            if lag_grid != 'log':
+                raise ValueError('lag_grid should be None, "log" or a list of integer lags, but I got {}'.format(lag_grid))
+            if not isinstance(nlags, int) or nlags < 1:
+                raise ValueError('nlags should be a positive integer, but I got {}'.format(nlags))
+            self.lag_grid = 'log'
+            lags = np.rint(np.geomspace(1, max(self.nframes-1, 1), num=nlags)).astype(int)
+            self.lags = np.unique(np.concatenate(([0], lags)))
+        else:
+            self.lag_grid = 'custom'
+            self.lags = np.unique(np.asarray(lag_grid, dtype=int))
+            if self.lags[0] < 0 or self.lags[-1] >= self.nframes:
+                raise ValueError('lag_grid values should be between 0 and nframes-1={}, but I got {}'.format(self.nframes-1, lag_grid))
 
 
     def compute_atoms_msd(self, displacements):
         '''
-            Compute MSD for targeted atoms.
+            Compute MSD for targeted atoms, at each time lag in self.lags.
 
             Options:
                 timesliced: this will average each atom's MSD at timestep t on all equivalent timeslices equal to t
                 bare: no timeslice averaging is done.
         '''
-        msd_atoms = np.zeros((self.nframes, self.natoms))
+        msd_atoms = np.zeros((len(self.lags), np.shape(displacements)[1]))
         if self.msd_type == 'timesliced':
-            for t in range(self.nframes):
-                if t%1000 == 0:
+            for i, t in enumerate(self.lags):
+                if i%1000 == 0:
                     print('Treating time interval {}'.format(t))
+                # All time origins and all atoms are treated at once for a given lag
                 arr = displacements[t:, :, :] - displacements[:(self.nframes-t), :, :]
-                msd_atoms[t, :] = np.mean(np.einsum('fad, fad -> fa', arr, arr), axis=0)
+                msd_atoms[i, :] = np.mean(np.einsum('fad, fad -> fa', arr, arr), axis=0)
 
         elif self.msd_type == 'bare':
-            msd_atoms = np.einsum('fad, fad -> fa', displacements, displacements)
+            arr = displacements[self.lags, :, :]
+            msd_atoms = np.einsum('fad, fad -> fa', arr, arr)
 
         return msd_atoms
 
 
+    def load_from_cache(self, cache, params):
+        '''
+            Retrieve the MSD arrays from a MsdCache instance.
+            Returns True on a cache hit, False otherwise (the key is kept for save_to_cache).
+        '''
+        self.cache_key = cache.make_key(self.fname, params)
+        data = cache.get(self.cache_key)
+        if data is None:
+            return False
+
+        self.nframes = int(data['nframes'])
+        self.natoms = int(data['natoms'])
+        self.lag_grid = str(data['lag_grid'])
+        self.lags = data['lags']
+        self.time = data['time']
+        self.msd = data['msd']
+        self.msd_atoms = data['msd_atoms']
+
+        if 'msd_charge' in data:
+            self.charges = params['charges']
+            self.msd_charge = data['msd_charge']
+            self.msd_charge_self = data['msd_charge_self']
+            self.volume = float(data['volume'])
+
+        return True
+
+
+    def save_to_cache(self, cache):
+
+        arrays = {'nframes': self.nframes, 'natoms': self.natoms, 'lag_grid': self.lag_grid, 'lags': self.lags,
+                  'time': self.time, 'msd': self.msd, 'msd_atoms': self.msd_atoms}
+        if self.charges is not None:
+            arrays.update({'msd_charge': self.msd_charge, 'msd_charge_self': self.msd_charge_self, 'volume': self.volume})
+
+        cache.put(self.cache_key, {key: np.asarray(val) for key, val in arrays.items()})
+
+
+    def unwrap_trajectory(self, block_size=1000):
+        '''
+            Unwraps inplace the positions of the ASE Atoms objects in self.traj,
+            using the cell of each frame (triclinic and NPT cells are supported).
+            Frames are treated by blocks of block_size to limit memory usage.
+        '''
+        unwrapper = TrajectoryUnwrapper()
+
+        for start in range(0, len(self.traj), block_size):
+            block = self.traj[start:start+block_size]
+            frac = np.asarray([frame.get_scaled_positions(wrap=False) for frame in block])
+            cells = np.asarray([np.asarray(frame.get_cell()) for frame in block])
+
+            for frame, positions in zip(block, unwrapper.unwrap(frac, cells)):
+                frame.set_positions(positions)
+
+
     def extract_diffusion_coefficient(self):
 
         # FIX ME: from here, classes should already have a time and msd property
@@ -58,6 +149,67 @@ class MsdData:
         return self.diffusion
 
 
+    def get_charged_atoms(self, symbols, charges):
+        '''
+            Select the atoms contributing to the collective (charge) MSD.
+
+            symbols: chemical symbols of all the atoms in the configuration
+            charges: dictionnary of formal charges, in units of e, i.e. {'Li': 1, 'S': -2}.
+                     Species that are not in the dictionnary are considered neutral.
+        '''
+
+        if not isinstance(charges, dict):
+            raise TypeError('charges should be a dictionnary, but I got a {}'.format(type(charges)))
+
+        self.charge_indices = [i for i, symbol in enumerate(symbols) if charges.get(str(symbol), 0) != 0]
+        if not self.charge_indices:
+            raise ValueError('Did not find any charged species from {} in symbols {}'.format(list(charges.keys()), set(symbols)))
+        self.charge_values = np.asarray([charges[str(symbols[i])] for i in self.charge_indices], dtype=float)
+        self.charges = charges
+
+
+    def compute_charge_msd(self, charge_displacements):
+        '''
+            Compute the collective MSD of the center of charge, |sum_i q_i dr_i(t)|^2, as well as 
+            its self part sum_i q_i^2 |dr_i(t)|^2, which gives the Nernst-Einstein conductivity.
+            Both are processed with the same msd_type as the individual atoms MSD.
+        '''
+        collective = np.einsum('a, fad -> fd', self.charge_values, charge_displacements)
+        self.msd_charge = self.compute_atoms_msd(collective[:, np.newaxis, :])[:, 0]
+
+        if self.charge_indices == list(self.atom_indices):
+            msd_atoms = self.msd_atoms
+        else:
+            msd_atoms = self.compute_atoms_msd(charge_displacements)
+        self.msd_charge_self = np.einsum('a, fa -> f', self.charge_values**2, msd_atoms)
+
+
+    def extract_conductivity(self):
+        '''
+            Ionic conductivity from the slope of the collective MSD,
+            sigma = e^2/(6 V kB T) d/dt <|sum_i q_i dr_i(t)|^2>,
+            fitted on the same time window as the diffusion coefficient.
+            The Haven ratio is the ratio of the Nernst-Einstein conductivity to sigma.
+        '''
+
+        # Angstrom^2/ps -> m^2/s, Angstrom^3 -> m^3 and S/m -> S/cm
+        prefactor = constants.elementary_charge**2*1E-8/(6*self.volume*1E-30*constants.boltzmann_JK*self.temperature)*1E-2
+
+        slope, cov = np.polyfit(self.time[self.discard_init_steps:], self.msd_charge[self.discard_init_steps:], 1, cov=True)
+        self.conductivity = prefactor*slope[0]
+        self.conductivity_std = prefactor*np.sqrt(np.diag(cov)[0])
+
+        slope, cov = np.polyfit(self.time[self.discard_init_steps:], self.msd_charge_self[self.discard_init_steps:], 1, cov=True)
+        self.conductivity_ne = prefactor*slope[0]
+        self.conductivity_ne_std = prefactor*np.sqrt(np.diag(cov)[0])
+
+        self.haven_ratio = self.conductivity_ne/self.conductivity
+        self.haven_ratio_std = np.abs(self.haven_ratio)*np.sqrt((self.conductivity_std/self.conductivity)**2 +
+                                                                (self.conductivity_ne_std/self.conductivity_ne)**2)
+
+        return self.conductivity
+
+
     def extract_msd_errors(self):
 
         if self.msd_atoms is not None:
@@ -71,21 +223,25 @@ class MsdData:
         myplot = MsdPlotter(**kwargs) 
         myplot.set_line2d_params(**kwargs)
 
-        y = self.slope[0]*self.time + self.slope[1]
+        # Long MSD(t) are downsampled if max_points is set (default in fast mode)
+        idx = myplot.downsample_indices(self.time, self.msd)
+        time = self.time[idx]
+        y = self.slope[0]*time + self.slope[1]
 
         if plot_all_atoms:
-            for a in range(self.natoms):
-                myplot.ax.plot(self.time, self.msd_atoms[:, a], linewidth=0.5*myplot.linewidth, linestyle='solid', alpha=0.6)
-            myplot.ax.plot(self.time, self.msd, color='black', linewidth=1.5*myplot.linewidth, linestyle='solid')
-            myplot.ax.plot(self.time, y, color=bright['red'], linewidth=1.5*myplot.linewidth, linestyle='dashed')
+            # All atoms in a single LineCollection
+            myplot.plot_curves(self.time, self.msd_atoms, linewidth=0.5*myplot.linewidth, linestyle='solid', alpha=0.6)
+            myplot.ax.plot(time, self.msd[idx], color='black', linewidth=1.5*myplot.linewidth, linestyle='solid')
+            myplot.ax.plot(time, y, color=bright['red'], linewidth=1.5*myplot.linewidth, linestyle='dashed')
         else:
-            myplot.ax.plot(self.time, self.msd, color=bright['blue'], linewidth=myplot.linewidth, linestyle='solid')
-            myplot.ax.plot(self.time, y, color=bright['red'], linewidth=myplot.linewidth, linestyle='dashed')
+            myplot.ax.plot(time, self.msd[idx], color=bright['blue'], linewidth=myplot.linewidth, linestyle='solid')
+            myplot.ax.plot(time, y, color=bright['red'], linewidth=myplot.linewidth, linestyle='dashed')
 
             # FIX ME: this is a little crude, as msd-msd_std can be negative
             # Plotting the MSD-std makes only sense if we do not plot individual trajectories :P
             if self.msd_std is not None and self.plot_errors:
-                myplot.ax.fill_between(self.time, self.msd-self.msd_std, self.msd+self.msd_std, color='gray', zorder=-1, alpha=0.3)
+                msd, msd_std = self.msd[idx], self.msd_std[idx]
+                myplot.ax.fill_between(time, msd-msd_std, msd+msd_std, color='gray', zorder=-1, alpha=0.3)
 
         if verbose:
             myplot.ax.text(0.10, 0.90, r'D={:.3e} cm$^2$/s'.format(self.diffusion), fontsize=myplot.labelsize+2, transform=myplot.ax.transAxes)
@@ -99,6 +255,14 @@ class MsdData:
         myplot.show_figure()
 
 
+    @property
+    def msd_atoms_dtype(self):
+        if self.precision == 'single':
+            return 'f'
+        else:
+            return 'd'
+
+
     def write_data(self):
 
         self.write_output()
@@ -109,12 +273,18 @@ class MsdData:
         with nc.Dataset(self.nc_output, 'w') as dts:
 
             dts.createDimension('number_of_frames', self.nframes)
+            dts.createDimension('number_of_lags', len(self.lags))
             dts.createDimension('number_of_diffusing_atoms', self.natoms)
             dts.createDimension('one', 1)
 
             dts.setncattr('diffusing_atom_type', self.atom_type)
             dts.setncattr('msd_type', self.msd_type)
             dts.setncattr('data_source', self.data_source)
+            dts.setncattr('lag_grid', self.lag_grid)
+
+            data = dts.createVariable(
+                    'lag_frames', 'i', ('number_of_lags'))
+            data[:] = self.lags
 
             data = dts.createVariable(
                     'temperature', 'd', ('one'))
@@ -127,7 +297,7 @@ class MsdData:
             data[:] = self.diffusion
 
             data = dts.createVariable(
-                    'time', 'd', ('number_of_frames'))
+                    'time', 'd', ('number_of_lags'))
             data.units = 'picosecond'
             data[:] = self.time
 
@@ -147,28 +317,78 @@ class MsdData:
             try:
                 data[:] = self.thermo_step * self.discard_init_steps
             except AttributeError:
-                data[:] = self.timestep * self.discard_init_steps
+                data[:] = self.timestep * self.lags[self.discard_init_steps]
 
             data = dts.createVariable(
                     'mean_squared_displacement', 'd',
-                    ('number_of_frames'))
+                    ('number_of_lags'))
             data.units = 'Angstrom^2'
             data[:] = self.msd
 
-            data = dts.createVariable(
-                    'mean_squared_displacement_individual_atoms', 'd',
-                    ('number_of_frames', 'number_of_diffusing_atoms'))
-            data.units = 'Angstrom^2'
             if self.msd_atoms is not None:
+                # One chunk per atom, so that individual atoms MSD can be read without loading the full array
+                data = dts.createVariable(
+                        'mean_squared_displacement_individual_atoms', self.msd_atoms_dtype,
+                        ('number_of_lags', 'number_of_diffusing_atoms'),
+                        zlib=True, complevel=4, shuffle=True, chunksizes=(min(len(self.lags), 262144), 1))
+                data.units = 'Angstrom^2'
                 data[:, :] = self.msd_atoms
 
             data = dts.createVariable(
                     'standard_deviation_mean_squared_displacement', 'd',
-                    ('number_of_frames'))
+                    ('number_of_lags'))
             data.units = 'Angstrom^2'
             if self.msd_std is not None:
                 data[:] = self.msd_std
 
+            if self.charges is not None:
+                dts.setncattr('charges', str(self.charges))
+
+                data = dts.createVariable(
+                        'cell_volume', 'd', ('one'))
+                data.units = 'Angstrom^3'
+                data[:] = self.volume
+
+                data = dts.createVariable(
+                        'charge_mean_squared_displacement', 'd',
+                        ('number_of_lags'))
+                data.units = 'e^2 Angstrom^2'
+                data[:] = self.msd_charge
+
+                data = dts.createVariable(
+                        'charge_mean_squared_displacement_self', 'd',
+                        ('number_of_lags'))
+                data.units = 'e^2 Angstrom^2'
+                data[:] = self.msd_charge_self
+
+                data = dts.createVariable(
+                        'ionic_conductivity', 'd', ('one'))
+                data.units = 'S/cm'
+                data[:] = self.conductivity
+
+                data = dts.createVariable(
+                        'ionic_conductivity_std', 'd', ('one'))
+                data.units = 'S/cm'
+                data[:] = self.conductivity_std
+
+                data = dts.createVariable(
+                        'nernst_einstein_conductivity', 'd', ('one'))
+                data.units = 'S/cm'
+                data[:] = self.conductivity_ne
+
+                data = dts.createVariable(
+                        'nernst_einstein_conductivity_std', 'd', ('one'))
+                data.units = 'S/cm'
+                data[:] = self.conductivity_ne_std
+
+                data = dts.createVariable(
+                        'haven_ratio', 'd', ('one'))
+                data[:] = self.haven_ratio
+
+                data = dts.createVariable(
+                        'haven_ratio_std', 'd', ('one'))
+                data[:] = self.haven_ratio_std
+
 
     def write_output(self):
 
@@ -181,9 +401,15 @@ class MsdData:
             try:
                 f.write('Initial {} ps has been discarded\n'.format(self.discard_init_steps*self.thermo_step))
             except AttributeError:
-                f.write('Initial {} ps has been discarded\n'.format(self.discard_init_steps*self.timestep))
+                f.write('Initial {} ps has been discarded\n'.format(self.lags[self.discard_init_steps]*self.timestep))
 
             f.write('Diffusing atoms type: {}\n'.format(self.atom_type))
             f.write('MSD type: {}\n'.format(self.msd_type))
+            f.write('Lag grid: {} ({} lags)\n'.format(self.lag_grid, len(self.lags)))
             f.write('Diffusion coefficient: {:.5e} cm^2/s\n'.format(self.diffusion))
+            if self.charges is not None:
+                f.write('Charges: {}\n'.format(self.charges))
+                f.write('Ionic conductivity: {:.5e} +- {:.5e} S/cm\n'.format(self.conductivity, self.conductivity_std))
+                f.write('Nernst-Einstein conductivity: {:.5e} +- {:.5e} S/cm\n'.format(self.conductivity_ne, self.conductivity_ne_std))
+                f.write('Haven ratio: {:.4f} +- {:.4f}\n'.format(self.haven_ratio, self.haven_ratio_std))
         f.close()
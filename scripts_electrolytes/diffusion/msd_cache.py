@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+class MsdCache:
+
+    def __init__(self, cachedir='OUT/msd_cache', max_size=2.0, hash_content=False):
+
+        '''
+            Content-addressed cache for the MSD arrays computed by MsdData.
+
+            Entries are keyed by the identity of the trajectory file and by the parameters which affect the MSD
+            (species, msd_type, discarded final steps, lag grid...), so changing only the fit window or the
+            plotting options reuses the cached arrays instead of reading the trajectory again.
+
+            Input:
+                cachedir: directory where cache entries are stored
+                          Default: "OUT/msd_cache"
+
+                max_size: maximal total size of the cache, in GB. Least recently used entries are removed
+                          when it is exceeded.
+                          Default: 2.0
+
+                hash_content: identify trajectory files by the SHA-256 hash of their content instead of
+                              their path, size and modification time. Slower for large files, but robust to
+                              files being moved or touched.
+                              Default: False
+        '''
+
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.hash_content = hash_content
+        os.makedirs(self.cachedir, exist_ok=True)
+
+
+    def file_identity(self, fname):
+
+        stat = os.stat(fname)
+        if self.hash_content:
+            sha = hashlib.sha256()
+            with open(fname, 'rb') as f:
+                for block in iter(lambda: f.read(2**24), b''):
+                    sha.update(block)
+            return {'size': stat.st_size, 'sha256': sha.hexdigest()}
+        else:
+            return {'path': os.path.abspath(fname), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+    def make_key(self, fname, params):
+
+        # Arrays are hashed element by element: their str() is truncated beyond 1000 elements
+        content = json.dumps({'file': self.file_identity(fname), 'params': normalize_params(params)}, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+    def entry_path(self, key):
+        return os.path.join(self.cachedir, '{}.npz'.format(key))
+
+
+    def get(self, key):
+
+        ''' Returns a dictionnary of arrays, or None if the key is not in the cache '''
+
+        path = self.entry_path(key)
+        if not os.path.exists(path):
+            return None
+
+        # Mark as recently used for LRU eviction
+        os.utime(path)
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+
+    def put(self, key, arrays):
+
+        ''' Stores a dictionnary of arrays. The entry is written to a temporary file and moved in place,
+            so that an interrupted write never leaves a corrupted entry. '''
+
+        path = self.entry_path(key)
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+        self.evict()
+
+
+    def evict(self):
+
+        entries = [os.path.join(self.cachedir, fname) for fname in os.listdir(self.cachedir) if fname.endswith('.npz')]
+        entries.sort(key=os.path.getmtime)
+
+        total = sum(os.path.getsize(entry) for entry in entries)
+        while entries and total > self.max_size*1E9:
+            oldest = entries.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+
+    def clear(self):
+
+        for fname in os.listdir(self.cachedir):
+            if fname.endswith('.npz'):
+                os.remove(os.path.join(self.cachedir, fname))
+
+
+def normalize_params(value):
+
+    ''' Converts the parameters of a cache entry (dictionnaries, lists, numpy arrays and scalars) to plain json types '''
+
+    if isinstance(value, dict):
+        return {str(key): normalize_params(val) for key, val in value.items()}
+    if isinstance(value, np.ndarray):
+        return normalize_params(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [normalize_params(val) for val in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError('Cannot use a parameter of type {} in a MSD cache key: {}'.format(type(value).__name__, value))
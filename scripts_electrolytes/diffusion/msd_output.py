@@ -1,11 +1,41 @@
 import numpy as np
-import netCDF4 as nc
 import os
-from pymatgen.io.abinit.netcdf import NetcdfReader
+from concurrent.futures import ProcessPoolExecutor
 from ..plotter.msd_plotter import MsdPlotter, DCPlotter
 from ..plotter.colorpalettes import bright
+from ..plotter.decimation import lttb_indices
 from ..utils.functions import sort_consecutive_groups
-from matplotlib.pyplot import subplots
+from ..utils.lazy import lazy_import
+
+nc = lazy_import('netCDF4')
+pmg_netcdf = lazy_import('pymatgen.io.abinit.netcdf')
+plt = lazy_import('matplotlib.pyplot')
+
+
+class LazyMsdAtoms:
+
+    ''' Read-only, netCDF-backed view on the individual atoms MSD written by MsdData.
+        Only the requested slices are read from disk, i.e. msd_atoms[:, a] reads a single atom. '''
+
+    def __init__(self, fname, varname='mean_squared_displacement_individual_atoms'):
+
+        self.dataset = nc.Dataset(fname, 'r')
+        self.variable = self.dataset.variables[varname]
+        self.variable.set_auto_mask(False)
+        self.shape = self.variable.shape
+
+    def __getitem__(self, key):
+        return np.asarray(self.variable[key], dtype=float)
+
+    def __array__(self, dtype=None):
+        # Loads the full array, only when explicitly converted with np.asarray
+        return np.asarray(self.variable[:, :], dtype=dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def close(self):
+        self.dataset.close()
 
 
 class MsdOutput:
@@ -25,16 +55,34 @@ class MsdOutput:
             else:
                 self.fname = fname
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+
+        ''' Closes the netCDF file opened by read_data(mode="msd_atoms") for the individual atoms MSD '''
+
+        if getattr(self, 'msd_atoms', None) is not None:
+            self.msd_atoms.close()
+            self.msd_atoms = None
+
     def read_data(self, mode='diffusion'):
 
         ''' Mode: defines the amount of data that will be read.
                 "diffusion": read only temperature, diffusion coefficient and msd_type
-                "msd": read the above, plus time, timestep and averaged MSD(t)
-                "msd_atoms": reads all the above, plus individual atoms msd
+                "msd": read the above, plus time, timestep, time lags and averaged MSD(t)
+                "msd_atoms": reads all the above, plus individual atoms msd. The latter is a lazy view on the
+                             netCDF file: data for a given atom is only read when accessed, i.e. msd_atoms[:, a]
                 Default: "diffusion"
         '''
 
-        reader = NetcdfReader(self.fname)
+        # A previous lazy view would otherwise keep its file open
+        self.close()
+
+        reader = pmg_netcdf.NetcdfReader(self.fname)
         self.temp = reader.read_value('temperature')[0]
         self.coeff = reader.read_value('diffusion_coefficient')[0]
         self.msd_type = reader.rootgrp.getncattr('msd_type')
@@ -45,12 +93,23 @@ class MsdOutput:
             self.time = reader.read_value('time')
             self.timestep = reader.read_value('timestep')[0]
             self.msd = reader.read_value('mean_squared_displacement')
+            # Files written before the lag grid option contain one lag per frame
+            try:
+                self.lags = reader.read_value('lag_frames')
+                self.lag_grid = reader.rootgrp.getncattr('lag_grid')
+            except Exception:
+                self.lags = np.arange(len(self.time))
+                self.lag_grid = 'full'
 
             if mode == 'msd_atoms':
                 self.natoms = reader.read_dimvalue('number_of_diffusing_atoms')
-                self.msd_atoms = reader.read_value('mean_squared_displacement_individual_atoms')
+                if 'mean_squared_displacement_individual_atoms' in reader.rootgrp.variables:
+                    self.msd_atoms = LazyMsdAtoms(self.fname)
+                else:
+                    self.msd_atoms = None
 
-    def extract_atomic_jumps(self, threshold=4.0, plot=False, dist2=2.0, **kwargs):
+    def extract_atomic_jumps(self, threshold=4.0, plot=False, dist2=2.0, atoms=None, panels_per_page=None, nprocs=None,
+                             **kwargs):
 
         ''' Locate possible atomic jumps in individual atoms MSD(t),
             i.e. values of MSD(t) that are larger than the threshold value.
@@ -66,14 +125,31 @@ class MsdOutput:
                    jump is detected.
                    Default: 2.0 angstrom^2
 
+            atoms: list of atom indices (in the diffusing atoms) to analyse. Only these atoms are read from the netCDF file.
+                   Default: None (all diffusing atoms)
+
+            panels_per_page: if set, the jumping atoms are plotted as pages of panels_per_page panels
+                             (figures/msd_jumps_<page>.png), rendered in parallel in fast mode (see plot_jump_pages),
+                             instead of one figure per atom.
+                             Default: None (one figure per atom)
+
+            nprocs: number of worker processes rendering the pages
+                    Default: None (one per available core)
+
             FIX ME: I will also need to add a diff_threshold so that I can compare the jump with the average MSD
             over the last N steps (to locate single jumps, not all timesteps where MSD
             is larger than threshold)
         '''
 
+        if getattr(self, 'msd_atoms', None) is None:
+            raise ValueError('File {} does not contain individual atoms MSD. Use read_data(mode="msd_atoms") first.'.format(self.fname))
+        if atoms is None:
+            atoms = range(self.natoms)
+
         jumping_atoms_list = []
+        jumps = {}
 
-        for a in range(self.natoms):
+        for a in atoms:
             mymsd = self.msd_atoms[:, a]
             if any(mymsd > threshold):
                 # or a condition with a mean?
@@ -91,20 +167,25 @@ class MsdOutput:
                 print('\nFound jumps in atom {}, between timesteps {}-{}'.format(a, start, end))
 
                 jumping_atoms_list.append(a)
-                if plot:
+                jumps[a] = start
+                if plot and not panels_per_page:
                     self.plot_msd_atom(a, threshold, start, **kwargs)
         print('Found jumps in atoms:{}'.format(jumping_atoms_list))
 
+        if plot and panels_per_page and jumps:
+            self.plot_jump_pages(jumps, threshold, panels_per_page=panels_per_page, nprocs=nprocs, **kwargs)
+
     def plot_msd_atom(self, index, href, vref, **kwargs):
 
         myplot = MsdPlotter(figsize=(12, 4), **kwargs)
         myplot.set_line2d_params(defname='msd_atom{}.png'.format(index), title='Atom {}'.format(index),
                                  xlim=(0, self.time[-1]), **kwargs)
-        myplot.ax.plot(self.time, self.msd_atoms[:, index], color='k')
+        msd = self.msd_atoms[:, index]
+        idx = myplot.downsample_indices(self.time, msd)
+        myplot.ax.plot(self.time[idx], msd[idx], color='k')
         myplot.ax.axhline(href, linestyle='dashed', color='blue')
         if len(vref) != 0:
-            for val in vref:
-                myplot.ax.axvline(val*self.timestep, linestyle='dashed', color='red')
+            myplot.ax.vlines(self.time[vref], 0, 1, transform=myplot.ax.get_xaxis_transform(), linestyle='dashed', color='red')
 
         myplot.fig.subplots_adjust(bottom=0.15)
         myplot.set_labels()
@@ -117,12 +198,60 @@ class MsdOutput:
         myplot.save_figure()
         myplot.show_figure()
 
+    def plot_jump_pages(self, jumps, threshold, panels_per_page=6, nprocs=None, **kwargs):
+
+        '''
+            Plots MSD(t) of the jumping atoms as multi-panel pages, figures/msd_jumps_<page>.png, which are rendered
+            concurrently in worker processes. Pages are rendered in fast mode (mathtext, no display) unless fast=False
+            is given, and each MSD(t) is downsampled to max_points before being sent to the workers.
+
+            Input:
+                jumps: dictionnary {atom index: list of jump timesteps}, as found by extract_atomic_jumps
+
+                threshold: threshold MSD value, drawn as an horizontal line
+
+                panels_per_page: number of atoms per page
+                                 Default: 6
+
+                nprocs: number of worker processes
+                        Default: None (one per available core)
+
+            Returns the list of figure names.
+        '''
+
+        kwargs = dict(kwargs)
+        kwargs.setdefault('fast', True)
+        kwargs.setdefault('max_points', 2000)
+        kwargs['showfig'] = False
+
+        atoms = sorted(jumps)
+        pages = []
+        for first in range(0, len(atoms), panels_per_page):
+            panels = []
+            for a in atoms[first:first+panels_per_page]:
+                msd = self.msd_atoms[:, a]
+                idx = lttb_indices(self.time, msd, kwargs['max_points']) if kwargs['max_points'] else np.arange(len(msd))
+                panels.append({'atom': a, 'time': self.time[idx], 'msd': msd[idx], 'jumps': self.time[jumps[a]]})
+            pages.append(panels)
+
+        fignames = ['msd_jumps_{}.png'.format(p) for p in range(len(pages))]
+        with ProcessPoolExecutor(max_workers=nprocs) as executor:
+            futures = [executor.submit(render_jump_page, figname, panels, threshold, self.time[-1], kwargs)
+                       for figname, panels in zip(fignames, pages)]
+            for future in futures:
+                future.result()
+
+        return fignames
+
     def diffusion_coefficient_from_slices(self, plot=True, **kwargs):
 
         ''' Computes the diffusion coefficient as an average on non-overlapping slices
             of size delta t in [1, time[-1]] '''
 
         self.read_data(mode='msd')
+        if self.lag_grid != 'full':
+            raise ValueError('diffusion_coefficient_from_slices requires the MSD at every timestep, but {} has a {} lag grid'.format(
+                             self.fname, self.lag_grid))
         nsteps = len(self.time)
 
         self.deltat = []
@@ -169,7 +298,7 @@ class MsdOutput:
 
     def plot_diffusion_from_slices(self, **kwargs):
 
-        fig, ax = subplots(1, 2, figsize=(12, 6))
+        fig, ax = plt.subplots(1, 2, figsize=(12, 6))
         for j in range(2):
             myplot = DCPlotter(ax=ax[j], **kwargs) 
             myplot.set_line2d_params(defname='diffusion_deltat.png', **kwargs)
@@ -232,7 +361,8 @@ class MsdOutput:
         if discard_init_time_ps:
             self.discard_init_steps = np.asarray([self.time>=discard_init_time_ps]).nonzero()[1][0]
         else:
-            self.discard_init_steps = discard_init_steps
+            # index of the first lag to keep in the (possibly sparse) lag grid
+            self.discard_init_steps = int(np.searchsorted(self.lags, discard_init_steps))
 
         if not rootname:
             if discard_init_time_ps:
@@ -259,7 +389,9 @@ class MsdOutput:
         myplot = MsdPlotter(**kwargs)
         myplot.set_line2d_params(defname='diffusion.png', **kwargs)
 
-        y = self.slope[0]*self.time + self.slope[1]
+        idx = myplot.downsample_indices(self.time, self.msd)
+        time = self.time[idx]
+        y = self.slope[0]*time + self.slope[1]
 
         if myplot.linecolor:
             color = myplot.linecolor
@@ -271,8 +403,8 @@ class MsdOutput:
         else:
             fitcolor = 'black'
 
-        myplot.ax.plot(self.time, self.msd, color=color, linewidth=1.0, linestyle='solid')
-        myplot.ax.plot(self.time, y, color=myplot.fitcolor, linewidth=myplot.linewidth, linestyle='dashed')
+        myplot.ax.plot(time, self.msd[idx], color=color, linewidth=1.0, linestyle='solid')
+        myplot.ax.plot(time, y, color=myplot.fitcolor, linewidth=myplot.linewidth, linestyle='dashed')
 
         if self.discard_init_steps != 0:
             myplot.ax.axvline(self.time[self.discard_init_steps], color='black', linestyle='dashed', linewidth=0.5)
@@ -347,3 +479,30 @@ class MsdOutput:
             f.write('MSD type: {}\n'.format(self.msd_type))
             f.write('Diffusion coefficient: {:.5e} cm^2/s\n'.format(self.coeff))
         f.close()
+
+
+def render_jump_page(figname, panels, threshold, tmax, kwargs):
+
+    ''' Worker function for MsdOutput.plot_jump_pages: draws one page of MSD(t) panels and saves it as figures/<figname>.
+        Defined at module level so that it can be sent to the process pool. '''
+
+    # Workers never display figures
+    plt.switch_backend('agg')
+    kwargs = {key: value for key, value in kwargs.items() if key not in ['ax', 'figsize', 'figname', 'defname', 'title', 'xlim']}
+
+    fig, axes = plt.subplots(len(panels), 1, figsize=(12, 3*len(panels)), squeeze=False)
+    for ax, panel in zip(axes[:, 0], panels):
+        myplot = MsdPlotter(ax=ax, **kwargs)
+        myplot.set_line2d_params(defname=figname, title='Atom {}'.format(panel['atom']), xlim=(0, tmax), **kwargs)
+        myplot.ax.plot(panel['time'], panel['msd'], color='k')
+        myplot.ax.axhline(threshold, linestyle='dashed', color='blue')
+        myplot.ax.vlines(panel['jumps'], 0, 1, transform=myplot.ax.get_xaxis_transform(), linestyle='dashed', color='red')
+        myplot.set_labels()
+        myplot.set_limits()
+        myplot.add_title()
+
+    fig.subplots_adjust(hspace=0.5)
+    myplot.save_figure()
+    plt.close(fig)
+
+    return figname
@@ -1,15 +1,17 @@
-from abipy.dynamics.hist import HistFile
-from abipy.core.structure import Structure
-from ..utils.constants import ha_to_ev, bohr_to_ang
+from ..utils.lazy import lazy_import
+from ..utils import constants
 from ..database.db_creator import MtpDbCreator, AseDbCreator
 #from scripts_electrolytes.utils.constants import ha_to_ev, bohr_to_ang
 
+abihist = lazy_import('abipy.dynamics.hist')
+abistructure = lazy_import('abipy.core.structure')
+
 ''' Small utilities to work with Abinit output files'''
 
 
 def extract_config_from_hist(fname, idx=0):
 
-    hist = HistFile(fname)
+    hist = abihist.HistFile(fname)
     structs = hist.structures
 
     return structs[idx]
@@ -29,7 +31,7 @@ def extract_neb_trajectory(fname, fmt=None, output='neb'):
     if not fmt:
         raise ValueError('Database output format unspecified. Choose fmt = "mtp" or fmt = "ase".')
 
-    hist = HistFile(fname)
+    hist = abihist.HistFile(fname)
 
     structures = read_relaxed_neb_structures(hist)
     energy, forces, stresses = read_neb_efs(hist)
@@ -71,7 +73,7 @@ def read_relaxed_neb_structures(data):
     structures = []
 
     for img in range(nimage):
-        s = Structure.from_abivars(
+        s = abistructure.Structure.from_abivars(
                 xred=xred[-1, img],
                 rprim=rprimd[-1, img],
                 acell=3 * [1.0],
@@ -85,8 +87,8 @@ def read_relaxed_neb_structures(data):
 
 def read_neb_efs(data):
 
-    e = data.reader.read_value('etotal')[-1, :] * ha_to_ev  # in eV
-    f = data.reader.read_value('fcart')[-1, :, :, :] * ha_to_ev/bohr_to_ang  # in eV/ang
-    s = data.reader.read_value('strten')[-1, :, :] * ha_to_ev/(bohr_to_ang**3)  # in eV/ang^3
+    e = data.reader.read_value('etotal')[-1, :] * constants.ha_to_ev  # in eV
+    f = data.reader.read_value('fcart')[-1, :, :, :] * constants.ha_to_ev/constants.bohr_to_ang  # in eV/ang
+    s = data.reader.read_value('strten')[-1, :, :] * constants.ha_to_ev/(constants.bohr_to_ang**3)  # in eV/ang^3
 
     return e, f, s
@@ -1,16 +1,43 @@
-from abipy.abilab import Structure
+import os
+import re
+import glob
 import json
-from abipy.abio.inputs import AbinitInput
-from abipy.abio.abivars import is_abivar
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .mtp_interface import split_cfg_configs, convert_chunk_to_abivars
+from ..utils.lazy import lazy_import
+
+abilab = lazy_import('abipy.abilab')
+abinputs = lazy_import('abipy.abio.inputs')
+abivars_db = lazy_import('abipy.abio.abivars')
+periodic_table = lazy_import('pymatgen.core.periodic_table')
+pmg_pseudos = lazy_import('pymatgen.io.abinit.pseudos')
 
 def poscar_to_abivars(vasp_fname):
 
-    structure = Structure.from_file(vasp_fname)
+    structure = abilab.Structure.from_file(vasp_fname)
     out = structure.to_abivars()
     # or maybe structure.to_abistring?
     # this does not work as MTP does not know the atomic species...
     return out
 
+def cfg_to_abivars(fname, atomic_species):
+
+    ''' Reads all configurations of a .cfg file as a list of abivars dicts, in a single pass.
+        MTP atom types 0, 1, ... are mapped to atomic_species (chemical symbols or atomic numbers). '''
+
+    atomic_numbers = [a if isinstance(a, int) else periodic_table.Element(a).Z for a in atomic_species]
+
+    structs = []
+    for config in split_cfg_configs(fname):
+        if not config or not config[0].startswith('BEGIN_CFG'):
+            continue
+        abivars, _, _, _ = convert_chunk_to_abivars(config, atomic_numbers)
+        structs.append(abivars)
+
+    return structs
+
+
 def load_abivars(fname):
 
     # extract the pseudo variables from the dictionnary, to work with AbinitInput class
@@ -37,10 +64,43 @@ def load_abivars(fname):
     return abivars, abipseudos
 
 
+def valence_electrons(mypseudos):
+
+    ''' Number of valence electrons of each element, {Z: zval}, read from the pseudopotential files '''
+
+    pseudos = mypseudos['pseudos']
+    if isinstance(pseudos, str):
+        pseudos = [p.strip().strip('"') for p in pseudos.split(',')]
+
+    zval = {}
+    for fname in pseudos:
+        pseudo = pmg_pseudos.Pseudo.from_file(os.path.join(mypseudos['pp_dirpath'], fname))
+        zval[pseudo.Z] = pseudo.Z_val
+
+    return zval
+
+
+def kpoint_count(myvars):
+
+    ''' Number of k-points of the unreduced grid defined by ngkpt/nshiftk (or kptrlatt), 1 if no grid is given.
+        Used as a cost estimate, the number of irreducible k-points is smaller. '''
+
+    if 'ngkpt' in myvars:
+        nkpt = 1
+        for n in myvars['ngkpt']:
+            nkpt *= int(n)
+    elif 'kptrlatt' in myvars:
+        nkpt = int(round(abs(np.linalg.det(np.reshape(myvars['kptrlatt'], (3, 3))))))
+    else:
+        return max(int(myvars.get('nkpt', 1)), 1)
+
+    return nkpt*int(myvars.get('nshiftk', 1))
+
+
 def check_abivars(myvars):
     fixvars = []
     for key in myvars.keys():
-        if not is_abivar(key):
+        if not abivars_db.is_abivar(key):
             fixvars.append(key)
             #print('{} is not an Abinit variable'.format(key))
     if len(fixvars)>0:
@@ -49,10 +109,104 @@ def check_abivars(myvars):
 
 def input_from_dict(struct, myvars, mypseudos):
 
-    abi_input = AbinitInput(struct, mypseudos['pseudos'], pseudo_dir=mypseudos['pp_dirpath'], abi_kwargs=myvars)
+    abi_input = abinputs.AbinitInput(struct, mypseudos['pseudos'], pseudo_dir=mypseudos['pp_dirpath'], abi_kwargs=myvars)
     abi_input.write()
 
 
 def abivars_to_abistruct(myvars):
 
-    return Structure.from_abivars(myvars)
+    return abilab.Structure.from_abivars(myvars)
+
+
+# Markers searched in Abinit log files, in a single pass
+error_markers = rb'(?P<scfconv>ScfConvergenceWarning)|(?P<memory>out-of-memory handler)|(?P<timelimit>TIME LIMIT)'
+completion_marker = b'Calculation completed'
+error_pattern = re.compile(error_markers)
+log_pattern = re.compile(error_markers + rb'|(?P<completed>Calculation completed)')
+nstep_pattern = re.compile(rb'nstep\s+(\d+)')
+
+
+def scan_abinit_log(workdir, pattern='log*', tail_size=8192):
+
+    '''
+        Classifies the outcome of the Abinit calculation in workdir from its log file(s), reading each file once.
+
+        Returns (status, nstep), where status is None if the calculation completed without SCF convergence warning,
+        or one of "scfconv", "memory", "timelimit", "unknown" (no log or no completion marker).
+        nstep is the number of SCF steps reported in the ScfConvergenceWarning, if any.
+    '''
+
+    found = set()
+    nstep = None
+
+    for fname in sorted(glob.glob(os.path.join(workdir, pattern))):
+        with open(fname, 'rb') as f:
+            content = f.read()
+
+        # The completion marker is normally at the end of the log, so only errors remain to be searched
+        if completion_marker in content[-tail_size:]:
+            found.add('completed')
+            markers = error_pattern
+        else:
+            markers = log_pattern
+
+        for match in markers.finditer(content):
+            marker = match.lastgroup
+            found.add(marker)
+            if marker == 'scfconv' and nstep is None:
+                # nstep is given within the 2 lines following the warning
+                following = b'\n'.join(content[match.end():].split(b'\n', 3)[:3])
+                value = nstep_pattern.search(following)
+                if value:
+                    nstep = int(value.group(1))
+
+    for status in ['scfconv', 'memory', 'timelimit']:
+        if status in found:
+            return status, nstep
+
+    if 'completed' not in found:
+        return 'unknown', nstep
+
+    return None, nstep
+
+
+walltime_pattern = re.compile(rb'Overall time at end \(sec\)\s*:\s*cpu=\s*\S+\s+wall=\s*([0-9.EeDd+-]+)')
+memory_pattern = re.compile(rb'should need less than\s+([0-9.]+)\s+Mbytes')
+nproc_pattern = re.compile(rb'nproc\s*=\s*(\d+)')
+
+
+def read_abinit_resources(workdir, pattern='log*'):
+
+    '''
+        Resources used by the completed Abinit calculation in workdir, read from its log file(s).
+
+        Returns (walltime, memory, nproc): the wall time in seconds, Abinit's estimate of the memory needed
+        by each MPI process in MB and the number of MPI processes. Values which were not found are None
+        (nproc defaults to 1).
+    '''
+
+    walltime, memory, nproc = None, None, 1
+
+    for fname in sorted(glob.glob(os.path.join(workdir, pattern))):
+        with open(fname, 'rb') as f:
+            content = f.read()
+
+        match = walltime_pattern.search(content)
+        if match:
+            walltime = float(match.group(1).replace(b'D', b'E').replace(b'd', b'e'))
+        estimates = [float(m.group(1)) for m in memory_pattern.finditer(content)]
+        if estimates:
+            memory = max(estimates + ([memory] if memory else []))
+        match = nproc_pattern.search(content)
+        if match:
+            nproc = int(match.group(1))
+
+    return walltime, memory, nproc
+
+
+def scan_abinit_logs(workdirs, pattern='log*', nthreads=8):
+
+    ''' Runs scan_abinit_log over several calculation directories concurrently. Returns a list of (status, nstep). '''
+
+    with ThreadPoolExecutor(max_workers=nthreads) as pool:
+        return list(pool.map(lambda workdir: scan_abinit_log(workdir, pattern), workdirs))
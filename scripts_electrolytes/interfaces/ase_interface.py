@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 
-from ase.io import read
-import pandas as pd
-from abipy.core.structure import Structure
+from ..utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+abistructure = lazy_import('abipy.core.structure')
 
 def abistruct_to_ase(struct):
 
@@ -10,7 +11,7 @@ def abistruct_to_ase(struct):
 
 def ase_to_abistruct(atoms):
 
-    return Structure.from_ase_atoms(atoms)
+    return abistructure.Structure.from_ase_atoms(atoms)
 
 
 def create_mdlogger_dataframe(fname):
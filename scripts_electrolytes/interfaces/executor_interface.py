@@ -0,0 +1,286 @@
+import os
+import time
+import logging
+import subprocess as subp
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures, FIRST_COMPLETED
+from .slurm_interface import SlurmWatcher, SlurmBackend, TERMINAL_STATES
+from ..utils.time import when_is_now
+
+
+class SlurmExecutor:
+
+    def __init__(self, username, scheduler=None):
+
+        '''
+            Runs the OTF jobs through the Slurm queue.
+
+            launch() submits a job with sbatch, wait() monitors all jobs submitted since the last wait()
+            and run() executes a command directly, within the current allocation.
+
+            Input:
+                username: cluster username
+
+                scheduler: SlurmBackend instance used to submit and monitor jobs
+                           Default: None (standard sbatch/squeue/sacct commands)
+        '''
+
+        self.username = username
+        self.scheduler = scheduler if scheduler is not None else SlurmBackend()
+        self.launcher = 'srun'
+        self.jobids = []
+
+
+    def launch(self, args, workdir=None):
+
+        ''' Submits a job. args contains the sbatch options followed by the submission script. Returns the job ID. '''
+
+        owd = os.getcwd()
+        if workdir:
+            os.chdir(workdir)
+        try:
+            jobid = self.scheduler.submit(args)
+        finally:
+            os.chdir(owd)
+
+        self.jobids.append(jobid)
+        return jobid
+
+
+    def job_times(self, jobids):
+
+        ''' Submission, start and end times (seconds since epoch) of the jobs in jobids, from the accounting database '''
+
+        return self.scheduler.job_times([str(jobid) for jobid in jobids])
+
+
+    def job_memory(self, jobids):
+
+        ''' Measured peak memory per process (MB) of the jobs in jobids, from the accounting database '''
+
+        return self.scheduler.job_memory([str(jobid) for jobid in jobids])
+
+
+    def resume(self, jobid):
+
+        ''' Watches again a job submitted before a restart, if it is still in the queue. Returns whether it was. '''
+
+        if jobid in self.jobids:
+            return True
+
+        states = self.scheduler.query([str(jobid)])
+        # A job found nowhere after a restart is not watched again
+        if any(state not in TERMINAL_STATES + ['UNKNOWN'] for state in states.values()):
+            self.jobids.append(jobid)
+            return True
+
+        return False
+
+
+    def wait(self, rootname, msg=None, on_finished=None):
+
+        ''' Waits for all launched jobs. on_finished(jobid, state) is called as soon as each job is done,
+            and the jobs it launches are waited for as well. '''
+
+        watcher = SlurmWatcher(rootname, self.username, jobids=self.jobids, backend=self.scheduler)
+        states = watcher.watch(msg=msg, on_finished=on_finished)
+        self.jobids = []
+
+        return states
+
+
+    def run(self, command):
+        subp.run(command, shell=True)
+
+
+class LocalExecutor:
+
+    def __init__(self, max_workers=1, cores_per_job=None, launcher='srun'):
+
+        '''
+            Runs the OTF jobs as local processes, i.e. within a single large Slurm allocation when submit=False.
+
+            launch() starts a job in a pool of max_workers concurrent processes, wait() blocks until all
+            of them are done and run() executes a command directly.
+
+            Input:
+                max_workers: number of jobs running concurrently
+                             Default: 1 (jobs run one after another)
+
+                cores_per_job: number of cores given to each concurrent job. With the srun launcher, this sets
+                               --ntasks=<cores_per_job> --exact so that concurrent job steps share the allocation.
+                               Default: None (launcher options are not modified)
+
+                launcher: command used to start parallel runs (i.e. "srun", "mpirun")
+                          Default: "srun"
+        '''
+
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError('max_workers should be a positive integer, but I got {}'.format(max_workers))
+        if cores_per_job is not None and (not isinstance(cores_per_job, int) or cores_per_job < 1):
+            raise ValueError('cores_per_job should be a positive integer, but I got {}'.format(cores_per_job))
+
+        self.max_workers = max_workers
+        self.cores_per_job = cores_per_job
+        # Launcher without the core options, for executors sharing it with other core counts
+        self.base_launcher = launcher
+        if cores_per_job is None:
+            self.launcher = launcher
+        elif launcher.split()[0] == 'srun':
+            self.launcher = '{} --ntasks={} --exact'.format(launcher, cores_per_job)
+        elif launcher.split()[0] in ['mpirun', 'mpiexec']:
+            self.launcher = '{} -np {}'.format(launcher, cores_per_job)
+        else:
+            raise ValueError('Cannot set the number of cores for launcher "{}". Use srun or mpirun.'.format(launcher))
+
+        self.pool = None
+        self.futures = {}
+        self.times = {}
+        self.njobs = 0
+
+
+    def launch(self, command, workdir=None):
+
+        ''' Queues a shell command, executed in workdir. Returns a job identifier. '''
+
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        jobid = 'local{}'.format(self.njobs)
+        self.njobs += 1
+        workdir = os.path.abspath(workdir) if workdir else os.getcwd()
+        self.times[jobid] = [time.time(), None, None]
+        self.futures[jobid] = self.pool.submit(self.run_job, jobid, command, workdir)
+
+        return jobid
+
+
+    def run_job(self, jobid, command, workdir):
+
+        self.times[jobid][1] = time.time()
+        try:
+            return subp.run(command, shell=True, cwd=workdir)
+        finally:
+            self.times[jobid][2] = time.time()
+
+
+    def job_times(self, jobids):
+
+        ''' Launch, start and end times (seconds since epoch) of the jobs in jobids '''
+
+        return {jobid: tuple(self.times[jobid]) for jobid in jobids if jobid in self.times}
+
+
+    def job_memory(self, jobids):
+        # Local processes are not accounted
+        return {}
+
+
+    def resume(self, jobid):
+        # Local processes do not survive a restart
+        return False
+
+
+    def wait(self, rootname, msg=None, on_finished=None):
+
+        ''' Waits for all launched jobs. on_finished(jobid, state) is called as soon as each job is done,
+            and the jobs it launches are waited for as well. '''
+
+        if msg:
+            logging.info('    {}: {}'.format(when_is_now(), msg))
+
+        states = {}
+        pending = {future: jobid for jobid, future in self.futures.items()}
+        while pending:
+            done, _ = wait_futures(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                jobid = pending.pop(future)
+                states[jobid] = 'COMPLETED' if future.result().returncode == 0 else 'FAILED'
+                if on_finished is not None:
+                    on_finished(jobid, states[jobid])
+            # Add the jobs launched by on_finished
+            for jobid, future in self.futures.items():
+                if jobid not in states and future not in pending:
+                    pending[future] = jobid
+
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.pool = None
+        self.futures = {}
+
+        failed = [jobid for jobid, state in states.items() if state != 'COMPLETED']
+        if failed:
+            logging.warning('{} of {} {} jobs exited with an error'.format(len(failed), len(states), rootname))
+
+        return states
+
+
+    def run(self, command):
+        subp.run(command, shell=True)
+
+
+class DryRunExecutor:
+
+    def __init__(self, launcher='srun', logfile='dryrun_commands.txt'):
+
+        '''
+            Records the commands and submissions of the OTF procedure without executing them,
+            to check a workflow before running it.
+
+            Input:
+                launcher: command used to start parallel runs, as it would appear in the commands
+                          Default: "srun"
+
+                logfile: file in which the recorded commands are appended
+                         Default: "dryrun_commands.txt"
+        '''
+
+        self.launcher = launcher
+        self.logfile = os.path.abspath(logfile)
+        self.commands = []
+        self.jobids = []
+
+
+    def record(self, kind, command, workdir=None):
+
+        workdir = os.path.abspath(workdir) if workdir else os.getcwd()
+        self.commands.append((kind, command, workdir))
+        with open(self.logfile, 'a') as f:
+            f.write('{}: [{}] in {}: {}\n'.format(when_is_now(), kind, workdir, command))
+
+
+    def launch(self, command, workdir=None):
+
+        self.record('launch', command, workdir)
+        jobid = 'dryrun{}'.format(len(self.commands))
+        self.jobids.append(jobid)
+
+        return jobid
+
+
+    def resume(self, jobid):
+        return False
+
+
+    def job_times(self, jobids):
+        return {}
+
+
+    def job_memory(self, jobids):
+        return {}
+
+
+    def wait(self, rootname, msg=None, on_finished=None):
+
+        states = {}
+        while len(states) < len(self.jobids):
+            for jobid in [jobid for jobid in self.jobids if jobid not in states]:
+                states[jobid] = 'COMPLETED'
+                if on_finished is not None:
+                    on_finished(jobid, states[jobid])
+        self.jobids = []
+
+        return states
+
+
+    def run(self, command):
+        self.record('run', command)
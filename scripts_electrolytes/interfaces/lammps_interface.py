@@ -1,13 +1,15 @@
+import io
 import numpy as np
-import pandas as pd
-from ase.io import read as ase_read
-from ase.io import write as ase_write
-from ase.md.analysis import DiffusionCoefficient
-from ase import Atoms
-from abipy.data import nist_database
 import os
-import netCDF4 as nc
-from ase.io.formats import string2index
+from ..utils.unwrap import unwrap_positions, cell_from_parameters
+from ..utils.lazy import lazy_import
+
+pd = lazy_import('pandas')
+nc = lazy_import('netCDF4')
+ase = lazy_import('ase')
+ase_io = lazy_import('ase.io')
+ase_formats = lazy_import('ase.io.formats')
+nist_database = lazy_import('abipy.data.nist_database')
 
 ''' Some functions to treat the outputs from a LAMMPS run'''
 
@@ -58,7 +60,7 @@ def read_msd_from_thermo(data):
 def read_traj_from_dump(fname, atomic_numbers, which=':', skip_nlast=None):
     ''' Read full trajectory from LAMMPS text dump file '''
 
-    traj= ase_read(fname, format='lammps-dump-text', index=which)
+    traj= ase_io.read(fname, format='lammps-dump-text', index=which)
 
     # as the lammps dump outputs only atom id (1,2,3...) and not type, ASE sees H, He, Li...
     # So, convert atom id to atomic masses
@@ -71,11 +73,80 @@ def read_traj_from_dump(fname, atomic_numbers, which=':', skip_nlast=None):
     return traj
 
 
+def iter_tail_blocks(fname, marker, blocksize=1048576):
+    ''' Yields the blocks of a text file starting with marker, from the last one to the first one.
+        The file is read backwards by chunks of blocksize bytes, so that only the end of the file
+        is read when only the last blocks are needed. '''
+
+    marker = marker.encode()
+    with open(fname, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = b''
+        while True:
+            idx = buf.rfind(marker)
+            if idx != -1:
+                yield buf[idx:].decode()
+                buf = buf[:idx]
+                continue
+            if pos == 0:
+                return
+            step = min(blocksize, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+
+
+def iter_lines_reversed(fname, blocksize=65536):
+    ''' Yields the lines of a text file from the last one to the first one, reading the file backwards '''
+
+    for block in iter_tail_blocks(fname, '\n', blocksize):
+        line = block[1:].rstrip('\r')
+        if line:
+            yield line
+    # The first line is not preceded by a newline
+    with open(fname, 'r') as f:
+        yield f.readline().rstrip('\r\n')
+
+
+def dump_frame_is_complete(frame):
+    ''' Checks that all the atoms of a LAMMPS dump text frame were written (the last frame of a running job may not):
+        the frame should end with a newline, and contain natoms lines with all the columns of the ITEM: ATOMS header '''
+
+    if not frame.endswith('\n'):
+        return False
+
+    lines = frame.splitlines()
+    try:
+        natoms = int(lines[lines.index('ITEM: NUMBER OF ATOMS')+1])
+        start = [i for i, line in enumerate(lines) if line.startswith('ITEM: ATOMS')][0]
+    except (ValueError, IndexError):
+        return False
+
+    ncolumns = len(lines[start].split()) - 2
+    atoms = [line.split() for line in lines[start+1:] if line.strip()]
+    return len(atoms) >= natoms and all(len(fields) == ncolumns for fields in atoms)
+
+
+def read_last_frame_from_dump(fname):
+    ''' Returns the text of the last complete frame of a LAMMPS dump text file, read from the end of the file '''
+
+    for frame in iter_tail_blocks(fname, 'ITEM: TIMESTEP'):
+        if dump_frame_is_complete(frame):
+            return frame
+    raise ValueError('Could not find a complete configuration in LAMMPS dump file {}'.format(fname))
+
+
 def read_config_from_dump(fname, atomic_numbers, which=-1):
     ''' Reads a specified atomic configuration from a LAMMPS dump text file
-        configuration index define by "which" arg. '''
+        configuration index define by "which" arg.
+        The last configuration (which=-1) is read from the end of the file, without parsing the previous ones. '''
 
-    atoms = ase_read(fname, format='lammps-dump-text', index=which)
+    if which == -1:
+        frame = io.StringIO(read_last_frame_from_dump(fname))
+        atoms = ase_io.read(frame, format='lammps-dump-text', index=-1)
+    else:
+        atoms = ase_io.read(fname, format='lammps-dump-text', index=which)
 
     # as the lammps dump outputs only atom id (1,2,3...) and not type, ASE sees H, He, Li...
     # So, convert atom id to atomic masses
@@ -83,14 +154,32 @@ def read_config_from_dump(fname, atomic_numbers, which=-1):
         atoms.numbers[a] = atomic_numbers[atoms.numbers[a]-1]
     return atoms
 
+def is_neb_line(data):
+    # NEB output lines: step, max/2-norm forces, GradV0..., EBF, EBR, RDT, then RD1 PE1 RD2 PE2...
+    if len(data) < 11 or not data[0].isdigit():
+        return False
+    try:
+        [float(val) for val in data[1:]]
+    except ValueError:
+        return False
+    return True
+
+
+def read_last_neb_line(fname):
+    ''' Returns the fields of the last NEB output line of a log.lammps main log file, reading it from the end '''
+
+    for line in iter_lines_reversed(fname):
+        if is_neb_line(line.split()):
+            return line.split()
+    raise ValueError('Could not find NEB results in file {}'.format(fname))
+
+
 def read_neb_logfile(fname, rescale_energy):
-    ''' Reads a log.lammps main log output file and extracts the converged results '''
-    
-    f = open(fname, 'r')
-    lines = f.readlines()
-    data = lines[-1]
+    ''' Reads a log.lammps main log output file and extracts the converged results.
+        Only the end of the file is read, up to the last NEB output line. '''
+
+    data = read_last_neb_line(fname)
 
-    data = data.split()
     forward_barrier = float(data[6])
     backward_barrier  = float(data[7])
     reaction_coordinate_length = float(data[8])
@@ -102,22 +191,47 @@ def read_neb_logfile(fname, rescale_energy):
     return forward_barrier, backward_barrier, reaction_coordinate_length, reaction_coordinate, energy
 
 
+def read_neb_status(fname):
+    ''' Returns the last step, maximal replica force and maximal atomic force of the NEB run in a log.lammps main log file '''
+
+    data = read_last_neb_line(fname)
+    return int(data[0]), float(data[1]), float(data[2])
+
+
+def read_neb_settings(fname):
+    ''' Reads the etol, ftol, N1 and N2 arguments of the neb command echoed in a log.lammps.X file.
+        Returns None if the command is not found, and None values for arguments given as LAMMPS variables. '''
+
+    with open(fname, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 5 or fields[0] != 'neb':
+                continue
+            settings = {}
+            for key, value, cast in zip(['etol', 'ftol', 'n1', 'n2'], fields[1:5], [float, float, int, int]):
+                try:
+                    settings[key] = cast(value)
+                except ValueError:
+                    settings[key] = None
+            return settings
+
+    return None
+
+
 def read_natoms(fname):
     ''' This reads the number of atoms in a lammps simulation from a log.lammps.X file
         where the initial structure was read from a .lmp file '''
 
-    f = open(fname, 'r')
-    lines = f.readlines()
-
+    # The file is read line by line, only until the number of atoms is found
     found = False
-    for line in lines:
-        if found:
-            natoms = int(line.split('atoms')[0])
-            break
-        else:
+    with open(fname, 'r') as f:
+        for line in f:
+            if found:
+                return int(line.split('atoms')[0])
             if line.find('reading atoms') != -1:
                 found = True
-    return natoms
+
+    raise ValueError('Could not find the number of atoms in file {}'.format(fname))
 
 
 def slice_trajectory_from_dump(fname, out_rootname='traj', atomic_numbers=None, nskip=10):
@@ -135,7 +249,7 @@ def slice_trajectory_from_dump(fname, out_rootname='traj', atomic_numbers=None,
     trajectory = read_traj_from_dump(fname, atomic_numbers, which=which)
 
     out_fname = '{}.xyz'.format(out_rootname)
-    ase_write(filename=out_fname, images=trajectory, append=True)
+    ase_io.write(filename=out_fname, images=trajectory, append=True)
 
 
 def abistruct_to_xyz(db, struct, energy=None, forces=None, stresses=None):
@@ -200,7 +314,7 @@ def read_traj_from_ncdump(fname, atomic_numbers, which=':', skip_nlast=None):
 
     if isinstance(which, str):
         try:
-            index = string2index(which)
+            index = ase_formats.string2index(which)
         except ValueError:
             pass
 
@@ -211,7 +325,11 @@ def read_traj_from_ncdump(fname, atomic_numbers, which=':', skip_nlast=None):
         angles = root.variables['cell_angles'][:, :]  # frame, 3
         atom_id = root.variables['id'][:, :]  # frame, natom
         atom_type = root.variables['type'][:, :]  # frame, natom
-        coords = root.variables['unwrapped_coordinates'][:, : ,:]  # frame, natom, 3
+        if 'unwrapped_coordinates' in root.variables:
+            coords = root.variables['unwrapped_coordinates'][:, : ,:]  # frame, natom, 3
+        else:
+            # Only wrapped positions were dumped: reconstruct continuous trajectories
+            coords = unwrap_positions(root.variables['coordinates'], cell_from_parameters(lattice, angles), cartesian=True)
         # Time array; frame indexes are scaled by scale_factor = timestep in calculations
         time = root.variables['time'][:]
         # Define cell from lattice parammeters and angles
@@ -221,7 +339,7 @@ def read_traj_from_ncdump(fname, atomic_numbers, which=':', skip_nlast=None):
             time = time[:-skip_nlast]
         for i in list(range(len(time)))[index]:
             symbol = get_symbol(atom_type[i,:], atomic_numbers)
-            atoms = Atoms(symbol, cell=cell[i], pbc=True, positions=coords[i,:])
+            atoms = ase.Atoms(symbol, cell=cell[i], pbc=True, positions=coords[i,:])
             traj.append(atoms)
     
     return time, traj
@@ -262,7 +380,7 @@ def extract_trajectory_from_ncdump(fname, out_rootname='traj', atomic_numbers=No
 
     if fmt == 'xyz':
         out_fname = '{}.xyz'.format(out_rootname)
-        ase_write(filename=out_fname, images=trajectory, append=True, format='xyz')
+        ase_io.write(filename=out_fname, images=trajectory, append=True, format='xyz')
     elif fmt == 'netcdf':
         out_fname = '{}.nc'.format(out_rootname)
-        ase_write(filename=out_fname, images=trajectory, append=False, format='netcdftrajectory')
+        ase_io.write(filename=out_fname, images=trajectory, append=False, format='netcdftrajectory')
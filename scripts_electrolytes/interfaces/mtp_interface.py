@@ -1,12 +1,15 @@
 #!/usr/bin/env python
+import os
 import numpy as np
 import subprocess as subp
 import re
-import pandas as pd
-from ..utils.constants import ang_to_bohr
+from ..utils import constants
+from ..utils.lazy import lazy_import
 from typing import Any, Dict, List, Optional, TextIO, Tuple
 from collections import defaultdict
 
+pd = lazy_import('pandas')
+
 def abistruct_to_cfg(db, struct, energy=None, forces=None, stresses=None):
 
     # Write configuration in the .cfg format from MLIP-2 package
@@ -257,6 +260,53 @@ def split_cfg_configs(fname):
     return configs
 
 
+def cfg_config_key(config, decimals=4):
+
+    ''' Identifies a .cfg configuration by its cell, types and positions, rounded to decimals.
+        Energies, stresses and features (i.e. the extrapolation grade) are ignored. '''
+
+    key = []
+    for line in config:
+        stripped = line.strip()
+        if stripped.startswith(('Energy', 'PlusStress', 'Feature', 'END_CFG')):
+            break
+        for token in stripped.split():
+            try:
+                key.append(round(float(token), decimals))
+            except ValueError:
+                key.append(token)
+
+    return tuple(key)
+
+
+def merge_cfg_files(fnames, outname, decimals=4):
+
+    ''' Concatenates the configurations of several .cfg files into outname, removing duplicated configurations
+        (same cell, types and positions up to decimals). Returns the number of configurations written
+        and the number of duplicates removed. '''
+
+    seen = set()
+    nconfigs = 0
+    nduplicates = 0
+
+    with open(outname, 'w') as f:
+        for fname in fnames:
+            if not os.path.exists(fname):
+                continue
+            for config in split_cfg_configs(fname):
+                if not config or not config[0].startswith('BEGIN_CFG'):
+                    continue
+                key = cfg_config_key(config, decimals)
+                if key in seen:
+                    nduplicates += 1
+                    continue
+                seen.add(key)
+                f.writelines(config)
+                nconfigs += 1
+
+    return nconfigs, nduplicates
+
+
 def convert_chunk_to_abivars(data, atomic_numbers):
 
     ''' Converts a .cfg configuration into an abivars dict, and read EFS if applicable '''
@@ -276,7 +326,7 @@ def convert_chunk_to_abivars(data, atomic_numbers):
                'znucl': atomic_numbers,
                'typat': typat,
                'acell': np.ones((3)),
-               'rprim': lattice * ang_to_bohr,
+               'rprim': lattice * constants.ang_to_bohr,
                'xangst': xcart
               }
 
@@ -321,7 +371,8 @@ def read_config_properties(data):
     try:
         my_idx
     except:
-        my_idx = [i for i, item in enumerate(data) if re.search('Feature', item)][0]
+        # Configurations without computed properties (i.e. selected for DFT) end with features or END_CFG
+        my_idx = [i for i, item in enumerate(data) if re.search('Feature|END_CFG', item)][0]
 
     return energy, stress, my_idx
 
@@ -350,7 +401,6 @@ def split_atomic_data(data, header, natom, latt):
         pos_are_cart = True
     elif header.find('direct_x') != -1:
         pos_are_cart = False
-        latt_inv = np.linalg.inv(latt.T)
     else:
         raise ValueError('Could not find either cartesian or reduced coordinates in AtomData header. Check your data.')
 
@@ -378,15 +428,15 @@ def split_atomic_data(data, header, natom, latt):
         if pos_are_cart:
             pos[a, :] = atom[idx_pos:idx_pos+3]
         else:
-            vec = np.asarray(atom[idx_pos:idx_pos+3])
-            pos[a, :] = np.matmul(latt_inv, vec)
+            vec = np.asarray(atom[idx_pos:idx_pos+3], dtype=float)
+            pos[a, :] = np.matmul(latt.T, vec)
 
         if forces is not None:
             forces[a, :] = atom[idx_forces:idx_forces+3]
 
     return  typat, pos, forces
 
-def read_cfgs_with_nbh_grade(filename: str, nbh_grade: bool=True, elements: list=None) -> pd.DataFrame:
+def read_cfgs_with_nbh_grade(filename: str, nbh_grade: bool=True, elements: list=None) -> 'pd.DataFrame':
     '''
     Read cfg file with atomic neighborhood MaxVol grade, 
     and convert to dataframe
@@ -445,7 +495,7 @@ def read_cfgs_with_nbh_grade(filename: str, nbh_grade: bool=True, elements: list
     df = convert_to_dataframe(docs=data_pool)
     return df
 
-def convert_to_dataframe(docs: List[Dict[str, Any]]) -> pd.DataFrame:
+def convert_to_dataframe(docs: List[Dict[str, Any]]) -> 'pd.DataFrame':
     '''
     Convert a list of docs into DataFrame usable for computing metrics and analysis.
     Taken from from diffusion_for_multi_scale_molecular_dynamics.crystal_diffusion.models.mtp
@@ -1,46 +1,454 @@
+import time
+import logging
+from datetime import datetime
 from subprocess import run
 from ..utils.time import when_is_now
 
+# Final Slurm job states, as reported by sacct. Any other state means the job is still in the queue.
+# "UNKNOWN" (not listed by squeue nor sacct) is not final: jobs are briefly invisible right after submission,
+# or when the accounting database lags behind (see SlurmWatcher).
+TERMINAL_STATES = ['COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL', 'PREEMPTED',
+                   'BOOT_FAIL', 'DEADLINE', 'REVOKED', 'SPECIAL_EXIT']
+
+
+class SlurmBackend:
+
+    def __init__(self, sbatch='sbatch', squeue='squeue', sacct='sacct'):
+
+        '''
+            Thin interface to the Slurm commands used for job submission and monitoring.
+            The executables can be replaced, i.e. by local scripts mimicking squeue/sacct for testing.
+
+            Input:
+                sbatch: command used to submit jobs
+                        Default: "sbatch"
+
+                squeue: command used to query pending and running jobs
+                        Default: "squeue"
+
+                sacct: command used to query the final state of jobs which left the queue.
+                       Can be None if job accounting is not available on the cluster.
+                       Default: "sacct"
+        '''
+
+        self.sbatch = sbatch
+        self.squeue = squeue
+        self.sacct = sacct
+
+
+    def submit(self, args):
+
+        ''' Submits a job with sbatch --parsable and returns its job ID (as a string) '''
+
+        output = run('{} --parsable {}'.format(self.sbatch, args), shell=True, capture_output=True, text=True)
+        if output.returncode != 0:
+            raise Exception('Job submission failed: {}'.format(output.stderr.strip()))
+
+        # --parsable prints "jobid" or "jobid;cluster"
+        return output.stdout.strip().split(';')[0]
+
+
+    def query(self, jobids):
+
+        '''
+            Returns the states of all jobs in jobids, with a single squeue call and, for jobs which left the queue,
+            a single sacct call. Array jobs are reported task by task (i.e. "1234_0", "1234_1").
+            Arrays with tasks still in the queue are also sent to sacct, for the states of their finished tasks.
+            Jobs that cannot be found anywhere are reported as "UNKNOWN".
+        '''
+
+        states = {}
+        ids = ','.join(jobids)
+
+        output = run('{} -h -j {} -o "%i %T"'.format(self.squeue, ids), shell=True, capture_output=True, text=True)
+        # squeue exits with an error when none of the jobs are known anymore
+        if output.returncode == 0:
+            states.update(self.parse_states(output.stdout))
+
+        # squeue only lists the tasks of an array which did not finish yet
+        arrays = [jobid for jobid in jobids if self.is_array(jobid, states)]
+        missing = [jobid for jobid in jobids if not self.is_listed(jobid, states)] + arrays
+        if missing and self.sacct:
+            output = run('{} -n -X -P -j {} -o JobID,State'.format(self.sacct, ','.join(missing)),
+                         shell=True, capture_output=True, text=True)
+            if output.returncode == 0:
+                for jobid, state in self.parse_states(output.stdout.replace('|', ' ')).items():
+                    # The states of the tasks still in the queue are more recent in squeue
+                    if jobid not in arrays:
+                        states.setdefault(jobid, state)
+
+        for jobid in jobids:
+            if not self.is_listed(jobid, states):
+                states[jobid] = 'UNKNOWN'
+
+        return states
+
+
+    def job_times(self, jobids):
+
+        '''
+            Returns the submission, start and end times (seconds since epoch, None if not reached) of the jobs
+            in jobids, from a single sacct call. Array jobs are reported task by task.
+        '''
+
+        return self.accounting(jobids)[0]
+
+
+    def job_memory(self, jobids):
+
+        '''
+            Returns the measured peak memory of the jobs in jobids, in MB: the largest MaxRSS (memory of a single process)
+            over the steps of each job, from a single sacct call. Array jobs are reported task by task.
+            Jobs whose steps did not report any memory are missing.
+        '''
+
+        return self.accounting(jobids)[1]
+
+
+    def accounting(self, jobids):
+
+        ''' Submission, start and end times, and peak memory of the jobs in jobids (see job_times and job_memory) '''
+
+        times, memory = {}, {}
+        if not jobids or not self.sacct:
+            return times, memory
+
+        # Without -X, sacct also lists the steps of each job (i.e. "1234.batch", "1234_0.0"), which report MaxRSS
+        output = run('{} -n -P -j {} -o JobID,Submit,Start,End,MaxRSS'.format(self.sacct, ','.join(jobids)),
+                     shell=True, capture_output=True, text=True)
+        if output.returncode != 0:
+            return times, memory
+
+        for line in output.stdout.splitlines():
+            fields = line.split('|')
+            if len(fields) < 5:
+                continue
+            jobid = fields[0].split('.')[0]
+            if '.' not in fields[0]:
+                times[jobid] = tuple(self.parse_time(field) for field in fields[1:4])
+            rss = self.parse_rss(fields[4])
+            if rss:
+                memory[jobid] = max(rss, memory.get(jobid, 0.))
+
+        return times, memory
+
+
+    def parse_rss(self, field):
+        # sacct prints i.e. "123456K", "1.5G", or nothing for the job allocation line. Values without units are in bytes.
+        field = field.strip()
+        if not field:
+            return None
+        try:
+            if field[-1].upper() in 'KMGT':
+                return parse_slurm_memory(field)
+            return float(field)/1024**2
+        except ValueError:
+            return None
+
+
+    def parse_time(self, field):
+        # sacct prints i.e. "2024-03-01T12:00:00", or "Unknown"/"None" for times not reached yet
+        try:
+            return datetime.fromisoformat(field.strip()).timestamp()
+        except ValueError:
+            return None
+
+
+    def parse_states(self, stdout):
+
+        states = {}
+        for line in stdout.splitlines():
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            # sacct reports i.e. "CANCELLED by 1234"
+            states[fields[0]] = fields[1].rstrip('+')
+
+        return states
+
+
+    def is_listed(self, jobid, states):
+        return any(key == jobid or key.split('_')[0] == jobid for key in states)
+
+
+    def is_array(self, jobid, states):
+        return any(key != jobid and key.split('_')[0] == jobid for key in states)
+
+
+    def count_user_jobs(self, username, rootname):
+
+        ''' Number of jobs of username whose name contains rootname '''
+
+        output = run('{} -h -u {} -o "%j"'.format(self.squeue, username), shell=True, capture_output=True, text=True)
+        return len([name for name in output.stdout.split() if rootname in name])
+
+
 class SlurmWatcher:
 
-    def __init__(self, rootname, username):
+    def __init__(self, rootname, username, jobids=None, backend=None, min_wait=5, max_wait=120, backoff=1.5,
+                 status_file='status.txt', max_missing=3):
+
+        '''
+            Waits for a set of Slurm jobs to leave the queue.
+
+            Input:
+                rootname: job name root, used in the status messages and to find jobs when jobids is not provided
+
+                username: cluster username
+
+                jobids: list of job IDs to watch, as returned by sbatch --parsable.
+                        Jobs appended to this list during watch() are also monitored.
+                        Default: None (watch all jobs of username whose name contains rootname)
+
+                backend: SlurmBackend instance used to query the scheduler
+                         Default: None (SlurmBackend with the standard Slurm commands)
+
+                min_wait: initial (and minimal) waiting time between two polls, in seconds
+                          Default: 5
+
+                max_wait: maximal waiting time between two polls, in seconds
+                          Default: 120
+
+                backoff: factor by which the waiting time increases when no job changed state since the previous poll.
+                         The waiting time is reset to min_wait as soon as a job finishes.
+                         Default: 1.5
+
+                status_file: file in which the progress is appended
+                             Default: "status.txt"
+
+                max_missing: number of consecutive polls after which a job which was never listed by squeue or sacct
+                             is considered gone (state "UNKNOWN"). A job which was listed before is considered gone
+                             as soon as it is not listed anymore.
+                             Default: 3
+        '''
 
         self.rootname = rootname
         self.username = username
+        # Kept as a reference, so that jobs appended to the list while watching are also monitored
+        self.jobids = jobids
+        self.backend = backend if backend is not None else SlurmBackend()
+
+        if min_wait <= 0 or max_wait < min_wait:
+            raise ValueError('Waiting times should satisfy 0 < min_wait <= max_wait, but I got {} and {}'.format(min_wait, max_wait))
+        if backoff < 1:
+            raise ValueError('backoff should be >= 1, but I got {}'.format(backoff))
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self.status_file = status_file
+        if not isinstance(max_missing, int) or max_missing < 1:
+            raise ValueError('max_missing should be a positive integer, but I got {}'.format(max_missing))
+        self.max_missing = max_missing
+
+        self.states = {}
+        self.finished = set()
+        self.seen = set()
+        self.missing = {}
+
+
+    def write_status(self, msg):
+        with open(self.status_file, 'a') as f:
+            f.write('{}\n'.format(msg))
+
 
+    def watch(self, msg=None, on_finished=None):
+
+        ''' Blocks until all watched jobs are done. Returns a dictionnary of terminal states for each job
+            (empty if jobids was not provided, in which case only the number of jobs can be monitored).
+
+            on_finished: function called as on_finished(jobid, state) as soon as a job (or array task) reaches
+                         a terminal state. It can submit new jobs and append their IDs to the jobids list,
+                         which are then watched as well.
+                         Default: None
+        '''
 
-    def watch(self, msg=None):
         if msg:
-            run("echo {}>>status.txt".format(msg), shell=True)
-        # this is the bash script
-        # jobs_left=`squeue -u broussev| grep -v JOBID | grep $1 | wc -l`;  
-        command = "squeue -u {}| grep -v JOBID | grep {} |wc -l".format(self.username, self.rootname)
-        jobs_left = int(run(command, shell=True, capture_output=True).stdout)
-        wait_time = 120
+            self.write_status(msg)
+
+        self.finished = set()
+        self.seen = set()
+        self.missing = {}
+        wait_time = self.min_wait
+        jobs_left, nfinished = self.poll(on_finished)
+        while jobs_left > 0:
+            self.write_status('{}: {} jobs left'.format(when_is_now(), jobs_left))
+            time.sleep(wait_time)
+
+            jobs_left, nfinished = self.poll(on_finished)
+            if nfinished > 0:
+                wait_time = self.min_wait
+            else:
+                wait_time = min(self.max_wait, wait_time*self.backoff)
+
+        if self.jobids is not None:
+            self.report()
+
+        return self.states
+
+
+    def poll(self, on_finished=None):
+
+        ''' Queries the scheduler once. Returns the number of jobs still queued or running,
+            and the number of jobs which finished since the previous poll '''
+
+        if self.jobids is None:
+            return self.backend.count_user_jobs(self.username, self.rootname), 0
+
+        if not self.jobids:
+            return 0, 0
+
+        self.states = self.backend.query([str(jobid) for jobid in self.jobids])
+
+        newly_finished = [jobid for jobid, state in self.states.items()
+                          if self.is_done(jobid, state) and jobid not in self.finished]
+        for jobid in newly_finished:
+            self.finished.add(jobid)
+            if on_finished is not None:
+                on_finished(jobid, self.states[jobid])
+
+        # Jobs submitted by on_finished are not in states yet
+        jobs_left = len([jobid for jobid, state in self.states.items() if jobid not in self.finished])
+        jobs_left += len([jobid for jobid in self.jobids if not self.backend.is_listed(str(jobid), self.states)])
+
+        return jobs_left, len(newly_finished)
+
+
+    def is_done(self, jobid, state):
+
+        ''' Whether a job reached a terminal state, or is gone from both squeue and sacct.
+            Must be called once per poll for each job, since it counts the polls a job is missing. '''
+
+        if state != 'UNKNOWN':
+            # Array tasks also mark their parent job as seen
+            self.seen.update([jobid, jobid.split('_')[0]])
+            self.missing.pop(jobid, None)
+            return state in TERMINAL_STATES
+
+        self.missing[jobid] = self.missing.get(jobid, 0) + 1
+        return jobid in self.seen or self.missing[jobid] >= self.max_missing
+
+
+    def report(self):
 
-        #for j in range(20):
-        while jobs_left>0:
-            # Decide if it should be just overwrite (>) or append (>>)
-            # I could also echo to the command line as it is intended to run from a terminal maybe using nohup
-#            run("echo {}: {} jobs left>>status.txt".format(datetime.now().strftime("%d/%m/%Y %H:%M:%S"), jobs_left), shell=True)
-            run("echo {}: {} jobs left>>status.txt".format(when_is_now(), jobs_left), shell=True)
+        failed = {jobid: state for jobid, state in self.states.items() if state != 'COMPLETED'}
+        self.write_status('{}: all {} jobs finished'.format(when_is_now(), self.rootname))
+        for jobid, state in failed.items():
+            self.write_status('    job {}: {}'.format(jobid, state))
+            logging.warning('Slurm job {} ({}) ended with state {}'.format(jobid, self.rootname, state))
 
-            run('sleep {}'.format(wait_time), shell=True)
-            jobs_left = int(run(command, shell=True, capture_output=True).stdout)
 
-        # so, get the number of jobs left
-        # as long as it's more than 0, wait a bit and check again
-        # to be tested
+def read_slurm_submitfile(fname):
 
+    ''' Splits a Slurm submission script into its #SBATCH options (as a dictionnary) and the list of command lines '''
 
-def write_slurm_submitfile_loop(args, precommands, command, nloop, calcdir, njobs=1):
+    args = {}
+    commands = []
+    with open(fname, 'r') as f:
+        for line in f.readlines():
+            line = line.strip()
+            if line.startswith('#SBATCH'):
+                option = line.split('#SBATCH')[1].split('#')[0].strip()
+                if '=' in option:
+                    key, val = option.split('=', 1)
+                else:
+                    key, val = (option.split(None, 1) + [''])[:2]
+                args[key.strip()] = val.strip()
+            elif line.startswith('#!') or not line:
+                continue
+            else:
+                commands.append(line)
 
-    with open('job.sh', 'w') as f:
+    return args, commands
+
+
+def parse_slurm_memory(value):
+
+    ''' Converts a Slurm memory request (i.e. "4000", "4000M", "4G") to MB '''
+
+    value = str(value).strip().upper()
+    units = {'K': 1./1024, 'M': 1, 'G': 1024, 'T': 1024**2}
+    if value and value[-1] in units:
+        return float(value[:-1])*units[value[-1]]
+    return float(value)
+
+
+def format_slurm_memory(mb):
+    return '{}M'.format(int(-(-mb//1)))
+
+
+def read_slurm_resources(args):
+
+    ''' Time limit (string) and memory request (option, MB) in a dictionnary of #SBATCH options.
+        Missing requests are returned as None. '''
+
+    time = args.get('--time', args.get('-t'))
+    memory = None
+    for key in ['--mem-per-cpu', '--mem']:
+        if key in args:
+            memory = (key, parse_slurm_memory(args[key]))
+            break
+
+    return time, memory
+
+
+def array_task_size(nloop, njobs, per_task=None):
+    ''' Number of directories computed by each task of a job array (the last task may compute less) '''
+    if per_task is None:
+        per_task = -(-nloop//njobs)
+    if per_task*njobs < nloop:
+        raise ValueError('{} tasks of {} directories cannot compute {} directories'.format(njobs, per_task, nloop))
+    return per_task
+
+
+def write_slurm_submitfile_loop(args, precommands, command, nloop, calcdir, njobs=1, indices=None, dirprefix='',
+                                fname='job.sh', per_task=None):
+
+    '''
+        Writes a Slurm submission script which runs the same commands in a series of directories.
+
+        Input:
+            args: dictionnary of #SBATCH options
+
+            precommands: list of command lines executed once per job (or array task), before the loop
+
+            command: list of command lines executed in each directory
+
+            nloop: number of directories
+
+            calcdir: directory containing the calculation directories
+
+            njobs: number of tasks of the job array. The directories are distributed in contiguous packs of
+                   per_task directories, which are computed sequentially by each task: task t computes
+                   the directories indices[t*per_task:(t+1)*per_task].
+                   Default: 1 (no job array, a single job loops over all directories)
+
+            indices: list of the nloop directory indices
+                     Default: None (0, 1, ..., nloop-1)
+
+            dirprefix: directories are named <dirprefix><index>
+                       Default: "" (directories named 0, 1, ...)
+
+            fname: name of the submission script
+                   Default: "job.sh"
+
+            per_task: number of directories computed by each array task
+                      Default: None (ceil(nloop/njobs))
+    '''
+
+    if indices is None:
+        indices = list(range(nloop))
+    if len(indices) != nloop:
+        raise ValueError('indices should contain nloop={} elements, but I got {}'.format(nloop, len(indices)))
+
+    with open(fname, 'w') as f:
 
         f.write('#!/usr/bin/bash\n')
         # enumerate slurm args and write them
         for key, val in args.items():
-            f.write(f'#SBATCH {key}={val}\n')
+            if key.startswith('--'):
+                f.write(f'#SBATCH {key}={val}\n')
+            else:
+                f.write(f'#SBATCH {key} {val}\n')
         if njobs>1:
             f.write(f'#SBATCH --array 0-{njobs-1}\n')
         f.write('\n')
@@ -50,39 +458,18 @@ def write_slurm_submitfile_loop(args, precommands, command, nloop, calcdir, njob
         f.write('\n')
 
         f.write(f'cd {calcdir}\n\n')
+        f.write('indices=({})\n'.format(' '.join([str(i) for i in indices])))
         # define job index
         if njobs>1:
-            # case n
-            f.write(f'maxarray={njobs}\n')
-            f.write(f'njobs={nloop}\n')
-            f.write('array=$SLURM_ARRAY_TASK_ID\n')
-            f.write(f'jobs_per_array=$((njobs/maxarray))\n\n')
-
-            f.write(f'if [ $array -eq $((maxarray-1)) ] && [ $(( (array+1)*jobs_per_array-1 )) -ne $((njobs-1)) ]\n')
-            f.write('then\n')
-            f.write(f'  for i in $(seq $((0+array*jobs_per_array)) $((njobs-1 )) ); do\n')
-            f.write(f'    cd $i\n')
-            for line in command:
-                f.write(f'    {line}\n')
-            f.write('    cd ..\n')
-            f.write('  done\n')
-
-            f.write('else\n')
-            f.write(f'  for i in $(seq $((0+array*jobs_per_array)) $(( (array+1)*jobs_per_array-1 )) ); do\n')
-            f.write(f'    cd $i\n')
-            for line in command:
-                f.write(f'    {line}\n')
-            f.write('    cd ..\n')
-            f.write('  done\n')
-            f.write('fi\n')
-
+            per_task = array_task_size(nloop, njobs, per_task)
+            f.write(f'per_task={per_task}\n')
+            f.write('first=$((SLURM_ARRAY_TASK_ID*per_task))\n\n')
+            f.write('for i in ${indices[@]:$first:$per_task}; do\n')
         else:
-            # write the loop main command
-            f.write(f'for i in $(seq $(()) {nloop-1}); do\n')
-            f.write(f'  cd $i\n')
-            for line in command:
-                f.write(f'  {line}\n')
-            f.write('  cd ..\n')
-            f.write('done\n')
-
-    f.close()
+            f.write('for i in ${indices[@]}; do\n')
+
+        # write the loop main command
+        f.write(f'  cd {calcdir}/{dirprefix}$i\n')
+        for line in command:
+            f.write(f'  {line}\n')
+        f.write('done\n')
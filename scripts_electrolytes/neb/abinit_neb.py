@@ -3,14 +3,26 @@ from ..interfaces.abinit_histfile import read_neb_efs
 import logging
 import os
 import numpy as np
-from abipy.dynamics.hist import HistFile
-from abipy.core.structure import Structure
-from ..utils.constants import ha_to_ev, bohr_to_ang
+from ..utils.lazy import lazy_import
+from ..utils import constants
+
+abihist = lazy_import('abipy.dynamics.hist')
 
 class HistNebData(NebData):
 
-    def __init__(self, fname=None, rootname='neb_from_hist', rescale_energy=True):
-        
+    def __init__(self, fname=None, rootname='neb_from_hist', rescale_energy=True, force_tol=None, verbose=True):
+
+        '''
+            NEB results from an Abinit HIST.nc file.
+
+            Input:
+                force_tol: maximal atomic force on the intermediate images for the run to be considered converged, in eV/Ang
+                           Default: None (Abinit default tolmxf, 5E-5 Ha/Bohr)
+
+                verbose: print the energy barriers
+                         Default: True
+        '''
+
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
         try:
@@ -19,14 +31,18 @@ class HistNebData(NebData):
             raise NameError('File {} does not exist. Please provide the correct path to the Abinit HIST.nc file containing NEB results.'.format(fname))
 
         super(HistNebData, self).__init__(fname, rootname)
+        if force_tol is None:
+            force_tol = 5E-5*constants.ha_to_ev/constants.bohr_to_ang
+        self.force_tol = force_tol
         self.read_data(rescale_energy)
 
-        self.print_barriers()
+        if verbose:
+            self.print_barriers()
 
 
     def read_data(self, rescale_energy):
         
-        hist = HistFile(self.fname)
+        hist = abihist.HistFile(self.fname)
         self.natoms = hist.reader.read_dimvalue('natom')
 
         self.potential_energy, forces, stresses = read_neb_efs(hist)
@@ -36,6 +52,19 @@ class HistNebData(NebData):
         nimage = hist.reader.read_dimvalue('nimage')
         self.reaction_coordinate = np.linspace(0, 1, num=nimage, endpoint=True)
 
+        # Path length: sum of the 3N-dimensional distances between consecutive images (minimum image convention)
+        xred = hist.reader.read_value('xred')[-1]
+        rprimd = hist.reader.read_value('rprimd')[-1]
+        dred = xred[1:] - xred[:-1]
+        dred -= np.round(dred)
+        dcart = np.einsum('iad, idk -> iak', dred, rprimd[:-1])*constants.bohr_to_ang
+        self.reaction_coordinate_length = np.sum(np.linalg.norm(dcart.reshape(nimage-1, -1), axis=1))
+
+        # The end points are fixed, so only the intermediate images are checked for convergence
+        self.nsteps = hist.reader.read_dimvalue('time')
+        self.max_force = np.max(np.linalg.norm(forces[1:-1], axis=-1))
+        self.converged = bool(self.max_force <= self.force_tol)
+
         saddle = np.argmax(self.potential_energy)
         self.forward_barrier = np.max(self.potential_energy) - np.min(self.potential_energy[:saddle])
         self.backward_barrier = np.max(self.potential_energy) - np.min(self.potential_energy[saddle:])
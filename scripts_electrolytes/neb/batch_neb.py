@@ -0,0 +1,248 @@
+import os
+import csv
+import json
+import fnmatch
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .lammps_neb import LammpsNebData
+from .abinit_neb import HistNebData
+from ..utils.time import when_is_now
+from ..utils.lazy import lazy_import
+
+nc = lazy_import('netCDF4')
+
+# Columns of the NEB table, in order
+NEB_TABLE_COLUMNS = ['path', 'source', 'natoms', 'nimages', 'forward_barrier', 'backward_barrier', 'path_length',
+                     'max_force', 'nsteps', 'converged']
+
+
+class BatchNebData:
+
+    def __init__(self, root='.', cache='neb_cache.json', nprocs=None, lammps_log='log.lammps', lammps_replica_log='log.lammps.0',
+                 hist_pattern='*HIST.nc', rescale_energy=True, force_tol=None):
+
+        '''
+            Analyzes all the NEB calculations found under a root directory, in parallel, and gathers
+            their barriers, path lengths, number of images and convergence status in a single table.
+
+            Parsed results are cached by file modification time, so that scanning the same campaign again
+            only parses new or modified NEB runs.
+
+            Input:
+                root: directory searched recursively for NEB runs
+                      Default: "."
+
+                cache: json file in which parsed results are stored. Relative paths are taken from root.
+                       Default: "neb_cache.json" (None disables caching)
+
+                nprocs: number of worker processes
+                        Default: None (one per available core)
+
+                lammps_log, lammps_replica_log: names of the LAMMPS main and first replica log files.
+                                                A directory containing both is a LAMMPS NEB run (see LammpsNebData).
+                                                Default: "log.lammps", "log.lammps.0"
+
+                hist_pattern: pattern of the Abinit HIST.nc files of NEB runs (see HistNebData)
+                              Default: "*HIST.nc"
+
+                rescale_energy: set the energy of the initial image to 0
+                                Default: True
+
+                force_tol: convergence criterion of the Abinit NEB runs (see HistNebData)
+                           Default: None
+        '''
+
+        if not os.path.isdir(root):
+            raise FileNotFoundError('Directory {} not found'.format(root))
+
+        self.root = os.path.abspath(root)
+        if cache:
+            self.cache_fname = cache if os.path.isabs(cache) else os.path.join(self.root, cache)
+        else:
+            self.cache_fname = None
+        self.nprocs = nprocs
+        self.lammps_log = lammps_log
+        self.lammps_replica_log = lammps_replica_log
+        self.hist_pattern = hist_pattern
+        self.options = {'rescale_energy': rescale_energy, 'force_tol': force_tol}
+
+        self.results = {}
+        self.failed = {}
+
+        logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+
+    def discover_runs(self):
+
+        ''' Returns the list of NEB runs under root, as dictionnaries with the source ("lammps" or "hist"),
+            the run path (relative to root) and the files it is read from '''
+
+        runs = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            if self.lammps_log in filenames and self.lammps_replica_log in filenames:
+                runs.append({'source': 'lammps', 'path': os.path.relpath(dirpath, self.root),
+                             'files': [os.path.join(dirpath, self.lammps_log), os.path.join(dirpath, self.lammps_replica_log)]})
+            for fname in sorted(fnmatch.filter(filenames, self.hist_pattern)):
+                fname = os.path.join(dirpath, fname)
+                runs.append({'source': 'hist', 'path': os.path.relpath(fname, self.root), 'files': [fname]})
+
+        return runs
+
+
+    def file_identity(self, run):
+        return [[os.path.relpath(fname, self.root), os.stat(fname).st_mtime_ns] for fname in run['files']]
+
+
+    def load_cache(self):
+
+        if self.cache_fname and os.path.exists(self.cache_fname):
+            with open(self.cache_fname, 'r') as f:
+                cache = json.load(f)
+            # Results parsed with other options cannot be reused
+            if cache.get('options') == self.options:
+                return cache['runs']
+        return {}
+
+
+    def save_cache(self, entries):
+
+        if not self.cache_fname:
+            return
+        tmp = '{}.tmp'.format(self.cache_fname)
+        with open(tmp, 'w') as f:
+            json.dump({'options': self.options, 'runs': entries}, f)
+        os.replace(tmp, self.cache_fname)
+
+
+    def analyze(self):
+
+        '''
+            Parses all the NEB runs which are not in the cache (or were modified since), in a process pool.
+            Returns the list of results, sorted by run path. Failed runs are listed in self.failed.
+        '''
+
+        runs = self.discover_runs()
+        cache = self.load_cache()
+
+        entries = {}
+        todo = []
+        for run in runs:
+            identity = self.file_identity(run)
+            entry = cache.get(run['path'])
+            if entry is not None and entry['files'] == identity:
+                entries[run['path']] = entry
+            else:
+                todo.append((run, identity))
+
+        logging.info('{}: Found {} NEB runs under {}, {} to parse'.format(when_is_now(), len(runs), self.root, len(todo)))
+
+        self.failed = {}
+        if todo:
+            with ProcessPoolExecutor(max_workers=self.nprocs) as executor:
+                futures = {executor.submit(analyze_neb_run, run, self.options): (run, identity) for run, identity in todo}
+
+                ndone = 0
+                for future in as_completed(futures):
+                    run, identity = futures[future]
+                    ndone += 1
+                    try:
+                        summary = future.result()
+                    except Exception as err:
+                        self.failed[run['path']] = err
+                        logging.warning('{}: [{}/{}] {} failed: {}'.format(when_is_now(), ndone, len(todo), run['path'], err))
+                    else:
+                        entries[run['path']] = {'files': identity, 'source': run['source'], 'summary': summary}
+                        logging.debug('{}: [{}/{}] {} parsed'.format(when_is_now(), ndone, len(todo), run['path']))
+
+        if self.failed:
+            logging.warning('{} of {} NEB runs could not be parsed: {}'.format(len(self.failed), len(runs), sorted(self.failed)))
+
+        # Runs which were removed from the campaign are dropped from the cache
+        self.save_cache(entries)
+
+        self.results = {}
+        for path in sorted(entries):
+            result = {'path': path, 'source': entries[path]['source']}
+            result.update(entries[path]['summary'])
+            self.results[path] = result
+
+        return list(self.results.values())
+
+
+    def table(self):
+
+        ''' Rows of the NEB table (list of lists, columns in NEB_TABLE_COLUMNS order) '''
+
+        if not self.results:
+            self.analyze()
+        return [[result[column] for column in NEB_TABLE_COLUMNS] for result in self.results.values()]
+
+
+    def write_csv(self, fname='neb_table.csv'):
+
+        rows = self.table()
+        with open(fname, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(NEB_TABLE_COLUMNS)
+            writer.writerows(rows)
+
+
+    def write_netcdf(self, fname='neb_table.nc'):
+
+        ''' Writes the NEB table, as well as the energy profile of each run (padded with NaN up to the largest number of images) '''
+
+        rows = self.table()
+        results = list(self.results.values())
+        nimages_max = max([result['nimages'] for result in results] + [1])
+
+        with nc.Dataset(fname, 'w') as dts:
+
+            dts.createDimension('number_of_runs', len(results))
+            dts.createDimension('number_of_images', nimages_max)
+            dts.setncattr('root_directory', self.root)
+
+            data = dts.createVariable('path', str, ('number_of_runs'))
+            for i, result in enumerate(results):
+                data[i] = result['path']
+
+            data = dts.createVariable('source', str, ('number_of_runs'))
+            for i, result in enumerate(results):
+                data[i] = result['source']
+
+            for column, dtype, units in [('natoms', 'i', None), ('nimages', 'i', None), ('forward_barrier', 'd', 'eV'),
+                                         ('backward_barrier', 'd', 'eV'), ('path_length', 'd', 'Angstrom'),
+                                         ('max_force', 'd', 'eV/Angstrom'), ('nsteps', 'i', None)]:
+                data = dts.createVariable(column, dtype, ('number_of_runs'))
+                if units:
+                    data.units = units
+                data[:] = np.asarray([row[NEB_TABLE_COLUMNS.index(column)] for row in rows])
+
+            # -1: unknown
+            data = dts.createVariable('converged', 'i', ('number_of_runs'))
+            data[:] = np.asarray([-1 if result['converged'] is None else int(result['converged']) for result in results])
+
+            for name, units in [('reaction_coordinate', None), ('potential_energy', 'eV')]:
+                profile = np.full((len(results), nimages_max), np.nan)
+                for i, result in enumerate(results):
+                    profile[i, :len(result[name])] = result[name]
+                data = dts.createVariable(name, 'd', ('number_of_runs', 'number_of_images'))
+                if units:
+                    data.units = units
+                data[:, :] = profile
+
+
+def analyze_neb_run(run, options):
+
+    ''' Worker function for BatchNebData: parses a single NEB run and returns its summary.
+        Defined at module level so that it can be sent to the process pool. '''
+
+    if run['source'] == 'lammps':
+        data = LammpsNebData(fname=run['files'][0], log_fname=run['files'][1], rescale_energy=options['rescale_energy'],
+                             verbose=False)
+    else:
+        data = HistNebData(fname=run['files'][0], rescale_energy=options['rescale_energy'], force_tol=options['force_tol'],
+                           verbose=False)
+
+    return data.summary()
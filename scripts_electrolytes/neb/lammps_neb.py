@@ -1,12 +1,14 @@
 import numpy as np
 import os
 from .neb import NebData, NebTraj
-from ..interfaces.lammps_interface import read_neb_logfile, read_config_from_dump, read_natoms
+from ..interfaces.lammps_interface import (read_neb_logfile, read_config_from_dump, read_natoms, read_neb_status,
+                                           read_neb_settings)
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 class LammpsNebData(NebData):
 
-    def __init__(self, fname='log.lammps', log_fname='log.lammps.0', rootname='neb_from_lammps', rescale_energy=True):
+    def __init__(self, fname='log.lammps', log_fname='log.lammps.0', rootname='neb_from_lammps', rescale_energy=True, verbose=True):
 
 
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
@@ -25,18 +27,51 @@ class LammpsNebData(NebData):
         self.log_fname = log_fname
 
         self.read_data(rescale_energy)
-        self.print_barriers()
+        self.read_status()
+        if verbose:
+            self.print_barriers()
 
     def read_data(self, rescale_energy):
         self.forward_barrier, self.backward_barrier, self.reaction_coordinate_length, self.reaction_coordinate, self.potential_energy = read_neb_logfile(self.fname, rescale_energy)
         self.natoms = read_natoms(self.log_fname)
 
+    def read_status(self):
+
+        ''' Convergence of the NEB run: the maximal atomic force should be below the ftol of the neb command.
+            If ftol is not available, the run is considered converged if it stopped before N1+N2 steps. '''
+
+        self.nsteps, self.max_replica_force, self.max_force = read_neb_status(self.fname)
+        settings = read_neb_settings(self.log_fname) or {}
+
+        if settings.get('ftol'):
+            self.converged = self.max_force <= settings['ftol']
+        elif settings.get('n1') is not None and settings.get('n2') is not None:
+            self.converged = self.nsteps < settings['n1'] + settings['n2']
+        else:
+            self.converged = None
+
 
 class LammpsNebTraj(NebTraj):
 
-    def __init__(self, in_rootname=None, nreplica=None,  atomic_numbers=None):
+    def __init__(self, in_rootname=None, nreplica=None,  atomic_numbers=None, nthreads=8):
+
+        '''
+            Final configuration of each replica of a LAMMPS NEB calculation, read from the dump.X files.
+
+            Input:
+                in_rootname: rootname of the dump files, i.e. "dump" for dump.1, dump.2...
+
+                nreplica: number of replicas (i.e. the total number of dump.X files)
+
+                atomic_numbers: list of atomic numbers of the LAMMPS atom types
+
+                nthreads: number of replicas read concurrently. Only the last configuration of each file is read,
+                          starting from the end of the file.
+                          Default: 8
+        '''
 
         self.check_input(in_rootname, nreplica, atomic_numbers)
+        self.nthreads = nthreads
 
         super(LammpsNebTraj, self).__init__(nreplica)
 
@@ -63,11 +98,9 @@ class LammpsNebTraj(NebTraj):
 
     def read_neb_trajectory(self):
 
-        # This will be a list of ASE Atoms objects
-        self.trajectory = []
-
         # LAMMPS NEB dump files for replicas start at 1
-        for irep in np.arange(1, self.nreplica+1):
-            fname = '{}.{}'.format(self.in_rootname, irep)
-            replica = read_config_from_dump(fname, self.atomic_numbers, which=-1)
-            self.trajectory.append(replica)
+        fnames = ['{}.{}'.format(self.in_rootname, irep) for irep in np.arange(1, self.nreplica+1)]
+
+        # This will be a list of ASE Atoms objects, in the replicas order
+        with ThreadPoolExecutor(max_workers=self.nthreads) as pool:
+            self.trajectory = list(pool.map(lambda fname: read_config_from_dump(fname, self.atomic_numbers, which=-1), fnames))
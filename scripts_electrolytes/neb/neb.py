@@ -1,9 +1,11 @@
 import os
 from ..plotter.neb_plotter import NebPathPlotter
 from ..plotter.colorpalettes import bright
-from ase.io import write as ase_write
+from ..utils.lazy import lazy_import
 import warnings
 
+ase_io = lazy_import('ase.io')
+
 ''' Basic class that calls the plotter '''
 # this is a different class in case I add Abinit output possibilities
 
@@ -40,6 +42,22 @@ class NebData:
         myplot.show_figure()
 
 
+    def summary(self):
+
+        ''' Dictionnary of the results of the NEB run, as tabulated by BatchNebData '''
+
+        return {'natoms': int(self.natoms),
+                'nimages': len(self.reaction_coordinate),
+                'forward_barrier': float(self.forward_barrier),
+                'backward_barrier': float(self.backward_barrier),
+                'path_length': float(self.reaction_coordinate_length),
+                'max_force': float(self.max_force),
+                'nsteps': int(self.nsteps),
+                'converged': self.converged,
+                'reaction_coordinate': [float(x) for x in self.reaction_coordinate],
+                'potential_energy': [float(e) for e in self.potential_energy]}
+
+
     def print_barriers(self):
 
         print('Forward (backward) energy barrier: {:.4f} ({:.4f}) eV'.format(self.forward_barrier, self.backward_barrier))
@@ -55,7 +73,7 @@ class NebTraj:
     def write_neb_trajectory(self, out_fname='nebtraj.xyz'):
 
         self.check_output_format(out_fname)
-        ase_write(filename=self.out_fname, images=self.trajectory, append=True)
+        ase_io.write(filename=self.out_fname, images=self.trajectory, append=True)
 
 
     def check_output_format(self, fname):
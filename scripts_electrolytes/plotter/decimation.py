@@ -0,0 +1,83 @@
+import numpy as np
+
+''' Shape-preserving downsampling of long time series, so that plotting cost does not scale with the trajectory length '''
+
+
+def lttb_indices(x, y, npoints):
+
+    '''
+        Largest-Triangle-Three-Buckets downsampling: returns the indices of npoints points of (x, y)
+        which preserve the visual shape of the curve (peaks and jumps are kept, unlike with regular striding).
+        The first and last points are always kept.
+
+        Input:
+            x, y: 1D arrays of the same length, x being sorted
+
+            npoints: number of points to keep. All indices are returned if the curve is shorter.
+    '''
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if npoints >= n or npoints < 3:
+        return np.arange(n)
+
+    # npoints-2 buckets between the first and last points, each containing at least one point
+    edges = np.linspace(1, n-1, npoints-1).astype(int)
+    indices = np.empty(npoints, dtype=int)
+    indices[0] = 0
+    indices[-1] = n-1
+
+    a = 0
+    for i in range(npoints-2):
+        start, end = edges[i], edges[i+1]
+        if i < npoints-3:
+            xnext = np.mean(x[end:edges[i+2]])
+            ynext = np.mean(y[end:edges[i+2]])
+        else:
+            xnext, ynext = x[-1], y[-1]
+
+        # Area of the triangle formed by the previously selected point, each candidate and the next bucket average
+        area = np.abs((x[a]-xnext)*(y[start:end]-y[a]) - (x[a]-x[start:end])*(ynext-y[a]))
+        a = start + int(np.argmax(area))
+        indices[i+1] = a
+
+    return indices
+
+
+def minmax_envelope(x, ys, nbuckets):
+
+    '''
+        Downsamples several curves sharing the same x by keeping, in each of nbuckets buckets,
+        the minimum and maximum of each curve (in their original order), so that the envelope of each curve is preserved.
+
+        Input:
+            x: 1D array of length npoints
+
+            ys: (npoints, ncurves) array
+
+            nbuckets: number of buckets. Curves are returned unchanged if they have less than 2*nbuckets points.
+
+        Returns the x and y values of the downsampled curves, as two (ncurves, npoints_kept) arrays.
+    '''
+
+    x = np.asarray(x, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    n, ncurves = np.shape(ys)
+    if 2*nbuckets >= n:
+        return np.broadcast_to(x, (ncurves, n)), ys.T
+
+    edges = np.linspace(0, n, nbuckets+1).astype(int)
+    curves = np.arange(ncurves)
+    xs = np.empty((ncurves, 2*nbuckets))
+    ys_kept = np.empty((ncurves, 2*nbuckets))
+
+    for b in range(nbuckets):
+        block = ys[edges[b]:edges[b+1]]
+        imin = edges[b] + np.argmin(block, axis=0)
+        imax = edges[b] + np.argmax(block, axis=0)
+        for k, idx in enumerate([np.minimum(imin, imax), np.maximum(imin, imax)]):
+            xs[:, 2*b+k] = x[idx]
+            ys_kept[:, 2*b+k] = ys[idx, curves]
+
+    return xs, ys_kept
@@ -1,8 +1,5 @@
-import matplotlib.pyplot as plt
 from .plotter import Plotter
 
-plt.rc('text', usetex=True)
-
 class EaPlotter(Plotter):
 
     def __init__(self, **kwargs):
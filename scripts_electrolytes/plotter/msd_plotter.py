@@ -1,8 +1,5 @@
-import matplotlib.pyplot as plt
 from .plotter import Plotter
 
-plt.rc('text', usetex=True)
-
 class MsdPlotter(Plotter):
 
     def __init__(self, **kwargs):
@@ -12,7 +9,7 @@ class MsdPlotter(Plotter):
 
     def set_labels(self):                                                                                                                                                                 
         self.ax.set_xlabel(r'time (ps)', fontsize=self.labelsize)
-        self.ax.set_ylabel(r'MSD (\AA$^2$)', fontsize=self.labelsize)
+        self.ax.set_ylabel(r'MSD ({}$^2$)'.format(self.angstrom), fontsize=self.labelsize)
 
     def set_limits(self):
         
@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 from ..interfaces.mtp_interface import read_errors
 from .plotter import Plotter
 
@@ -1,12 +1,12 @@
-import matplotlib.pyplot as plt
 from .plotter import Plotter
-from matplotlib.ticker import StrMethodFormatter
+from ..utils.lazy import lazy_import
 
-plt.rc('text', usetex=True)
-plt.rc('font', family='sans-serif')
+mticker = lazy_import('matplotlib.ticker')
 
 class NebPathPlotter(Plotter):
 
+    rc_params = {'text': {'usetex': True}, 'font': {'family': 'sans-serif'}}
+
     def __init__(self, **kwargs):
 
         super(NebPathPlotter, self).__init__(**kwargs)
@@ -16,7 +16,7 @@ class NebPathPlotter(Plotter):
         self.ax.set_xlabel(r'Normalized reaction coordinate', fontsize=self.labelsize)
         self.ax.set_ylabel(r'Energy (eV)', fontsize=self.labelsize)
 
-        self.ax.xaxis.set_major_formatter(StrMethodFormatter('{x:.1f}'))
-        self.ax.yaxis.set_major_formatter(StrMethodFormatter('{x:.2f}'))
+        self.ax.xaxis.set_major_formatter(mticker.StrMethodFormatter('{x:.1f}'))
+        self.ax.yaxis.set_major_formatter(mticker.StrMethodFormatter('{x:.2f}'))
 
         self.ax.tick_params(axis='both', labelsize=self.labelsize-2)
@@ -1,8 +1,11 @@
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import os
+import numpy as np
+from .decimation import lttb_indices, minmax_envelope
+from ..utils.lazy import lazy_import
 
-plt.rc('text', usetex=True)
+mpl = lazy_import('matplotlib')
+plt = lazy_import('matplotlib.pyplot')
+mcollections = lazy_import('matplotlib.collections')
 
 class Plotter:
 
@@ -17,17 +20,33 @@ class Plotter:
                 showfig: Boolean, display figure or not
                 linecolor: color for lineplot
                 fitcolor: color for linear fit
+                fast: Boolean, fast rendering mode for batch/headless use: text is rendered with mathtext
+                      instead of LaTeX, paths are simplified, figures are not shown by default
+                      and are closed once saved.
+                      Default: False
+                max_points: maximal number of points per curve for the curves drawn with downsample_indices
+                            and plot_curves, which are downsampled preserving their shape.
+                            Default: 2000 in fast mode, None (no downsampling) otherwise
 
             kwargs without default values (ignored if not specified):
                 title: figure title
     '''
 
+    # Global matplotlib settings, applied when a figure is created rather than when the module is imported
+    rc_params = {'text': {'usetex': True}}
+    # Settings which override rc_params in fast mode
+    fast_rc_params = {'text': {'usetex': False}, 'mathtext': {'fontset': 'cm'},
+                      'path': {'simplify': True, 'simplify_threshold': 1.0}, 'agg.path': {'chunksize': 10000}}
+
     def __init__(self, ax=None, **kwargs):
 
         self._init_figure(ax=ax, **kwargs)
 
     def _init_figure(self, ax=None, **kwargs):
 
+        self.fast = kwargs.get('fast', False)
+        self.max_points = kwargs.get('max_points', 2000 if self.fast else None)
+        self.set_rc_params()
         if ax:
             self.ax = ax
             self.fig = ax.get_figure()
@@ -36,6 +55,18 @@ class Plotter:
             self.set_size(*kwargs.get('figsize', (6, 6)))
             # FIX ME: test the code without providing ax in the input
 
+    def set_rc_params(self):
+        rc_params = dict(self.rc_params)
+        if self.fast:
+            rc_params.update(self.fast_rc_params)
+        for group, params in rc_params.items():
+            plt.rc(group, **params)
+
+    @property
+    def angstrom(self):
+        # \AA is a LaTeX text command, which mathtext does not understand
+        return r'\AA' if plt.rcParams['text.usetex'] else '\u00c5'
+
     def set_size(self, w, h):
         ''' Set figure size'''
         self.fig.set_size_inches(w, h)
@@ -46,7 +77,7 @@ class Plotter:
         self.set_labelsize(kwargs.get('labelsize', 16))
         self.set_figname(kwargs.get('figname', defname))
         self.set_savefig(kwargs.get('savefig', True))
-        self.set_showfig(kwargs.get('showfig', True))
+        self.set_showfig(kwargs.get('showfig', not self.fast))
         self.set_marker(kwargs.get('marker', 'o'))
         self.set_linecolor(kwargs.get('linecolor', False))
         self.set_fitcolor(kwargs.get('fitcolor', False))
@@ -106,8 +137,40 @@ class Plotter:
             except OSError:
                 pass
             pathname = os.path.join('figures', self.figname)
-            plt.savefig(pathname, bbox_inches='tight')
+            self.fig.savefig(pathname, bbox_inches='tight')
 
     def show_figure(self):
         if self.showfig:
             plt.show()
+        elif self.fast:
+            # Batch rendering: release the figure once it is saved
+            plt.close(self.fig)
+
+    def downsample_indices(self, x, y):
+        ''' Indices of the points of the curve (x, y) to draw, at most max_points (see decimation.lttb_indices) '''
+        if self.max_points:
+            return lttb_indices(x, y, self.max_points)
+        return np.arange(len(x))
+
+    def plot_curves(self, x, ys, **kwargs):
+
+        '''
+            Draws the columns of ys against x as a single LineCollection, colored with the axes color cycle.
+            This is much faster than one ax.plot per curve when there are many curves (i.e. one per atom).
+            If max_points is set, the curves are downsampled with decimation.minmax_envelope.
+            kwargs are passed to LineCollection (linewidth, linestyle, alpha...).
+        '''
+
+        ys = np.asarray(ys)
+        if self.max_points:
+            xs, ys = minmax_envelope(x, ys, self.max_points//2)
+        else:
+            xs, ys = np.broadcast_to(x, (np.shape(ys)[1], len(x))), ys.T
+
+        colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        lines = mcollections.LineCollection(np.stack((xs, ys), axis=-1),
+                                            colors=[colors[i%len(colors)] for i in range(len(xs))], **kwargs)
+        self.ax.add_collection(lines)
+        self.ax.autoscale_view()
+
+        return lines
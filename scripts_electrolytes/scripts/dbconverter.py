@@ -28,7 +28,7 @@ from scripts_electrolytes.database.db_converter import DbConverter
         start: Integer, index of the first configuration to convert
                Default: 0
 
-        every: Integer, convert every "Every" configuration (i.e. data.structures[start::every])
+        every: Integer, convert every "Every" configuration (i.e. configurations[start::every])
                Default: 1 (all)
 
         ex: the following command converts a database called mydatabase in .cfg format to .xyz format
@@ -0,0 +1,169 @@
+import os
+import numpy as np
+from ..interfaces.mtp_interface import split_cfg_configs, read_natom, read_lattice, split_atomic_data
+
+''' Diversity-based down-selection of the configurations selected for DFT, using cheap structural descriptors '''
+
+
+def read_cfg_structure(config):
+
+    ''' Returns the lattice, atom types (starting at 1) and cartesian positions of a .cfg configuration '''
+
+    natom = read_natom(config)
+    lattice = read_lattice(config)
+
+    start = [i for i, line in enumerate(config) if 'AtomData:' in line][0]
+    header = config[start]
+    atomdata = config[start+1:start+1+natom]
+    typat, xcart, _ = split_atomic_data(atomdata, header, natom, lattice)
+
+    return lattice, typat, xcart
+
+
+def structure_descriptor(lattice, typat, xcart, ntypes, rcut=6.0, nbins=24):
+
+    '''
+        Partial radial distribution descriptor of a periodic structure: for each pair of atomic species,
+        the histogram of interatomic distances (minimum image convention) up to rcut, per atom.
+        The volume per atom is appended, so that compressed and expanded cells are distinguished.
+
+        Input:
+            lattice: (3,3) array of lattice vectors (rows), in Angstrom
+
+            typat: atom types, starting at 1
+
+            xcart: (natom,3) array of cartesian positions, in Angstrom
+
+            ntypes: number of atomic species, which sets the descriptor length
+
+            rcut: cutoff radius of the histograms, in Angstrom
+                  Default: 6.0
+
+            nbins: number of bins of each histogram
+                   Default: 24
+    '''
+
+    natom = len(typat)
+    xred = np.matmul(xcart, np.linalg.inv(lattice))
+    dred = xred[None, :, :] - xred[:, None, :]
+    dred -= np.round(dred)
+    dist = np.linalg.norm(np.matmul(dred, lattice), axis=-1)
+
+    iu, ju = np.triu_indices(natom, k=1)
+    dist = dist[iu, ju]
+    ti = np.minimum(typat[iu], typat[ju])
+    tj = np.maximum(typat[iu], typat[ju])
+
+    edges = np.linspace(0., rcut, nbins+1)
+    hists = []
+    for a in range(1, ntypes+1):
+        for b in range(a, ntypes+1):
+            mask = (ti == a) & (tj == b)
+            hist, _ = np.histogram(dist[mask], bins=edges)
+            hists.append(hist/natom)
+
+    volume = np.abs(np.linalg.det(lattice))/natom
+
+    return np.append(np.concatenate(hists), volume)
+
+
+def farthest_point_sampling(descriptors, nkeep, start=0):
+
+    ''' Greedily picks nkeep rows of descriptors, each one being the farthest from those already picked.
+        Returns the sorted indices of the picked rows. '''
+
+    npoints = len(descriptors)
+    if nkeep >= npoints:
+        return list(range(npoints))
+
+    picked = [start]
+    mindist = np.linalg.norm(descriptors - descriptors[start], axis=1)
+    while len(picked) < nkeep:
+        idx = int(np.argmax(mindist))
+        picked.append(idx)
+        mindist = np.minimum(mindist, np.linalg.norm(descriptors - descriptors[idx], axis=1))
+
+    return sorted(picked)
+
+
+def kmedoids_sampling(descriptors, nkeep, max_iter=50):
+
+    ''' Partitions the rows of descriptors into nkeep clusters (k-medoids, initialized by farthest point sampling)
+        and returns the sorted indices of the medoids. '''
+
+    npoints = len(descriptors)
+    if nkeep >= npoints:
+        return list(range(npoints))
+
+    dist = np.linalg.norm(descriptors[:, None, :] - descriptors[None, :, :], axis=-1)
+    medoids = np.asarray(farthest_point_sampling(descriptors, nkeep))
+
+    for _ in range(max_iter):
+        labels = np.argmin(dist[:, medoids], axis=1)
+        new_medoids = medoids.copy()
+        for k in range(nkeep):
+            members = np.nonzero(labels == k)[0]
+            if len(members) == 0:
+                continue
+            new_medoids[k] = members[np.argmin(np.sum(dist[np.ix_(members, members)], axis=1))]
+        if np.array_equal(np.sort(new_medoids), np.sort(medoids)):
+            break
+        medoids = new_medoids
+
+    return sorted(int(m) for m in medoids)
+
+
+def downselect_cfg(fname, max_configs, method='fps', dropped_fname=None, rcut=6.0, nbins=24):
+
+    '''
+        Keeps at most max_configs structurally diverse configurations of a .cfg file, which is rewritten in place.
+
+        Input:
+            fname: .cfg file containing the configurations
+
+            max_configs: maximum number of configurations kept
+
+            method: "fps" (farthest point sampling) or "kmedoids"
+                    Default: "fps"
+
+            dropped_fname: .cfg file in which the dropped configurations are written
+                           Default: None (dropped configurations are discarded)
+
+            rcut, nbins: parameters of the descriptor (see structure_descriptor)
+
+        Returns the indices of the kept and dropped configurations in the original file.
+    '''
+
+    if method not in ['fps', 'kmedoids']:
+        raise ValueError('method should be "fps" or "kmedoids", but I got {}'.format(method))
+
+    configs = [config for config in split_cfg_configs(fname) if config and config[0].startswith('BEGIN_CFG')]
+    if len(configs) <= max_configs:
+        return list(range(len(configs))), []
+
+    structures = [read_cfg_structure(config) for config in configs]
+    ntypes = max(int(np.max(typat)) for _, typat, _ in structures)
+    descriptors = np.asarray([structure_descriptor(latt, typat, xcart, ntypes, rcut, nbins)
+                              for latt, typat, xcart in structures])
+    # Scale each component so that the volume does not dominate the histograms
+    scale = np.std(descriptors, axis=0)
+    scale[scale == 0] = 1.
+    descriptors = (descriptors - np.mean(descriptors, axis=0))/scale
+
+    if method == 'fps':
+        kept = farthest_point_sampling(descriptors, max_configs)
+    else:
+        kept = kmedoids_sampling(descriptors, max_configs)
+    dropped = [i for i in range(len(configs)) if i not in kept]
+
+    tmp = '{}.tmp'.format(fname)
+    with open(tmp, 'w') as f:
+        for i in kept:
+            f.writelines(configs[i])
+    if dropped_fname:
+        with open(dropped_fname, 'w') as f:
+            for i in dropped:
+                f.writelines(configs[i])
+    os.replace(tmp, fname)
+
+    return kept, dropped
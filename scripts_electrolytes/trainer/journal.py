@@ -0,0 +1,79 @@
+import os
+import json
+from ..utils.time import when_is_now
+
+
+class OtfJournal:
+
+    # Stages of an OTF iteration, in order
+    stages = ['md_done', 'selected', 'dft_submitted', 'dft_collected', 'trained', 'validated']
+
+    def __init__(self, fname, reset=False):
+
+        '''
+            Durable record of the completed stages of one OTF iteration, used to resume an interrupted
+            iteration from its last completed stage.
+
+            The journal is a json file containing the completion time of each stage and the data needed
+            to resume (number of selected configurations, DFT job IDs...). It is rewritten atomically
+            after each update, so a crash never leaves a partially written journal.
+
+            Input:
+                fname: path of the journal file
+
+                reset: discard an existing journal and start from scratch
+                       Default: False
+        '''
+
+        self.fname = os.path.abspath(fname)
+
+        if os.path.exists(self.fname) and not reset:
+            with open(self.fname, 'r') as f:
+                self.data = json.load(f)
+        else:
+            self.data = {'stages': {}}
+            self.save()
+
+
+    def save(self):
+
+        tmp = '{}.tmp'.format(self.fname)
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.fname)
+
+
+    def done(self, stage):
+
+        if stage not in self.stages:
+            raise ValueError('stage should be one of {}, but I got {}'.format(self.stages, stage))
+        return stage in self.data['stages']
+
+
+    def mark(self, stage, **data):
+
+        ''' Records that stage is completed, with optional data needed to resume '''
+
+        if stage not in self.stages:
+            raise ValueError('stage should be one of {}, but I got {}'.format(self.stages, stage))
+        self.data['stages'][stage] = when_is_now()
+        self.data.update(data)
+        self.save()
+
+
+    def update(self, **data):
+        self.data.update(data)
+        self.save()
+
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+    @property
+    def last_stage(self):
+
+        done = [stage for stage in self.stages if stage in self.data['stages']]
+        return done[-1] if done else None
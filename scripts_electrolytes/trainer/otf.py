@@ -2,17 +2,27 @@ import os
 import logging
 import json
 import subprocess as subp
-from ..interfaces.abinit_interface import poscar_to_abivars, load_abivars, input_from_dict
-from ..interfaces.slurm_interface import SlurmWatcher
+from ..interfaces.abinit_interface import (
+    cfg_to_abivars, load_abivars, input_from_dict, scan_abinit_log, scan_abinit_logs,
+    valence_electrons, kpoint_count, read_abinit_resources,
+)
+from ..interfaces.slurm_interface import read_slurm_submitfile, write_slurm_submitfile_loop, read_slurm_resources, format_slurm_memory
+from ..interfaces.executor_interface import SlurmExecutor, LocalExecutor
 from ..database.db_creator import MtpDbCreator
-from ..utils.time import when_is_now, increase_jobtime
+from .journal import OtfJournal
+from .workspace import IterLog, copy_file, count_configs
+from .diversity import downselect_cfg
+from .telemetry import OtfTelemetry, write_telemetry_report
+from ..utils.time import when_is_now, parse_jobtime, format_jobtime
 
 class OtfMtpTrainer:
 
     def __init__(self, mtp_path=None, init_mtp=None, init_train_db=None, abi_input=None,
                  dft_job_args=None, dft_job_script=None, username=None, train_job_args=None,
                  train_job_script=None, valid_db=None, submit=True, abicommand=None,
-                 restart_iterstep=None, stop_at_max_nsteps=False):
+                 restart_iterstep=None, stop_at_max_nsteps=False, scheduler=None, dft_array_packing=None,
+                 executor=None, stream_dft=False, max_dft_configs=None, diversity_method='fps',
+                 dft_warmstart=None, resource_model=None):
 
         '''
             Base class to train MTP models on-the-fly
@@ -52,6 +62,43 @@ class OtfMtpTrainer:
                                     even if there are configurations with gamma>gamma_select
                                     intended for initial aggregation of configurations from potentials trained from a small number of configs
                                     Default:False (stop OTF procedure when no configurations are preselected)
+
+                scheduler: SlurmBackend instance used to submit and monitor jobs when submit=True
+                           (see interfaces/slurm_interface.py)
+                           Default: None (standard sbatch/squeue/sacct commands)
+
+                dft_array_packing: when submit=True, submit all DFT calculations of an iteration as a single Slurm job array,
+                                   each array task computing this number of configurations sequentially.
+                                   The command lines of dft_job_script are then run in each config directory.
+                                   Default: None (one job per configuration)
+
+                executor: object running the DFT, MD and training jobs (see interfaces/executor_interface.py):
+                          SlurmExecutor submits jobs to the queue (submit=True), LocalExecutor runs them as local processes,
+                          possibly several DFT jobs concurrently (submit=False), and DryRunExecutor only records the commands.
+                          Default: None (SlurmExecutor if submit=True, sequential LocalExecutor otherwise)
+
+                stream_dft: check and collect each DFT calculation into train.cfg as soon as its job is done,
+                            and relaunch failed calculations immediately instead of after the whole batch.
+                            Default: False (wait for all DFT jobs, then check, relaunch and collect)
+
+                max_dft_configs: maximum number of configurations computed with DFT at each iteration. If mlp select-add
+                                 selects more, a structurally diverse subset is kept (see trainer/diversity.py) and the
+                                 other configurations are written to dropped_configs.cfg in the iteration directory.
+                                 Default: None (all selected configurations are computed)
+
+                diversity_method: how the subset is picked when max_dft_configs is exceeded,
+                                  "fps" (farthest point sampling) or "kmedoids"
+                                  Default: "fps"
+
+                dft_warmstart: DftWarmStartCache instance (see trainer/warmstart.py). The density (or wavefunctions) of each
+                               completed DFT calculation is stored, and each new calculation starts its SCF cycle from the
+                               most similar compatible configuration in the cache.
+                               Default: None (SCF cycles start from scratch)
+
+                resource_model: DftResourceModel instance (see trainer/resources.py), used when submit=True.
+                                The wall time and memory of each completed DFT calculation are recorded, and the
+                                --time and memory requests of new and relaunched DFT jobs are predicted from them.
+                                Default: None (requests of dft_job_script, increased by 1.5 on each TIME LIMIT relaunch)
         '''
 
         if not mtp_path:
@@ -127,6 +174,38 @@ class OtfMtpTrainer:
         self.restart_iterstep = restart_iterstep
         self.stop_at_max_nsteps = stop_at_max_nsteps
 
+        if executor is None:
+            if submit:
+                executor = SlurmExecutor(self.username, scheduler)
+            else:
+                executor = LocalExecutor()
+        elif submit and isinstance(executor, LocalExecutor):
+            raise ValueError('LocalExecutor runs jobs locally and cannot be used with submit=True.')
+        elif not submit and isinstance(executor, SlurmExecutor):
+            raise ValueError('SlurmExecutor submits jobs to the queue and cannot be used with submit=False.')
+        self.executor = executor
+        self.iter_log = None
+        self.stream_dft = stream_dft
+
+        if dft_array_packing is not None and (not isinstance(dft_array_packing, int) or dft_array_packing < 1):
+            raise ValueError('dft_array_packing should be a positive integer, but I got {}'.format(dft_array_packing))
+        self.dft_array_packing = dft_array_packing
+        self.config_tasks = {}
+        self.completed_tasks = {}
+        self.job_states = {}
+        self.dft_structs = []
+        self.dft_jobs = {}
+
+        if max_dft_configs is not None and (not isinstance(max_dft_configs, int) or max_dft_configs < 1):
+            raise ValueError('max_dft_configs should be a positive integer, but I got {}'.format(max_dft_configs))
+        if diversity_method not in ['fps', 'kmedoids']:
+            raise ValueError('diversity_method should be "fps" or "kmedoids", but I got {}'.format(diversity_method))
+        self.max_dft_configs = max_dft_configs
+        self.diversity_method = diversity_method
+        self.dft_warmstart = dft_warmstart
+        self.resource_model = resource_model
+        self.zval = None
+
         self.set_abivars(abi_input)
         
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
@@ -140,104 +219,355 @@ class OtfMtpTrainer:
         self.mlip_flags = json.load(open(fname))
 
 
+    def open_journal(self):
+        # Stage journal of the current iteration, only reused when restarting this iteration
+        # Must be run from iterdir
+        resume = self.restart_iterstep is not None and self.iterstep == self.restart_iterstep
+        self.journal = OtfJournal(os.path.join(self.iterdir, 'otf_journal.json'), reset=not resume)
+
+        if resume and self.journal.last_stage:
+            logging.info('    {}: Resuming iteration {} after stage {}'.format(when_is_now(), self.iterstep, self.journal.last_stage))
+            self.log('  Resuming after stage {}'.format(self.journal.last_stage))
+
+        # Timing events of all iterations are appended to a single file, next to the iteration directories
+        self.telemetry = OtfTelemetry(os.path.join(os.path.dirname(self.iterdir), 'otf_telemetry.jsonl'), self.iterstep)
+        self.dft_jobs = {}
+
+
     def preselect_configs(self):
         ''' Calls all tasks to perform one learning-on-the-fly cycle '''
 
-        # LAMMPS MD run to preselect extrapolative configurations
-        self.mdrun_select()
-        # Check if configurations were preselected during the MD run
-        npreselect = self.check_configs(f'{self.preselect_fname}')
+        if self.journal.done('md_done'):
+            self.max_nsteps_reached = self.journal.get('max_nsteps_reached')
+            return self.journal.get('npreselect')
+
+        with self.telemetry.stage('md') as counts:
+            # LAMMPS MD run to preselect extrapolative configurations
+            self.mdrun_select()
+            # Check if configurations were preselected during the MD run
+            npreselect = self.check_configs(f'{self.preselect_fname}')
+            counts['npreselect'] = npreselect
+        self.journal.mark('md_done', npreselect=npreselect, max_nsteps_reached=self.max_nsteps_reached)
 
         return npreselect
 
     def run_otf_iteration(self):
 
         # Select configurations for DFT calculations
-        self.select_configs()
-        nselect = self.check_configs('add_to_train.cfg')
-        # Evaluate selected configurations with DFT
-        self.launch_dft(nselect)
-        # Check job outputs and relaunch if necessary/requested
-        dft_error = self.check_dft_output(nselect)
-        
-        if dft_error:
-            self.relaunch_dft(nselect)
+        if self.journal.done('selected'):
+            nselect = self.journal.get('nselect')
+        else:
+            with self.telemetry.stage('select') as counts:
+                self.select_configs()
+                nselect = self.check_configs('add_to_train.cfg')
+                dropped = []
+                if self.max_dft_configs and nselect > self.max_dft_configs:
+                    nselect, dropped = self.downselect_configs('add_to_train.cfg')
+                counts.update(nselect=nselect, ndropped=len(dropped))
+            self.journal.mark('selected', nselect=nselect, dropped_configs=dropped)
+
+        if not self.journal.done('dft_collected'):
+            if self.stream_dft:
+                # Evaluate, check and collect each configuration as soon as its job is done
+                with self.telemetry.stage('dft', streamed=True) as counts:
+                    self.run_dft_streamed(nselect)
+                    counts.update(njobs=len(self.dft_jobs), ncollected=len(self.collected_configs))
+            else:
+                with self.telemetry.stage('dft') as counts:
+                    # Evaluate selected configurations with DFT
+                    self.launch_dft(nselect)
+                    # Check job outputs and relaunch if necessary/requested
+                    dft_error = self.check_dft_output(nselect)
+
+                    if dft_error:
+                        self.relaunch_dft(nselect)
+                    counts['njobs'] = len(self.dft_jobs)
+
+                with self.telemetry.stage('collect') as counts:
+                    # Collect energy/forces/stresses from DFT data
+                    self.collect_dft()
+                    counts['ncollected'] = nselect
+            self.record_dft_jobs()
+            self.journal.mark('dft_collected')
 
-        # Collect energy/forces/stresses from DFT data
-        self.collect_dft()
         # Retrain MTP potential
-        self.train_model()
+        if not self.journal.done('trained'):
+            with self.telemetry.stage('train'):
+                self.train_model()
+            self.journal.mark('trained')
+
+        if self.valid_db and not self.journal.done('validated'):
+            os.chdir(self.iterdir)
+            with self.telemetry.stage('validate'):
+                self.compute_validation_errors()
+            self.journal.mark('validated')
+
+
+    def record_dft_jobs(self):
+        # Queue wait and run time of the DFT jobs of this iteration, in the telemetry file
+        if self.dft_jobs:
+            times = self.executor.job_times(list(self.dft_jobs))
+            self.telemetry.dft_jobs(self.dft_jobs, times, self.job_states)
+
+
+    def assign_task(self, j, jobid):
+        # Job (or array task) computing configuration j
+        self.config_tasks[j] = jobid
+        self.dft_jobs.setdefault(jobid, []).append(j)
+
+
+    def journal_tasks(self):
+        # Configurations completed before a restart stay in the journal, so that a later restart does not relaunch them
+        self.journal.update(config_tasks=dict(list(self.completed_tasks.items()) + list(self.config_tasks.items())))
+
+
+    def write_report(self):
+        # Performance report of all iterations, from the telemetry file
+        # Must be run from the root directory
+        fname = 'otf_telemetry.jsonl'
+        if os.path.exists(fname):
+            write_telemetry_report(fname, 'otf_report.txt')
 
 
     def check_configs(self, fname):
-        nselect = int(subp.run('grep BEGIN_CFG {} | wc -l'.format(fname), shell=True, capture_output=True).stdout)
-        return nselect
+        return count_configs(fname)
+
+
+    def downselect_configs(self, fname):
+        # Keep a diverse subset of max_dft_configs selected configurations, the others are stored in dropped_configs.cfg
+        # Must be run from iterdir
+        kept, dropped = downselect_cfg(fname, self.max_dft_configs, method=self.diversity_method,
+                                       dropped_fname='dropped_configs.cfg')
 
-    def launch_dft(self, njobs):
+        logging.info('    {}: Kept {} of {} selected configurations for DFT'.format(when_is_now(), len(kept), len(kept)+len(dropped)))
+        self.log('  Kept {} of {} selected configurations ({}), dropped configurations {} written to dropped_configs.cfg'.format(
+                 len(kept), len(kept)+len(dropped), self.diversity_method, dropped))
+
+        return len(kept), dropped
+
+    def launch_dft(self, njobs, on_finished=None):
         logging.info('    {}: Running DFT calculcations...'.format(when_is_now()))
-        self.run('echo "  Preparing and launching DFT calculations. This may take some time.">>iter_output.txt')
+        self.log('  Preparing and launching DFT calculations. This may take some time.')
         os.makedirs('calc', exist_ok=True)
         self.calcdir = os.path.abspath('calc')
         os.chdir(self.calcdir)
 
-        self.run('echo "  Processing POSCAR files...">>../iter_output.txt')
-        command = self.set_convert_poscar_command()
+        self.log('  Processing selected configurations...')
+        self.read_selected_configs()
 
-        self.run(command)
-        
-        if njobs == 1:
-            self.launch_job(0, 'POSCAR')
-        else:
-            for j in range(njobs):
-                self.launch_job(j, 'POSCAR{}'.format(j))
+        # When resuming, skip configurations which were completed, and keep watching the jobs still in the queue
+        previous = {int(j): jobid for j, jobid in self.journal.get('config_tasks', {}).items()}
+        self.completed_configs = []
+        self.completed_tasks = {}
 
-        # Monitor job status if submitted to the queue
-        if self.submit:
-            self.watch_jobs('iter{}_config'.format(self.iterstep), msg='Watching DFT jobs...')
+        self.config_tasks = {}
+        launched = []
+        for j in range(njobs):
+            if j in previous:
+                if self.check_config_output(j) is None:
+                    self.completed_configs.append(j)
+                    self.completed_tasks[j] = previous[j]
+                    continue
+                if self.executor.resume(previous[j]):
+                    self.assign_task(j, previous[j])
+                    continue
+            launched.append(j)
+
+        self.write_dft_inputs(launched)
+        # The journal is updated after each submission, so that a crash before all jobs are submitted does not duplicate them
+        for j in launched:
+            self.launch_job(j)
+            if not self.use_job_array:
+                self.journal_tasks()
+
+        if self.use_job_array and launched:
+            self.launch_job_array(launched)
+            self.journal_tasks()
+
+        if previous:
+            self.log('  {} DFT calculations already completed, {} still running'.format(
+                     len(self.completed_configs), njobs-len(self.completed_configs)-len(launched)))
+        self.journal_tasks()
+        self.journal.mark('dft_submitted')
+
+        # Wait for all DFT jobs, either submitted to the queue or running locally
+        self.watch_jobs('iter{}_config'.format(self.iterstep), msg='Watching DFT jobs...', on_finished=on_finished)
+
+
+    def read_selected_configs(self):
+        # Structures of the configurations selected for DFT, read directly from add_to_train.cfg
+        self.dft_structs = cfg_to_abivars(os.path.join(self.iterdir, 'add_to_train.cfg'), self.atomic_species)
+
+
+    def write_dft_inputs(self, indices):
+        # Writes the Abinit input of each configuration in indices, in its config{j} directory
+        # Must be run from calcdir
+        for j in indices:
+            workdir = self.create_workdir(j)
+            os.chdir(workdir)
+            self.write_abi_input(self.dft_structs[j], self.warmstart_vars(j))
+            os.chdir(self.calcdir)
 
 
-    def launch_job(self, j, config):
-        # Must be run from calcdir
-        self.fix_poscar(config)
-        struct = poscar_to_abivars(config)
+    def warmstart_vars(self, j):
+        # Abinit variables to store the density/wavefunctions of config j and start from the nearest cached result
+        if self.dft_warmstart is None:
+            return {}
+
+        extra = dict(self.dft_warmstart.output_vars)
+        path = self.dft_warmstart.nearest(self.dft_structs[j], self.abivars)
+        if path is not None:
+            # The input reads its own copy, since the cached file may be evicted while the job is queued
+            path = self.dft_warmstart.checkout(path, os.path.join(self.calcdir, 'config{}'.format(j)))
+            extra.update(self.dft_warmstart.input_vars(path))
+        return extra
 
+
+    def store_warmstart(self, j):
+        if self.dft_warmstart is not None:
+            self.dft_warmstart.add('iter{}_config{}'.format(self.iterstep, j), os.path.join(self.calcdir, 'config{}'.format(j)),
+                                   self.dft_structs[j], self.abivars)
+
+
+    def launch_job(self, j):
+        # Must be run from calcdir, after write_dft_inputs
         workdir = self.create_workdir(j)
         os.chdir(workdir)
 
-        self.write_abi_input(struct)
-        
-        if self.submit:
+        if self.use_job_array:
+            # Input is only prepared, all configurations are submitted together by launch_job_array
+            pass
+        elif self.submit:
             if self.dft_job_args:
                 dft_job_args = self.dft_job_args + ' --job-name=iter{}_config{}'.format(self.iterstep, j)
             else:
                 dft_job_args = ' --job-name=iter{}_config{}'.format(self.iterstep, j)
-            command = "sbatch {} {}".format(dft_job_args, self.dft_jobscript)
+            dft_job_args += self.resource_args([j])
+            self.assign_task(j, self.submit_job('{} {}'.format(dft_job_args, self.dft_jobscript)))
         else:
-            command = "srun {} run.abi>& log".format(self.abicommand)
-        self.run(command)
+            command = "{} {} run.abi>& log".format(self.executor.launcher, self.abicommand)
+            self.assign_task(j, self.executor.launch(command, workdir=workdir))
         os.chdir(self.calcdir)
 
 
-    def watch_jobs(self, rootname, msg):
+    @property
+    def use_job_array(self):
+        return self.submit and self.dft_array_packing is not None
+
+
+    def launch_job_array(self, indices, arg=None):
+        # Submits the configurations in indices as one job array, packing dft_array_packing configurations per task
+        # arg: additional sbatch options, default: predicted resources
+        # Must be run from calcdir
+        if arg is None:
+            arg = self.resource_args(indices)
+        sbatch_args, commands = read_slurm_submitfile(self.dft_jobscript)
+        ntasks = -(-len(indices)//self.dft_array_packing)
+        # The same packing is used by the script and for the task mapping below
+        write_slurm_submitfile_loop(sbatch_args, [], commands, len(indices), self.calcdir, njobs=ntasks,
+                                    indices=indices, dirprefix='config', fname='dft_array.sh',
+                                    per_task=self.dft_array_packing)
+
+        dft_job_args = ' --job-name=iter{}_config {}'.format(self.iterstep, arg)
+        if self.dft_job_args:
+            dft_job_args = self.dft_job_args + dft_job_args
+        jobid = self.submit_job('{} dft_array.sh'.format(dft_job_args))
+
+        # Keep track of the array task computing each configuration
+        for n, j in enumerate(indices):
+            if ntasks > 1:
+                self.assign_task(j, '{}_{}'.format(jobid, n//self.dft_array_packing))
+            else:
+                self.assign_task(j, jobid)
+
+
+    def config_job_state(self, j):
+        # Final Slurm state of the job (or array task) which computed configuration j, if known
+        return self.job_states.get(self.config_tasks.get(j), None)
+
+
+    def submit_job(self, args):
+        # Submit with sbatch, the executor keeps track of the job ID for monitoring
+        return self.executor.launch(args)
+
+
+    def watch_jobs(self, rootname, msg, on_finished=None):
         os.chdir(self.iterdir)
-        watcher = SlurmWatcher(rootname, self.username)
-        watcher.watch(msg=msg)
+        self.job_states = self.executor.wait(rootname, msg=msg, on_finished=on_finished)
+
+
+    def run_dft_streamed(self, njobs):
+        # Pipelined DFT step: each configuration is checked, and either collected or relaunched, as soon as its job is done
+        os.chdir(self.iterdir)
+        self.log('  Collecting DFT results as jobs complete...')
+        copy_file('{}/../{}/train.cfg'.format(self.iterdir, self.iterstep-1), 'train.cfg')
+
+        self.nrelaunch = {}
+        self.failed_configs = {}
+        self.collected_configs = []
+        self.launch_dft(njobs, on_finished=self.on_dft_finished)
+        os.chdir(self.iterdir)
+
+        # Calculations completed before a restart
+        for j in self.completed_configs:
+            self.collect_config(j)
+
+        logging.info('    {}: {} of {} DFT calculations collected'.format(when_is_now(), len(self.collected_configs), njobs))
+        if self.failed_configs:
+            raise Exception('Some exceptions occured in iterstep {} for configs {}: {}. Stopping OTF procedure.'.format(
+                            self.iterstep, list(self.failed_configs.keys()), list(self.failed_configs.values())))
+
+
+    def on_dft_finished(self, jobid, state):
+        # Called by the executor when a DFT job (or array task) reaches a terminal state
+        self.job_states[jobid] = state
+        configs = [j for j, task in self.config_tasks.items() if task == jobid]
+
+        for j in configs:
+            err = self.check_config_output(j)
+            if err is None:
+                self.collect_config(j)
+                continue
+
+            nrelaunch = self.nrelaunch.get(j, 0)
+            relaunched = []
+            if self.relaunch and nrelaunch < self.max_relaunch:
+                relaunched = self.relaunch_configs([j], [err], nrelaunch)
+
+            if j in relaunched:
+                self.nrelaunch[j] = nrelaunch + 1
+                logging.info('    {}: config{} failed ({}), relaunched'.format(when_is_now(), j, err))
+            else:
+                self.failed_configs[j] = err
+                logging.warning('    {}: config{} failed ({})'.format(when_is_now(), j, err))
+
+
+    def collect_config(self, j):
+        db = MtpDbCreator(dbname=os.path.join(self.iterdir, 'train.cfg'), append=True)
+        db.db_from_gsr(os.path.join(self.calcdir, 'config{}'.format(j)))
+        self.collected_configs.append(j)
+        self.store_warmstart(j)
+        self.record_resources(j)
 
 
     def collect_dft(self):
         os.chdir(self.iterdir)
-        self.run('echo "  Collecting DFT results...">>iter_output.txt')
-        self.run('cp {}/../{}/train.cfg .'.format(self.iterdir, self.iterstep-1))
+        self.log('  Collecting DFT results...')
+        copy_file('{}/../{}/train.cfg'.format(self.iterdir, self.iterstep-1), 'train.cfg')
         db = MtpDbCreator(dbname='train.cfg', append=True)
         db.db_from_gsr(self.calcdir)
 
+        for j in range(len(self.dft_structs)):
+            self.store_warmstart(j)
+            self.record_resources(j)
+
 
     def train_model(self):
         # Start new training from the fitted potential from the previous iteration
         # Must run in iterdir
         os.chdir(self.iterdir)
         logging.info('    {}: Retraining MTP potential...'.format(when_is_now()))
-        self.run('echo "  Training potential from updated training set. This may take some time.">>iter_output.txt')
+        self.log('  Training potential from updated training set. This may take some time.')
 
         traincommand = self.set_traincommand()
         if self.mlip_flags:
@@ -253,25 +583,21 @@ class OtfMtpTrainer:
             else:
                 train_job_args = ' --job-name=iter{}_train'.format(self.iterstep)
 
-            self.run('cp {} train.sh'.format(self.train_jobscript))
+            copy_file(self.train_jobscript, 'train.sh')
 
             with open('train.sh', 'a') as f:
                 f.write('srun {} >&train_$SLURM_JOB_ID.out'.format(traincommand))
 
-            runcommand = "sbatch {} train.sh".format(train_job_args)
+            self.submit_job('{} train.sh'.format(train_job_args))
         else:
-            runcommand = 'srun {} >&train.out'.format(traincommand)
-
-        self.run(runcommand)
+            runcommand = '{} {} >&train.out'.format(self.executor.launcher, traincommand)
+            self.executor.run(runcommand)
         # Monitor training job if submitted to the queue
         if self.submit:
             self.watch_jobs('iter{}_train'.format(self.iterstep), msg='Watching training job...')
 
         logging.info('    {}: ... training completed\n\n'.format(when_is_now()))
-        self.run('echo "  Training completed\n\n">>iter_output.txt')
-
-        if self.valid_db:
-            self.compute_validation_errors()
+        self.log('  Training completed\n\n')
 
 
     def check_dft_output(self, njobs):
@@ -279,34 +605,13 @@ class OtfMtpTrainer:
         self.failed_calc_index = []
         self.errormsg = []
 
-        for j in range(njobs):
-            # Check for some typical errors
-            scf = self.check_process('grep -A2 ScfConvergenceWarning config{}/log*'.format(j))
-            if scf.returncode == 0:
-                self.failed_calc_index.append(j)
-                self.errormsg.append('scfconv')
-                # update nstep in abivars dictionnary
-                nstep = int(str(scf.stdout).split('nstep ')[1].split(' ')[0])
-                self.abivars['nstep'] = int(1.5*nstep)
-                continue
-
-            oom = self.check_process('grep  "out-of-memory handler" config{}/log*'.format(j))
-            if oom.returncode == 0:
+        # All log files are scanned concurrently
+        workdirs = [os.path.join(self.calcdir, 'config{}'.format(j)) for j in range(njobs)]
+        for j, (status, nstep) in enumerate(scan_abinit_logs(workdirs)):
+            err = self.classify_dft_output(j, status, nstep)
+            if err is not None:
                 self.failed_calc_index.append(j)
-                self.errormsg.append('memory')
-                continue
-
-            time = self.check_process('grep  "TIME LIMIT" config{}/log*'.format(j))
-            if time.returncode == 0:
-                self.failed_calc_index.append(j)
-                self.errormsg.append('timelimit')
-                continue
-
-            end_ok = self.check_process('grep  "Calculation completed" config{}/log*'.format(j))
-            if end_ok.returncode != 0:
-                self.failed_calc_index.append(j)
-                self.errormsg.append('unknown')
-                continue
+                self.errormsg.append(err)
 
         if len(self.failed_calc_index)>0:
             return True
@@ -314,9 +619,29 @@ class OtfMtpTrainer:
             return False
 
 
-    def check_process(self, command):
-        output = subp.run(command, shell=True, capture_output=True)
-        return output
+    def check_config_output(self, j):
+        # Returns the type of error for configuration j, or None if the calculation completed
+        status, nstep = scan_abinit_log(os.path.join(self.calcdir, 'config{}'.format(j)))
+        return self.classify_dft_output(j, status, nstep)
+
+
+    def classify_dft_output(self, j, status, nstep):
+
+        if status == 'scfconv':
+            # update nstep in abivars dictionnary
+            if nstep is not None:
+                self.abivars['nstep'] = int(1.5*nstep)
+            return 'scfconv'
+
+        if status == 'unknown':
+            # In a packed job array, configurations which did not start before the task was killed have no log
+            state = self.config_job_state(j)
+            if state == 'TIMEOUT':
+                return 'timelimit'
+            elif state == 'OUT_OF_MEMORY':
+                return 'memory'
+
+        return status
 
 
     def relaunch_dft(self, njobs):
@@ -328,47 +653,11 @@ class OtfMtpTrainer:
 
         nrelaunch = 0
         while nrelaunch < self.max_relaunch:
-            os.chdir(self.calcdir)
-            for j, err in zip(self.failed_calc_index, self.errormsg):
-                if err == 'scfconv':
-                    try:
-                        self.launch_job(j, 'POSCAR{}'.format(j))
-                    except:
-                        self.launch_job(j, 'POSCAR')
-
-                if self.submit:  # "oom", "time" should only be relevant for submitted jobs. "unknown", well... check it out!
-                    # relaunch options, relaunch job if submit, modifying parameters as needed
-                    # errormsg : in "memory", "timelimit', 'unknown'
-                    if err == 'timelimit':
-                        # ADD A CHECK IF -t OR --time is in dft_job_args
-                        try:
-                            output = self.check_process("grep -- ' -t ' {}".format(self.dft_jobscript))
-                            time = str(output.stdout).split(' -t ')[1].split('\\n')[0]
-                        except:
-                            output = self.check_process("grep -- ' --time ' {}".format(self.dft_jobscript))
-                            time = str(output.stdout).split(' --time ')[1].split('\\n')[0]
-
-                        jobtime = increase_jobtime(time)
-                        arg = '--time {}'.format(jobtime)
-                        self.relaunch_dft_job(j, arg)
-                    
-                    if err == 'memory':
-                        raise NotImplementedError('Automatic memory increase not implemented. Do it or fix it by hand.')
-                        try:
-                            output = self.check_process("grep -- ' -m ' {}".format(self.dft_jobscript))
-                            time = str(output.stdout).split(' -t ')[1].split('\\n')[0]
-                        except:
-                            output = self.check_process("grep -- ' --time ' {}".format(self.dft_jobscript))
-                            time = str(output.stdout).split(' --time ')[1].split('\\n')[0]
-
-                        jobtime = increase_jobtime(time, 1.25**nrelaunch)
-                        arg = '--time {}'.format(jobtime)
-                        self.relaunch_dft_job(j, arg)
+            self.relaunch_configs(self.failed_calc_index, self.errormsg, nrelaunch)
 
             os.chdir(self.iterdir) # returning to the iter directory for job monitoring
-            # Monitor job status if submitted to the queue
-            if self.submit:
-                self.watch_jobs('iter{}_config'.format(self.iterstep), msg='Watching DFT jobs, relaunch={}...'.format(nrelaunch+1))
+            # Wait for the relaunched jobs
+            self.watch_jobs('iter{}_config'.format(self.iterstep), msg='Watching DFT jobs, relaunch={}...'.format(nrelaunch+1))
 
             dft_error = self.check_dft_output(njobs) #-> break if not ok
             if dft_error:
@@ -379,6 +668,148 @@ class OtfMtpTrainer:
         raise Exception('The number of DFT relaunch in iterstep {} reached max_relaunch = {}'.format(self.iterstep, self.max_relaunch))
 
 
+    def relaunch_configs(self, indices, errors, nrelaunch):
+        # Relaunches the failed configurations, modifying parameters as needed
+        # Returns the list of configurations which were relaunched
+        owd = os.getcwd()
+        os.chdir(self.calcdir) # launching must be done from calcdir
+        relaunched = []
+        # Configurations to resubmit as job arrays, in packed mode
+        array_indices = []
+        # Configurations relaunched with larger time or memory requests, by error
+        resized_indices = {}
+        for j, err in zip(indices, errors):
+            if err == 'scfconv':
+                self.write_dft_inputs([j])
+                self.launch_job(j)
+                array_indices.append(j)
+                relaunched.append(j)
+
+            if self.submit:  # "oom", "time" should only be relevant for submitted jobs. "unknown", well... check it out!
+                # relaunch options, relaunch job if submit, increasing the failed request at each relaunch
+                # errormsg : in "memory", "timelimit', 'unknown'
+                if err in ['timelimit', 'memory']:
+                    if self.use_job_array:
+                        resized_indices.setdefault(err, []).append(j)
+                    else:
+                        self.relaunch_dft_job(j, self.relaunch_resource_args([j], err, nrelaunch))
+                    relaunched.append(j)
+
+        if self.use_job_array:
+            if array_indices:
+                self.launch_job_array(array_indices)
+            for err, err_indices in resized_indices.items():
+                self.launch_job_array(err_indices, arg=self.relaunch_resource_args(err_indices, err, nrelaunch))
+
+        self.journal_tasks()
+        os.chdir(owd)
+        return relaunched
+
+
+    def resource_features(self, j):
+        # Number of atoms, valence electrons and k-points of configuration j, for the resource model
+        if self.zval is None:
+            self.zval = valence_electrons(self.abipseudos)
+        struct = self.dft_structs[j]
+        nelect = sum(self.zval[int(struct['znucl'][t-1])] for t in struct['typat'])
+        return len(struct['typat']), nelect, kpoint_count(self.abivars)
+
+
+    def record_resources(self, j):
+        # Adds the measured wall time and memory of the completed configuration j to the resource model.
+        # The memory is the peak memory per process recorded by Slurm (the largest of the configurations of an array task),
+        # or Abinit's a priori estimate if it is not available.
+        if self.resource_model is None:
+            return
+        walltime, memory, _ = read_abinit_resources(os.path.join(self.calcdir, 'config{}'.format(j)))
+        task = self.config_tasks.get(j)
+        if task is not None:
+            memory = self.executor.job_memory([task]).get(str(task), memory)
+        self.resource_model.record(*self.resource_features(j), walltime=walltime, memory=memory)
+
+
+    def predict_resources(self, indices):
+        # Predicted time limit (seconds) and memory per MPI process (MB) of a job computing the configurations in indices.
+        # In a job array, each task computes up to dft_array_packing configurations sequentially.
+        if self.resource_model is None:
+            return None, None
+
+        predictions = [self.resource_model.predict(*self.resource_features(j)) for j in indices]
+        nseq = self.sequential_configs(indices)
+
+        walltime, memory = None, None
+        if all(p[0] is not None for p in predictions):
+            walltime = min(nseq*max(p[0] for p in predictions), self.resource_model.max_time)
+        if all(p[1] is not None for p in predictions):
+            memory = max(p[1] for p in predictions)
+
+        return walltime, memory
+
+
+    def sequential_configs(self, indices):
+        # Number of configurations computed one after another by a job computing the configurations in indices
+        return min(self.dft_array_packing, len(indices)) if self.use_job_array else 1
+
+
+    def memory_request(self, memory):
+        # Converts a memory per MPI process (MB) into the memory option used in dft_job_script
+        # Returns (option, MB), or None if the number of tasks per node cannot be determined for --mem
+        sbatch_args = read_slurm_submitfile(self.dft_jobscript)[0]
+        key = read_slurm_resources(sbatch_args)[1]
+        key = key[0] if key else '--mem-per-cpu'
+
+        if key == '--mem-per-cpu':
+            cpus = int(sbatch_args.get('--cpus-per-task', sbatch_args.get('-c', 1)))
+            return key, memory/cpus
+
+        ntasks = sbatch_args.get('--ntasks-per-node')
+        if ntasks is None and int(sbatch_args.get('--nodes', sbatch_args.get('-N', 1))) == 1:
+            ntasks = sbatch_args.get('--ntasks', sbatch_args.get('-n'))
+        if ntasks is None:
+            return None
+        return key, memory*int(ntasks)
+
+
+    def resource_args(self, indices, time_factor=1., memory_factor=1.):
+        # sbatch options for the time and memory requests of a job computing the configurations in indices:
+        # predicted by the resource model if possible, otherwise those of dft_job_script. Each request is
+        # multiplied by its factor. A request is written when it is predicted, or when its factor (or the array packing
+        # for the time) changes the request of dft_job_script. The time is capped at the resource model max_time (7 days).
+        # The time of dft_job_script is for one configuration, and is multiplied by the number of configurations
+        # computed sequentially by each array task.
+        walltime, memory = self.predict_resources(indices)
+        script_time, script_memory = read_slurm_resources(read_slurm_submitfile(self.dft_jobscript)[0])
+        nseq = self.sequential_configs(indices)
+
+        args = ''
+        if walltime is None and (time_factor != 1. or nseq > 1) and script_time is not None:
+            walltime = nseq*parse_jobtime(script_time)
+        if walltime is not None:
+            max_time = self.resource_model.max_time if self.resource_model is not None else 7*24*3600
+            args += ' --time={}'.format(format_jobtime(min(walltime*time_factor, max_time)))
+
+        request = self.memory_request(memory) if memory is not None else None
+        if request is None and memory_factor != 1.:
+            request = script_memory
+        if request is not None:
+            args += ' {}={}'.format(request[0], format_slurm_memory(request[1]*memory_factor))
+
+        return args
+
+
+    def relaunch_resource_args(self, indices, err, nrelaunch):
+        # Larger time (TIME LIMIT) or memory (OUT OF MEMORY) requests for relaunched configurations
+        factor = 1.5**(nrelaunch+1)
+        if err == 'timelimit':
+            args = self.resource_args(indices, time_factor=factor)
+        else:
+            args = self.resource_args(indices, memory_factor=factor)
+            if '--mem' not in args:
+                raise Exception('Configurations {} ran out of memory, but no memory request was found in {}. '
+                                'Add --mem or --mem-per-cpu to the script.'.format(indices, self.dft_jobscript))
+        return args
+
+
     def relaunch_dft_job(self, idx, arg):
         # reset the dft_job_args with new arg and submit
         os.chdir('config{}'.format(idx))
@@ -386,19 +817,45 @@ class OtfMtpTrainer:
             dft_job_args = self.dft_job_args + ' --job-name=iter{}_config{} {}'.format(self.iterstep, idx, arg)
         else:
             dft_job_args = ' --job-name=iter{}_config{} {}'.format(self.iterstep, idx, arg)
-        command = "sbatch {} {}".format(dft_job_args, self.dft_jobscript)
-        self.run(command)
+        self.assign_task(idx, self.submit_job('{} {}'.format(dft_job_args, self.dft_jobscript)))
         os.chdir(self.calcdir)
 
 
-    def write_abi_input(self, struct):
-        input_from_dict(struct, self.abivars, self.abipseudos)
+    def write_abi_input(self, struct, extra_vars=None):
+        abivars = dict(self.abivars, **extra_vars) if extra_vars else self.abivars
+        input_from_dict(struct, abivars, self.abipseudos)
 
 
     def run(self, command):
+        # Flush the progress lines first, as the command may also write to iter_output.txt
+        self.flush_log()
         subp.run(command, shell=True)
 
 
+    def open_iter_log(self):
+        # Progress file of the current iteration, kept open during the whole iteration
+        # Must be run from iterdir
+        self.close_iter_log()
+        self.iter_log = IterLog(os.path.join(self.iterdir, 'iter_output.txt'))
+
+
+    def log(self, msg):
+        if self.iter_log is None:
+            self.open_iter_log()
+        self.iter_log.write(msg)
+
+
+    def flush_log(self):
+        if self.iter_log is not None:
+            self.iter_log.flush()
+
+
+    def close_iter_log(self):
+        if self.iter_log is not None:
+            self.iter_log.close()
+            self.iter_log = None
+
+
     def create_workdir(self, j):
         string = 'config{}'.format(j)
         os.makedirs(string, exist_ok=True) # FIX ME: remove the exist_ok ?
@@ -425,17 +882,23 @@ class OtfMtpTrainer:
                 raise FileNotFoundError(f'lammps_input file {lammps_input} not found')
             self.lammps_input = os.path.abspath(lammps_input)
 
+        # lammps_struct and temp can be lists, to run several MD replicas (see OtfMtp3Trainer)
         if not lammps_struct:
             raise ValueError('Must provide initial structure in .lmp format for LAMMPS as lammps_struct')
         else:
-            if not os.path.exists(lammps_struct):
-                raise FileNotFoundError(f'lammps_struct file {lammps_struct} not found')
-            self.lammps_struct = os.path.abspath(lammps_struct)
+            if not isinstance(lammps_struct, list):
+                lammps_struct = [lammps_struct]
+            for fname in lammps_struct:
+                if not os.path.exists(fname):
+                    raise FileNotFoundError(f'lammps_struct file {fname} not found')
+            self.md_structs = [os.path.abspath(fname) for fname in lammps_struct]
+            self.lammps_struct = self.md_structs[0]
 
         if not temp:
             raise ValueError('Must provide MD temperature as temp')
         else:
-            self.temperature = temp
+            self.md_temps = temp if isinstance(temp, list) else [temp]
+            self.temperature = self.md_temps[0]
 
         if not atomic_species:
             raise ValueError("Must provide the list of atomic species using chemical symbols, in the same order as the MTP data as atomic_species")
@@ -1,8 +1,8 @@
 import os
 import logging
-import subprocess as subp
 from ..utils.time import when_is_now
 from .otf import OtfMtpTrainer
+from .workspace import copy_file, touch, remove, file_contains
 
 class OtfMtp2Trainer(OtfMtpTrainer):
     '''
@@ -17,14 +17,21 @@ class OtfMtp2Trainer(OtfMtpTrainer):
     def __init__(self, mtp_path=None, init_mtp=None, init_train_db=None, abi_input=None,
                  dft_job_args=None, dft_job_script=None, username=None, train_job_args=None,
                  train_job_script=None, valid_db=None, submit=True, abicommand=None,
-                 restart_iterstep=None, mlip_flags=None, mlip_ini=None, stop_at_max_nsteps=False):
+                 restart_iterstep=None, mlip_flags=None, mlip_ini=None, stop_at_max_nsteps=False, scheduler=None,
+                 dft_array_packing=None, executor=None,
+                 stream_dft=False, max_dft_configs=None, diversity_method='fps',
+                 dft_warmstart=None, resource_model=None):
 
         super(OtfMtp2Trainer, self).__init__(mtp_path=mtp_path, init_mtp=init_mtp, init_train_db=init_train_db,
                                              abi_input=abi_input, dft_job_args=dft_job_args,
                                              dft_job_script=dft_job_script, username=username,
                                              train_job_args=train_job_args, train_job_script=train_job_script,
                                              valid_db=valid_db, submit=submit, abicommand=abicommand,
-                                             restart_iterstep=restart_iterstep, stop_at_max_nsteps=stop_at_max_nsteps)
+                                             restart_iterstep=restart_iterstep, stop_at_max_nsteps=stop_at_max_nsteps,
+                                             scheduler=scheduler, dft_array_packing=dft_array_packing,
+                                             executor=executor, stream_dft=stream_dft,
+                                             max_dft_configs=max_dft_configs, diversity_method=diversity_method,
+                                             dft_warmstart=dft_warmstart, resource_model=resource_model)
 
         self.preselect_fname = 'preselected.cfg'
 
@@ -40,8 +47,8 @@ class OtfMtp2Trainer(OtfMtpTrainer):
 
         self.owd = os.getcwd()
         os.makedirs('0', exist_ok=True)
-        os.system('cp {} 0/current.mtp'.format(self.init_mtp))
-        os.system('cp {} 0/train.cfg'.format(self.init_train))
+        copy_file(self.init_mtp, '0/current.mtp')
+        copy_file(self.init_train, '0/train.cfg')
         self.iterstep = 1
 
 
@@ -49,6 +56,8 @@ class OtfMtp2Trainer(OtfMtpTrainer):
                             atomic_species=None, relaunch=True, dry_run=False):
 
         self.set_lammps_variables(lammps_path, md_nsteps, lammps_input, lammps_struct, temp, atomic_species, relaunch)
+        if len(self.md_structs) > 1 or len(self.md_temps) > 1:
+            raise NotImplementedError('Multi-replica MD preselection is only implemented for OtfMtp3Trainer.')
         if dry_run:
             print('Dry run finished, all paths were checked. Proceed with training.')
             quit()
@@ -67,7 +76,9 @@ class OtfMtp2Trainer(OtfMtpTrainer):
             self.iterdir = os.path.abspath(iterdir)
             os.chdir(self.iterdir)
 
-            self.run(['echo "\nOTF learning step {}">>iter_output.txt'.format(self.iterstep)])
+            self.open_iter_log()
+            self.log('\nOTF learning step {}'.format(self.iterstep))
+            self.open_journal()
             npreselect = self.preselect_configs()
 
             if npreselect>0:
@@ -77,29 +88,31 @@ class OtfMtp2Trainer(OtfMtpTrainer):
                 if self.stop_at_max_nsteps and self.max_nsteps_reached:
                     # In stop_at_max_nsteps mode, use the last trained potential from the 1st completed MD run
                     finished = True
-                    self.run('cp current.mtp {}/final.mtp'.format(self.owd))
-                    self.run('cp train.cfg {}/final.cfg'.format(self.owd))
-                    self.run('echo "  Extrapolative confugurations were preselected but max MD steps was reached.\n  Stopping per user request.">>iter_output.txt')
+                    copy_file('current.mtp', '{}/final.mtp'.format(self.owd))
+                    copy_file('train.cfg', '{}/final.cfg'.format(self.owd))
+                    self.log('  Extrapolative confugurations were preselected but max MD steps was reached.\n  Stopping per user request.')
                     os.chdir(self.owd)
                 else:
                     os.chdir(self.owd)
 
             else:
                 finished = True
-                self.run('cp prev.mtp {}/final.mtp'.format(self.owd))
-                self.run('cp ../{}/train.cfg {}/final.cfg'.format(self.iterstep-1, self.owd))
-                self.run('echo "  No extrapolative configuration were preselected.">>iter_output.txt')
+                copy_file('prev.mtp', '{}/final.mtp'.format(self.owd))
+                copy_file('../{}/train.cfg'.format(self.iterstep-1), '{}/final.cfg'.format(self.owd))
+                self.log('  No extrapolative configuration were preselected.')
                 os.chdir(self.owd)
 
+        self.close_iter_log()
+        self.write_report()
         logging.info("{}: OTF learning scheme completed after {} steps".format(when_is_now(), self.iterstep))
 
     def compute_als(self):
         logging.info('    {}: Creating active learning state...'.format(when_is_now()))
-        self.run('echo "  Active set construction...">>iter_output.txt')
+        self.log('  Active set construction...')
         command = '{} calc-grade ../{}/current.mtp ../{}/train.cfg ../{}/train.cfg out.cfg --als-filename=state.als>>iter_output.txt'.format(
                   self.mtp, self.iterstep-1, self.iterstep-1, self.iterstep-1)
         self.run(command)
-        self.run('rm out.cfg')
+        remove('out.cfg')
 
 
     def mdrun_select(self):
@@ -107,29 +120,28 @@ class OtfMtp2Trainer(OtfMtpTrainer):
         self.compute_als()
 
         logging.info('    {}: Running MD trajectory...'.format(when_is_now()))
-        self.run('echo "  Running MD trajectory...">>iter_output.txt')
-        self.run(['cp ../{}/current.mtp prev.mtp'.format(self.iterstep-1)])
-        self.run('touch preselected.cfg')
+        self.log('  Running MD trajectory...')
+        copy_file('../{}/current.mtp'.format(self.iterstep-1), 'prev.mtp')
+        touch('preselected.cfg')
         command = '{} -v SEED 1 -v T {} -v NSTEP {} -v MLIP_INI {} -v STRUCT {} -log none -in {} &>lammps.log'.format(
                 self.lammps, self.temperature, self.mdsteps, self.mlip_ini, self.lammps_struct, self.lammps_input)
-        self.run(command)
+        self.executor.run(command)
 
         # Check if nsteps was reached
-        out = self.check_process(f'grep "Breaking threshold exceeded" lammps.log')
-        if out.returncode == 0:
+        if file_contains('lammps.log', 'Breaking threshold exceeded'):
             self.max_nsteps_reached = False
-            self.run('echo "        Breaking threshold exceeded">>iter_output.txt')
+            self.log('        Breaking threshold exceeded')
         else:
             self.max_nsteps_reached = True
-            self.run('echo "        Max MD steps was reached without exceeding beaking threshold">>iter_output.txt')
+            self.log('        Max MD steps was reached without exceeding beaking threshold')
 
 
     def select_configs(self):
-        self.run('echo "  Selecting configurations...">>iter_output.txt')
+        self.log('  Selecting configurations...')
         command = (f'{self.mtp} select-add ../{self.iterstep-1}/current.mtp ../{self.iterstep-1}/train.cfg {self.preselect_fname} add_to_train.cfg --als-filename=state.als>>iter_output.txt')
         self.run(command)
-        self.run('rm selected.cfg')
-        self.run('rm state.als')
+        remove('selected.cfg')
+        remove('state.als')
 
 
     def set_traincommand(self):
@@ -139,39 +151,10 @@ class OtfMtp2Trainer(OtfMtpTrainer):
             traincommand = "{} train prev.mtp train.cfg --trained-pot-name=current.mtp --update-mindist".format(self.mtp)
         return traincommand
 
-    def set_convert_poscar_command(self):
-        command = '{} convert-cfg ../add_to_train.cfg POSCAR --output-format=vasp-poscar>>../iter_output.txt'.format(self.mtp)
-        return command
-
-    def fix_poscar(self, fname):
-        # fix the POSCAR files produced by MTP as they do not include atomic species information
-        # According to the VASP wiki, this line should always be the 6th line, as the 5 first are mandatory
-        with open(fname, 'r+') as f:
-            content = f.readlines()
-            string = ' '+' '.join(self.atomic_species)+'\n'
-            content.insert(5, string)
-            f.seek(0)
-            f.writelines(content)
-
     def compute_validation_errors(self):
         return
 
 
-    def fix_poscar(self, fname):
-        # fix the POSCAR files produced by MTP as they do not include atomic species information
-        # According to the VASP wiki, this line should always be the 6th line, as the 5 first are mandatory
-        with open(fname, 'r+') as f:
-            content = f.readlines()
-            string = ' '+' '.join(self.atomic_species)+'\n'
-            content.insert(5, string)
-            f.seek(0)
-            f.writelines(content)
-
-
-    def run(self, command):
-        subp.run(command, shell=True)
-
-
     def set_mlip_variables(self, mlip_ini, training_flags):
 
         if not mlip_ini:
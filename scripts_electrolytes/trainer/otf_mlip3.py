@@ -1,8 +1,10 @@
 import os
 import logging
-import subprocess as subp
 from ..utils.time import when_is_now
 from .otf import OtfMtpTrainer
+from .workspace import copy_file, touch, file_contains
+from ..interfaces.executor_interface import LocalExecutor, DryRunExecutor
+from ..interfaces.mtp_interface import merge_cfg_files
 
 class OtfMtp3Trainer(OtfMtpTrainer):
     '''
@@ -18,14 +20,21 @@ class OtfMtp3Trainer(OtfMtpTrainer):
     def __init__(self, mtp_path=None, init_mtp=None, init_train_db=None, abi_input=None,
                  dft_job_args=None, dft_job_script=None, username=None, train_job_args=None,
                  train_job_script=None, valid_db=None, submit=True, abicommand=None,
-                 restart_iterstep=None, mlip_flags=None, training_mode='cfg', stop_at_max_nsteps=False):
+                 restart_iterstep=None, mlip_flags=None, training_mode='cfg', stop_at_max_nsteps=False, scheduler=None,
+                 dft_array_packing=None, executor=None,
+                 stream_dft=False, max_dft_configs=None, diversity_method='fps',
+                 dft_warmstart=None, resource_model=None):
 
         super(OtfMtp3Trainer, self).__init__(mtp_path=mtp_path, init_mtp=init_mtp, init_train_db=init_train_db,
                                              abi_input=abi_input, dft_job_args=dft_job_args,
                                              dft_job_script=dft_job_script, username=username,
                                              train_job_args=train_job_args, train_job_script=train_job_script,
                                              valid_db=valid_db, submit=submit, abicommand=abicommand,
-                                             restart_iterstep=restart_iterstep, stop_at_max_nsteps=stop_at_max_nsteps)
+                                             restart_iterstep=restart_iterstep, stop_at_max_nsteps=stop_at_max_nsteps,
+                                             scheduler=scheduler, dft_array_packing=dft_array_packing,
+                                             executor=executor, stream_dft=stream_dft,
+                                             max_dft_configs=max_dft_configs, diversity_method=diversity_method,
+                                             dft_warmstart=dft_warmstart, resource_model=resource_model)
 
         self.preselect_fname = 'preselected.cfg'
         self.mlip_path = 'prev.almtp'
@@ -49,15 +58,30 @@ class OtfMtp3Trainer(OtfMtpTrainer):
 
         self.owd = os.getcwd()
         os.makedirs('0', exist_ok=True)
-        os.system('cp {} 0/current.almtp'.format(self.init_mtp))
-        os.system('cp {} 0/train.cfg'.format(self.init_train))
+        copy_file(self.init_mtp, '0/current.almtp')
+        copy_file(self.init_train, '0/train.cfg')
         self.iterstep = 1
 
 
     def train_from_lammpsmd(self, lammps_path=None, md_nsteps=10000, lammps_input=None, lammps_struct=None, temp=None,
-                            atomic_species=None, relaunch=True, preselect_fname=None, dry_run=False):
+                            atomic_species=None, relaunch=True, preselect_fname=None, dry_run=False, md_seeds=None,
+                            md_cores_per_replica=None):
+
+        '''
+            Multi-replica preselection: lammps_struct and temp can be lists of structures and temperatures, and md_seeds
+            a list of random seeds. One MD replica is run for each (structure, temperature, seed) combination,
+            concurrently, each in its own md<N> subdirectory. Their preselected configurations are merged
+            and deduplicated before select_configs.
+
+            md_seeds: list of seeds for the LAMMPS SEED variable
+                      Default: None ([1])
+
+            md_cores_per_replica: number of cores given to each replica when several replicas run concurrently
+                                  Default: None (srun options are not modified)
+        '''
 
         self.set_lammps_variables(lammps_path, md_nsteps, lammps_input, lammps_struct, temp, atomic_species, relaunch)
+        self.set_md_replicas(md_seeds, md_cores_per_replica)
         if dry_run:
             print('Dry run finished, all paths were checked. Proceed with training.')
             quit()
@@ -79,7 +103,9 @@ class OtfMtp3Trainer(OtfMtpTrainer):
             self.iterdir = os.path.abspath(iterdir)
             os.chdir(self.iterdir)
 
-            self.run(['echo "\nOTF learning step {}">>iter_output.txt'.format(self.iterstep)])
+            self.open_iter_log()
+            self.log('\nOTF learning step {}'.format(self.iterstep))
+            self.open_journal()
             npreselect = self.preselect_configs()
 
             if npreselect>0:
@@ -89,45 +115,100 @@ class OtfMtp3Trainer(OtfMtpTrainer):
                 if self.stop_at_max_nsteps and self.max_nsteps_reached: 
                     # In stop_at_max_nsteps mode, use the last trained potential from the 1st completed MD run
                     finished = True
-                    self.run('cp current.almtp {}/final.almtp'.format(self.owd))
-                    self.run('cp train.cfg {}/final.cfg'.format(self.owd))
-                    self.run('echo "  Extrapolative configurations were preselected but max MD steps was reached.\n  Stopping per user request.">>iter_output.txt')
+                    copy_file('current.almtp', '{}/final.almtp'.format(self.owd))
+                    copy_file('train.cfg', '{}/final.cfg'.format(self.owd))
+                    self.log('  Extrapolative configurations were preselected but max MD steps was reached.\n  Stopping per user request.')
                     os.chdir(self.owd)
                 else:
                     os.chdir(self.owd)
 
             else:
                 finished = True
-                self.run('cp prev.almtp {}/final.almtp'.format(self.owd))
-                self.run('cp ../{}/train.cfg {}/final.cfg'.format(self.iterstep-1, self.owd))
-                self.run('echo "  No extrapolative configuration were preselected.">>iter_output.txt')
+                copy_file('prev.almtp', '{}/final.almtp'.format(self.owd))
+                copy_file('../{}/train.cfg'.format(self.iterstep-1), '{}/final.cfg'.format(self.owd))
+                self.log('  No extrapolative configuration were preselected.')
                 os.chdir(self.owd)
 
+        self.close_iter_log()
+        self.write_report()
         logging.info("{}: OTF learning scheme completed after {} steps".format(when_is_now(), self.iterstep))
 
 
+    def set_md_replicas(self, seeds, cores_per_replica):
+
+        if seeds is None:
+            seeds = [1]
+        elif not isinstance(seeds, list):
+            seeds = [seeds]
+        self.md_replicas = [{'struct': struct, 'temp': temp, 'seed': seed}
+                            for struct in self.md_structs for temp in self.md_temps for seed in seeds]
+        self.md_cores_per_replica = cores_per_replica
+
+
+    def set_lammps_command(self, replica, mlip_path, launcher='srun'):
+        command = '{} {} -v SEED {} -v T {} -v NSTEP {} -v MLIPPATH {} -v STRUCT {} -log none -in {} &>lammps.log'.format(
+                launcher, self.lammps, replica['seed'], replica['temp'], self.mdsteps, mlip_path, replica['struct'], self.lammps_input)
+        return command
+
+
     def mdrun_select(self):
         # Run MD trajectory in selection mode
         logging.info('    {}: Running MD trajectory...'.format(when_is_now()))
-        self.run('echo "  Running MD trajectory...">>iter_output.txt')
-        self.run(['cp ../{}/current.almtp prev.almtp'.format(self.iterstep-1)])
-        self.run(f'touch {self.preselect_fname}')
-        command = 'srun {} -v SEED 1 -v T {} -v NSTEP {} -v MLIPPATH {} -v STRUCT {} -log none -in {} &>lammps.log'.format(
-                self.lammps, self.temperature, self.mdsteps, self.mlip_path, self.lammps_struct, self.lammps_input)
-        self.run(command)
+        self.log('  Running MD trajectory...')
+        copy_file('../{}/current.almtp'.format(self.iterstep-1), 'prev.almtp')
+        touch(self.preselect_fname)
+
+        if len(self.md_replicas) == 1:
+            command = self.set_lammps_command(self.md_replicas[0], self.mlip_path, launcher=self.executor.launcher)
+            self.executor.run(command)
+            breaking = [self.check_breaking('lammps.log')]
+        else:
+            breaking = self.run_md_replicas()
 
         #Check if nsteps was reached
-        out = self.check_process(f'grep "Breaking threshold exceeded" lammps.log')
-        if out.returncode == 0:
+        if any(breaking):
             self.max_nsteps_reached = False
-            self.run('echo "        Breaking threshold exceeded">>iter_output.txt')
+            self.log('        Breaking threshold exceeded')
         else:
             self.max_nsteps_reached = True
-            self.run('echo "        Max MD steps was reached without exceeding breaking threshold">>iter_output.txt')
+            self.log('        Max MD steps was reached without exceeding breaking threshold')
+
+
+    def run_md_replicas(self):
+        # Runs all MD replicas concurrently, then merges their preselected configurations
+        # Returns whether the breaking threshold was exceeded, for each replica
+        nreplicas = len(self.md_replicas)
+        if isinstance(self.executor, DryRunExecutor):
+            executor = self.executor
+        else:
+            launcher = getattr(self.executor, 'base_launcher', self.executor.launcher)
+            executor = LocalExecutor(max_workers=nreplicas, cores_per_job=self.md_cores_per_replica, launcher=launcher)
+
+        mlip_path = os.path.abspath(self.mlip_path)
+        workdirs = []
+        for r, replica in enumerate(self.md_replicas):
+            workdir = 'md{}'.format(r)
+            os.makedirs(workdir, exist_ok=True)
+            touch(os.path.join(workdir, self.preselect_fname))
+            executor.launch(self.set_lammps_command(replica, mlip_path, launcher=executor.launcher), workdir=workdir)
+            workdirs.append(workdir)
+
+        executor.wait('iter{}_md'.format(self.iterstep), msg='Running {} MD replicas...'.format(nreplicas))
+
+        fnames = [os.path.join(workdir, self.preselect_fname) for workdir in workdirs]
+        nconfigs, nduplicates = merge_cfg_files(fnames, self.preselect_fname)
+        self.log('        {} MD replicas preselected {} configurations ({} duplicates removed)'.format(
+                 nreplicas, nconfigs, nduplicates))
+
+        return [self.check_breaking(os.path.join(workdir, 'lammps.log')) for workdir in workdirs]
+
+
+    def check_breaking(self, logfile):
+        return file_contains(logfile, 'Breaking threshold exceeded')
 
 
     def select_configs(self):
-        self.run('echo "  Selecting configurations...">>iter_output.txt')
+        self.log('  Selecting configurations...')
         command = (f'{self.mtp} select_add ../{self.iterstep-1}/current.almtp ../{self.iterstep-1}/train.cfg {self.preselect_fname} add_to_train.cfg>>iter_output.txt')
         self.run(command)
 
@@ -138,35 +219,12 @@ class OtfMtp3Trainer(OtfMtpTrainer):
         traincommand = "{} train prev.almtp train.cfg --save_to=current.almtp --update-mindist --al_mode={}".format(self.mtp, self.training_mode)
         return traincommand
 
-    def set_convert_poscar_command(self):
-        string = ','.join([str(a) for a in self.atomic_species])
-        command = '{} convert ../add_to_train.cfg POSCAR --input_format=txt --output_format=poscar --type_order={}>>../iter_output.txt'.format(self.mtp, string)
-        return command
-
-    def fix_poscar(self, fname):
-        return
-
     def compute_validation_errors(self):
         command = f'{self.mtp} check_errors current.almtp {self.valid_db} --report_to="valid_errors.log"'
         self.run(command)
         return
 
 
-    def fix_poscar(self, fname):
-        # fix the POSCAR files produced by MTP as they do not include atomic species information
-        # According to the VASP wiki, this line should always be the 6th line, as the 5 first are mandatory
-        with open(fname, 'r+') as f:
-            content = f.readlines()
-            string = ' '+' '.join(self.atomic_species)+'\n'
-            content.insert(5, string)
-            f.seek(0)
-            f.writelines(content)
-
-
-    def run(self, command):
-        subp.run(command, shell=True)
-
-
     def set_mlip_variables(self, training_flags):
 
         if training_flags:
@@ -0,0 +1,120 @@
+import os
+import json
+import numpy as np
+
+
+class DftResourceModel:
+
+    def __init__(self, fname='dft_resources.json', time_margin=1.5, memory_margin=1.3, min_samples=3,
+                 min_time=600, max_time=7*24*3600):
+
+        '''
+            Model of the wall time and memory of the OTF DFT calculations, fitted on the completed calculations.
+
+            Each completed calculation is recorded with its number of atoms, valence electrons and k-points.
+            Wall time and memory per MPI process are fitted as power laws of these quantities
+            (least squares on their logarithms), and the predictions are used to set the --time and memory
+            requests of new DFT jobs, and to size the requests of relaunched jobs.
+
+            Input:
+                fname: json file in which the measured resources are stored, so that they are kept across iterations
+                       and restarts
+                       Default: "dft_resources.json"
+
+                time_margin: factor applied to the predicted wall time
+                             Default: 1.5
+
+                memory_margin: factor applied to the predicted memory
+                               Default: 1.3
+
+                min_samples: number of completed calculations needed before predicting requests
+                             Default: 3
+
+                min_time, max_time: bounds of the predicted wall time requests, in seconds
+                                    Default: 600, 7 days
+        '''
+
+        self.fname = os.path.abspath(fname)
+        self.time_margin = time_margin
+        self.memory_margin = memory_margin
+        self.min_samples = min_samples
+        self.min_time = min_time
+        self.max_time = max_time
+
+        if os.path.exists(self.fname):
+            with open(self.fname, 'r') as f:
+                self.samples = json.load(f)
+        else:
+            self.samples = []
+
+
+    def save(self):
+
+        tmp = '{}.tmp'.format(self.fname)
+        with open(tmp, 'w') as f:
+            json.dump(self.samples, f, indent=1)
+        os.replace(tmp, self.fname)
+
+
+    def record(self, natom, nelect, nkpt, walltime=None, memory=None):
+
+        ''' Adds a completed calculation. walltime is in seconds, memory is per MPI process, in MB. '''
+
+        if walltime is None and memory is None:
+            return
+        self.samples.append({'natom': int(natom), 'nelect': float(nelect), 'nkpt': int(nkpt),
+                             'walltime': walltime, 'memory': memory})
+        self.save()
+
+
+    def fit(self, quantity):
+
+        ''' Least squares fit of log(quantity) against log(natom), log(nelect), log(nkpt).
+            Features which are constant, or determined by the previous ones (i.e. nelect proportional to natom
+            for a fixed composition), are dropped and get a zero coefficient.
+            Returns the coefficients and the largest residual, or None if there are not enough samples
+            to fit the remaining parameters. '''
+
+        samples = [s for s in self.samples if s.get(quantity)]
+        if len(samples) < self.min_samples:
+            return None
+
+        x = np.asarray([[1., np.log(s['natom']), np.log(s['nelect']), np.log(s['nkpt'])] for s in samples])
+        y = np.log([s[quantity] for s in samples])
+
+        kept = [0]
+        for k in range(1, x.shape[1]):
+            if np.linalg.matrix_rank(x[:, kept + [k]]) > len(kept):
+                kept.append(k)
+        # The largest residual is only meaningful with more samples than parameters
+        if len(samples) <= len(kept):
+            return None
+
+        coeffs = np.zeros(x.shape[1])
+        coeffs[kept] = np.linalg.lstsq(x[:, kept], y, rcond=None)[0]
+        residual = max(np.max(y - np.matmul(x, coeffs)), 0.)
+
+        return coeffs, residual
+
+
+    def predict(self, natom, nelect, nkpt):
+
+        ''' Predicted wall time (seconds) and memory per MPI process (MB) of a calculation, including margins.
+            Each value is None if there is not enough data. '''
+
+        x = np.asarray([1., np.log(natom), np.log(nelect), np.log(nkpt)])
+        predictions = []
+        for quantity, margin in [('walltime', self.time_margin), ('memory', self.memory_margin)]:
+            fit = self.fit(quantity)
+            if fit is None:
+                predictions.append(None)
+                continue
+            coeffs, residual = fit
+            # The largest residual covers the spread of the measured values
+            predictions.append(margin*np.exp(np.dot(coeffs, x) + residual))
+
+        walltime, memory = predictions
+        if walltime is not None:
+            walltime = min(max(walltime, self.min_time), self.max_time)
+
+        return walltime, memory
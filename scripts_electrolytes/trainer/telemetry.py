@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import numpy as np
+from contextlib import contextmanager
+from ..utils.time import when_is_now
+
+''' Structured timing telemetry of the OTF procedure, and iteration performance reports '''
+
+# Stages of an OTF iteration, in order, as recorded in the telemetry file
+TELEMETRY_STAGES = ['md', 'select', 'dft', 'collect', 'train', 'validate']
+
+
+class OtfTelemetry:
+
+    def __init__(self, fname, iterstep):
+
+        '''
+            JSON-lines event log of the OTF procedure, shared by all iterations.
+
+            Each line is an event with its type, iteration, time (seconds since epoch) and data:
+            stage_start/stage_end events delimit the stages of an iteration (with their duration and
+            configuration counts), and dft_job events give the queue wait and run time of each DFT job.
+
+            Input:
+                fname: path of the telemetry file, to which events are appended
+
+                iterstep: OTF iteration of the recorded events
+        '''
+
+        self.fname = os.path.abspath(fname)
+        self.iterstep = iterstep
+
+
+    def event(self, kind, **data):
+
+        record = {'event': kind, 'iterstep': self.iterstep, 'time': time.time(), 'date': when_is_now()}
+        record.update(data)
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+    @contextmanager
+    def stage(self, name, **data):
+
+        ''' Records the start and end of a stage. Counts known at the end of the stage can be added
+            to the yielded dictionnary. '''
+
+        counts = dict(data)
+        start = time.time()
+        self.event('stage_start', stage=name)
+        try:
+            yield counts
+        finally:
+            self.event('stage_end', stage=name, duration=time.time()-start, **counts)
+
+
+    def dft_jobs(self, tasks, times, states=None):
+
+        ''' Records the queue wait and run time of each DFT job, given the configurations it computed
+            ({jobid: [configs]}) and its submission, start and end times ({jobid: (submit, start, end)}) '''
+
+        states = states or {}
+        for jobid, (submit, start, end) in times.items():
+            wait = start - submit if submit is not None and start is not None else None
+            run = end - start if start is not None and end is not None else None
+            # Array tasks are reported as "<jobid>_<task>"
+            configs = tasks.get(jobid, tasks.get(jobid.split('_')[0], []))
+            self.event('dft_job', jobid=jobid, configs=configs, state=states.get(jobid),
+                       queue_wait=wait, run_time=run)
+
+
+def read_telemetry(fname):
+
+    events = []
+    with open(fname, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Last line of an interrupted run
+                continue
+    return events
+
+
+def summarize_telemetry(fname):
+
+    '''
+        Aggregates the events of a telemetry file by iteration.
+
+        Returns a dictionnary {iterstep: summary}, each summary containing the total duration of each stage
+        (a stage run several times, i.e. after a restart, is summed), the counts recorded at the end of the stages,
+        and the number, mean/max queue wait and mean/max run time of the DFT jobs.
+    '''
+
+    summary = {}
+    for event in read_telemetry(fname):
+        it = summary.setdefault(event['iterstep'], {'stages': {}, 'counts': {}, 'njobs': 0, 'queue_wait': [], 'run_time': []})
+
+        if event['event'] == 'stage_end':
+            it['stages'][event['stage']] = it['stages'].get(event['stage'], 0.) + event['duration']
+            for key, value in event.items():
+                if key not in ['event', 'iterstep', 'time', 'date', 'stage', 'duration']:
+                    it['counts'][key] = value
+        elif event['event'] == 'dft_job':
+            it['njobs'] += 1
+            if event.get('queue_wait') is not None:
+                it['queue_wait'].append(event['queue_wait'])
+            if event.get('run_time') is not None:
+                it['run_time'].append(event['run_time'])
+
+    for it in summary.values():
+        wait = it.pop('queue_wait')
+        run = it.pop('run_time')
+        it['dft_jobs'] = {'njobs': it.pop('njobs'),
+                          'queue_wait_mean': float(np.mean(wait)) if wait else None,
+                          'queue_wait_max': float(np.max(wait)) if wait else None,
+                          'run_time_mean': float(np.mean(run)) if run else None,
+                          'run_time_max': float(np.max(run)) if run else None}
+        it['total'] = sum(it['stages'].values())
+
+    return summary
+
+
+def write_telemetry_report(fname, outname='otf_report.txt'):
+
+    '''
+        Writes a text report of the telemetry file fname: wall time of each stage for each iteration,
+        the slowest stage, DFT queue wait vs run time and the DFT throughput (configurations per hour).
+    '''
+
+    summary = summarize_telemetry(fname)
+
+    def fmt(value):
+        return '{:10.1f}'.format(value) if value is not None else '{:>10}'.format('-')
+
+    lines = ['OTF performance report ({})'.format(when_is_now()),
+             'Stage wall times in seconds', '',
+             '{:>6}'.format('iter') + ''.join('{:>10}'.format(stage) for stage in TELEMETRY_STAGES)
+             + '{:>10}{:>10}{:>12}'.format('total', 'nselect', 'bottleneck')]
+
+    totals = {stage: 0. for stage in TELEMETRY_STAGES}
+    for iterstep in sorted(summary, key=int):
+        it = summary[iterstep]
+        stages = it['stages']
+        bottleneck = max(stages, key=stages.get) if stages else '-'
+        lines.append('{:>6}'.format(iterstep) + ''.join(fmt(stages.get(stage)) for stage in TELEMETRY_STAGES)
+                     + fmt(it['total']) + '{:>10}'.format(str(it['counts'].get('nselect', '-'))) + '{:>12}'.format(bottleneck))
+        for stage in TELEMETRY_STAGES:
+            totals[stage] += stages.get(stage, 0.)
+
+    lines.append('{:>6}'.format('all') + ''.join(fmt(totals[stage]) for stage in TELEMETRY_STAGES) + fmt(sum(totals.values())))
+
+    lines += ['', 'DFT jobs: queue wait and run time in seconds', '',
+              '{:>6}{:>8}{:>12}{:>12}{:>12}{:>12}{:>14}'.format('iter', 'njobs', 'wait_mean', 'wait_max', 'run_mean', 'run_max', 'configs/hour')]
+    for iterstep in sorted(summary, key=int):
+        it = summary[iterstep]
+        jobs = it['dft_jobs']
+        ncollected = it['counts'].get('ncollected')
+        dft_time = it['stages'].get('dft', 0.) + it['stages'].get('collect', 0.)
+        throughput = 3600*ncollected/dft_time if ncollected and dft_time > 0 else None
+        lines.append('{:>6}{:>8}'.format(iterstep, jobs['njobs']) + ''.join('{:>12}'.format(fmt(jobs[key]).strip())
+                     for key in ['queue_wait_mean', 'queue_wait_max', 'run_time_mean', 'run_time_max'])
+                     + '{:>14}'.format(fmt(throughput).strip()))
+
+    with open(outname, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    return summary
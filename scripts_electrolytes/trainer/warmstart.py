@@ -0,0 +1,209 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import numpy as np
+from .diversity import structure_descriptor
+from ..utils import constants
+
+
+class DftWarmStartCache:
+
+    # Variables which do not affect the compatibility of cached files
+    ignored_vars = ['nstep', 'prtden', 'prtwf', 'getden_filepath', 'getwfk_filepath']
+
+    def __init__(self, cachedir='dft_warmstart', kind='den', max_size=10.0, cell_tol=1E-4):
+
+        '''
+            Cache of the densities (or wavefunctions) of completed OTF DFT calculations, used to start the SCF cycle
+            of newly selected configurations from the result of the most similar previous configuration.
+
+            Entries are indexed by a compatibility key (Abinit variables template, composition and cell), and ranked
+            within a key by the distance between structural descriptors (see trainer/diversity.py).
+
+            Input:
+                cachedir: directory where the cached files and the index are stored
+                          Default: "dft_warmstart"
+
+                kind: which output is reused, "den" (density, getden_filepath) or "wfk" (wavefunctions, getwfk_filepath).
+                      WFK files allow a better starting point but are much larger.
+                      Default: "den"
+
+                max_size: maximal total size of the cache, in GB. Least recently used entries are removed
+                          when it is exceeded.
+                          Default: 10.0
+
+                cell_tol: maximal relative difference between the lattice vectors of two compatible configurations
+                          Default: 1E-4
+        '''
+
+        if kind not in ['den', 'wfk']:
+            raise ValueError('kind should be "den" or "wfk", but I got {}'.format(kind))
+
+        self.cachedir = os.path.abspath(cachedir)
+        self.kind = kind
+        self.max_size = max_size
+        self.cell_tol = cell_tol
+        self.suffix = 'DEN' if kind == 'den' else 'WFK'
+        self.index_fname = os.path.join(self.cachedir, 'index.json')
+        os.makedirs(self.cachedir, exist_ok=True)
+
+        if os.path.exists(self.index_fname):
+            with open(self.index_fname, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+
+    @property
+    def output_vars(self):
+        # Abinit variables required to write the cached file
+        return {'prtden': 1} if self.kind == 'den' else {'prtwf': 1}
+
+
+    def input_vars(self, path):
+        # Abinit variables reading a cached file
+        return {'get{}_filepath'.format(self.kind): '"{}"'.format(path)}
+
+
+    def save_index(self):
+
+        tmp = '{}.tmp'.format(self.index_fname)
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_fname)
+
+
+    def template_hash(self, abivars):
+        # Cached files are only compatible between calculations with the same parameters (ecut, kpoints, nband...)
+        abivars = {key: value for key, value in abivars.items() if key not in self.ignored_vars}
+        content = json.dumps(abivars, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+    def fingerprint(self, struct):
+
+        ''' Composition, lattice (Angstrom) and descriptor of a configuration given as abivars '''
+
+        znucl = list(struct['znucl'])
+        typat = np.asarray(struct['typat'])
+        composition = [[int(znucl[t-1]), int(np.sum(typat == t))] for t in range(1, len(znucl)+1)]
+        composition = sorted(c for c in composition if c[1] > 0)
+
+        lattice = np.asarray(struct['rprim'])*np.asarray(struct['acell'])[:, None]/constants.ang_to_bohr
+        descriptor = structure_descriptor(lattice, typat, np.asarray(struct['xangst']), len(znucl))
+
+        return composition, lattice, descriptor
+
+
+    def compatible(self, entry, template, composition, lattice):
+
+        if entry['template'] != template or entry['composition'] != composition:
+            return False
+        ref = np.asarray(entry['lattice'])
+        return np.max(np.abs(lattice - ref))/np.max(np.abs(ref)) < self.cell_tol
+
+
+    def nearest(self, struct, abivars):
+
+        ''' Path of the cached file of the most similar compatible configuration, or None '''
+
+        template = self.template_hash(abivars)
+        composition, lattice, descriptor = self.fingerprint(struct)
+
+        best, best_dist = None, np.inf
+        for name, entry in self.index.items():
+            if not self.compatible(entry, template, composition, lattice):
+                continue
+            dist = np.linalg.norm(descriptor - np.asarray(entry['descriptor']))
+            if dist < best_dist:
+                best, best_dist = name, dist
+
+        if best is None:
+            return None
+
+        path = os.path.join(self.cachedir, best)
+        if not os.path.exists(path):
+            self.index.pop(best)
+            self.save_index()
+            return self.nearest(struct, abivars)
+
+        # Mark as recently used for LRU eviction
+        os.utime(path)
+        return path
+
+
+    def checkout(self, path, workdir):
+
+        '''
+            Links (or copies, if hard links are not supported) the cached file at path into workdir, and returns the path
+            of the local file. Inputs should read the local file, which is kept even if the cached one is evicted
+            before the job starts.
+        '''
+
+        local = os.path.join(workdir, 'warmstart_{}{}'.format(self.suffix, '.nc' if path.endswith('.nc') else ''))
+        if os.path.exists(local):
+            os.remove(local)
+        try:
+            os.link(path, local)
+        except OSError:
+            shutil.copyfile(path, local)
+
+        return local
+
+
+    def find_output(self, workdir):
+
+        outputs = glob.glob(os.path.join(workdir, '*o_{}'.format(self.suffix)))
+        outputs += glob.glob(os.path.join(workdir, '*o_{}.nc'.format(self.suffix)))
+        return outputs[0] if outputs else None
+
+
+    def add(self, name, workdir, struct, abivars):
+
+        ''' Stores the output of the completed calculation in workdir, under name. Returns whether a file was stored. '''
+
+        output = self.find_output(workdir)
+        if output is None:
+            return False
+
+        composition, lattice, descriptor = self.fingerprint(struct)
+        fname = '{}_{}{}'.format(name, self.suffix, '.nc' if output.endswith('.nc') else '')
+        path = os.path.join(self.cachedir, fname)
+
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        shutil.copyfile(output, tmp)
+        os.replace(tmp, path)
+
+        self.index[fname] = {'template': self.template_hash(abivars), 'composition': composition,
+                             'lattice': lattice.tolist(), 'descriptor': descriptor.tolist()}
+        self.evict()
+        self.save_index()
+
+        return True
+
+
+    def evict(self):
+
+        entries = [name for name in self.index if os.path.exists(os.path.join(self.cachedir, name))]
+        entries.sort(key=lambda name: os.path.getmtime(os.path.join(self.cachedir, name)))
+
+        total = sum(os.path.getsize(os.path.join(self.cachedir, name)) for name in entries)
+        while entries and total > self.max_size*1E9:
+            oldest = entries.pop(0)
+            path = os.path.join(self.cachedir, oldest)
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+        self.index = {name: entry for name, entry in self.index.items() if name in entries}
+
+
+    def clear(self):
+
+        for name in self.index:
+            path = os.path.join(self.cachedir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        self.index = {}
+        self.save_index()
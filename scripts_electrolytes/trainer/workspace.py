@@ -0,0 +1,93 @@
+import os
+import shutil
+
+''' In-process file operations and bookkeeping for the OTF trainers, replacing shell commands (cp, touch, rm, grep, echo) '''
+
+
+def copy_file(src, dst):
+    ''' Copies src to dst (a file or a directory). The copy is written to a temporary file and moved in place,
+        so dst is never left partially written. '''
+
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if not os.path.exists(src):
+        raise FileNotFoundError('Cannot copy {}: file not found'.format(src))
+
+    tmp = '{}.tmp{}'.format(dst, os.getpid())
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+    return dst
+
+
+def touch(fname):
+    with open(fname, 'a'):
+        os.utime(fname)
+
+
+def remove(fname):
+    ''' Removes fname if it exists '''
+    try:
+        os.remove(fname)
+    except FileNotFoundError:
+        pass
+
+
+def count_configs(fname, token=b'BEGIN_CFG'):
+    ''' Number of configurations in a .cfg file '''
+
+    if not os.path.exists(fname):
+        return 0
+
+    nconfigs = 0
+    with open(fname, 'rb') as f:
+        for line in f:
+            if line.startswith(token):
+                nconfigs += 1
+
+    return nconfigs
+
+
+def file_contains(fname, text):
+    ''' Whether text appears in fname (False if the file does not exist) '''
+
+    if not os.path.exists(fname):
+        return False
+
+    text = text.encode()
+    with open(fname, 'rb') as f:
+        for line in f:
+            if text in line:
+                return True
+
+    return False
+
+
+class IterLog:
+
+    def __init__(self, fname):
+
+        '''
+            Buffered handle on the iteration progress file (iter_output.txt).
+
+            The file is opened once in append mode, so that lines written by external programs
+            (i.e. mlp select_add >>iter_output.txt) are not overwritten. The buffer must be flushed
+            before running such a program to keep the lines in order.
+        '''
+
+        self.fname = os.path.abspath(fname)
+        self.handle = open(self.fname, 'a')
+
+
+    def write(self, msg):
+        self.handle.write('{}\n'.format(msg))
+
+
+    def flush(self):
+        if not self.handle.closed:
+            self.handle.flush()
+
+
+    def close(self):
+        if not self.handle.closed:
+            self.handle.close()
@@ -1 +1,8 @@
-from .constants import *
+from . import constants
+
+
+def __getattr__(name):
+    # Constants are exposed at the package level, and computed on first access (see constants.py)
+    if name in constants.__all__:
+        return getattr(constants, name)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
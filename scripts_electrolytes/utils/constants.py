@@ -1,21 +1,48 @@
-import scipy.constants as cst
+''' Physical constants and unit conversions. The CODATA values are read from scipy.constants,
+    which is only imported when one of them is first used. '''
 
-# Hartree to eV conversion
-ha_to_ev = cst.physical_constants['Hartree energy in eV'][0]
+# Conversion factors for stress units
+evang3_to_gpa = 160.21766208
+gpa_to_evang3 = 1./evang3_to_gpa
 
-# Bohr radius in Angstrom
-bohr_to_ang = cst.physical_constants['Bohr radius'][0]/cst.angstrom
-ang_to_bohr = 1./bohr_to_ang
+__all__ = ['ha_to_ev', 'bohr_to_ang', 'ang_to_bohr', 'atomic_timeunit', 'hartree_energy_ev', 'boltzmann_evK',
+           'boltzmann_JK', 'elementary_charge', 'evang3_to_gpa', 'gpa_to_evang3']
 
-# Atomic unit of time
-atomic_timeunit = cst.physical_constants['atomic unit of time'][0]
 
-# Hartree energy in eV
-hartree_energy_ev = cst.physical_constants['Hartree energy in eV'][0]
+def load_codata():
 
-# Boltzmann constant in eV/K
-boltzmann_evK = cst.physical_constants['Boltzmann constant in eV/K'][0]
+    import scipy.constants as cst
 
-# Conversion factors for stress units
-evang3_to_gpa = 160.21766208
-gpa_to_evang3 = 1./evang3_to_gpa
+    codata = {}
+    # Hartree to eV conversion
+    codata['ha_to_ev'] = cst.physical_constants['Hartree energy in eV'][0]
+
+    # Bohr radius in Angstrom
+    codata['bohr_to_ang'] = cst.physical_constants['Bohr radius'][0]/cst.angstrom
+    codata['ang_to_bohr'] = 1./codata['bohr_to_ang']
+
+    # Atomic unit of time
+    codata['atomic_timeunit'] = cst.physical_constants['atomic unit of time'][0]
+
+    # Hartree energy in eV
+    codata['hartree_energy_ev'] = cst.physical_constants['Hartree energy in eV'][0]
+
+    # Boltzmann constant in eV/K
+    codata['boltzmann_evK'] = cst.physical_constants['Boltzmann constant in eV/K'][0]
+
+    # Boltzmann constant in J/K
+    codata['boltzmann_JK'] = cst.physical_constants['Boltzmann constant'][0]
+
+    # Elementary charge in Coulomb
+    codata['elementary_charge'] = cst.physical_constants['elementary charge'][0]
+
+    return codata
+
+
+def __getattr__(name):
+
+    if name in __all__:
+        # Computed once, then stored as regular module attributes
+        globals().update(load_codata())
+        return globals()[name]
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
@@ -0,0 +1,118 @@
+import sys
+import json
+import argparse
+import subprocess
+
+'''
+    Import-time benchmark of the package, guarding the deferred imports of heavy dependencies.
+
+    Each module is imported in a fresh interpreter, which reports the import time and the heavy dependencies
+    loaded as a side effect. The benchmark fails (nonzero exit status) if a heavy dependency is loaded
+    at import time, or if an import takes longer than the given threshold.
+
+    Syntax:
+        python -m scripts_electrolytes.utils.import_benchmark --max_time <seconds> --repeat <n>
+'''
+
+# Dependencies which should only be imported when actually used
+HEAVY_MODULES = ['abipy', 'pymatgen', 'ase', 'netCDF4', 'pandas', 'matplotlib', 'scipy']
+
+# Modules imported by the command line scripts, and the subpackages
+BENCHMARK_MODULES = ['scripts_electrolytes',
+                     'scripts_electrolytes.database.db_splitter',
+                     'scripts_electrolytes.database.db_merger',
+                     'scripts_electrolytes.database.db_creator',
+                     'scripts_electrolytes.database.db_converter',
+                     'scripts_electrolytes.interfaces.abinit_interface',
+                     'scripts_electrolytes.interfaces.lammps_interface',
+                     'scripts_electrolytes.plotter.msd_plotter',
+                     'scripts_electrolytes.diffusion.msd_output',
+                     'scripts_electrolytes.neb.abinit_neb',
+                     ]
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted(name for name in {heavy} if name in sys.modules)
+print(json.dumps({{"time": elapsed, "heavy": heavy}}))
+'''
+
+
+def time_import(module, repeat=3):
+
+    ''' Best import time (seconds) of module over repeat fresh interpreters, and the heavy modules it loaded '''
+
+    best, heavy = None, []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True)
+        if output.returncode != 0:
+            raise ImportError('Could not import {}:\n{}'.format(module, output.stderr))
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        if best is None or result['time'] < best:
+            best = result['time']
+        heavy = result['heavy']
+
+    return best, heavy
+
+
+def run_benchmark(modules=None, max_time=1.0, repeat=3):
+
+    '''
+        Times the import of each module and checks that no heavy dependency is loaded.
+
+        Input:
+            modules: list of modules to import
+                     Default: BENCHMARK_MODULES
+
+            max_time: maximal import time of a module, in seconds
+                      Default: 1.0
+
+            repeat: number of fresh interpreters per module, the best time being kept
+                    Default: 3
+
+        Returns the list of failures (empty if the benchmark passed).
+    '''
+
+    modules = modules or BENCHMARK_MODULES
+    failures = []
+    print('{:<50}{:>10}  {}'.format('module', 'time (s)', 'heavy modules loaded'))
+    for module in modules:
+        try:
+            elapsed, heavy = time_import(module, repeat)
+        except ImportError as err:
+            print('{:<50}{:>10}  {}'.format(module, '-', 'import failed'))
+            failures.append(str(err))
+            continue
+        print('{:<50}{:>10.3f}  {}'.format(module, elapsed, ', '.join(heavy) or '-'))
+        if heavy:
+            failures.append('{} loads {} at import time'.format(module, ', '.join(heavy)))
+        if elapsed > max_time:
+            failures.append('{} takes {:.3f} s to import (max {:.3f} s)'.format(module, elapsed, max_time))
+
+    return failures
+
+
+def create_parser():
+
+    parser = argparse.ArgumentParser(description='Import-time benchmark of scripts_electrolytes')
+    parser.add_argument('modules', nargs='*', help='Modules to import. Default: package, subpackages and script modules')
+    parser.add_argument('--max_time', type=float, default=1.0, help='Maximal import time of a module, in seconds')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of fresh interpreters per module')
+
+    return parser
+
+
+def main():
+
+    args = create_parser().parse_args()
+    failures = run_benchmark(args.modules, args.max_time, args.repeat)
+    for failure in failures:
+        print('FAILED: {}'.format(failure.splitlines()[0]))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import importlib
+import types
+
+''' Deferred imports of heavy dependencies (abipy, pymatgen, ase, netCDF4, pandas, matplotlib...),
+    so that importing the package and running the command line scripts stays fast '''
+
+
+class LazyModule(types.ModuleType):
+
+    def __init__(self, name):
+
+        '''
+            Placeholder for a module which is only imported when one of its attributes is first accessed,
+            i.e. "pd = lazy_import('pandas')" at module level, then "pd.DataFrame(...)" in a function.
+        '''
+
+        super(LazyModule, self).__init__(name)
+        self.__dict__['_module'] = None
+
+
+    def load(self):
+
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+        return module
+
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+    def __dir__(self):
+        return dir(self.load())
+
+
+def lazy_import(name):
+    ''' Returns a LazyModule for module name (i.e. "matplotlib.pyplot") '''
+    return LazyModule(name)
@@ -5,33 +5,46 @@ def when_is_now():
     return datetime.now().strftime("%d/%m/%Y %H:%M:%S")
 
 
-def increase_jobtime(timestr, factor):
-    ''' Increase the Slurm time request and format it correctly'''
-    split = timestr.split(':')
-
-    if len(split) == 3:
-        # Only HH:MM:SS or H:MM:SS
+def parse_jobtime(timestr):
+    ''' Converts a Slurm time request ("MM", "MM:SS", "HH:MM:SS", "D-HH", "D-HH:MM", "D-HH:MM:SS") to seconds '''
+
+    timestr = str(timestr).strip()
+    days = 0
+    if '-' in timestr:
+        days, timestr = timestr.split('-')
+        split = [int(x) for x in timestr.split(':')]
+        # With days, the fields are HH, HH:MM or HH:MM:SS
+        split += [0]*(3-len(split))
         hh, mm, ss = split
-        dd = 0
+    else:
+        split = [int(x) for x in timestr.split(':')]
+        if len(split) == 1:
+            hh, mm, ss = 0, split[0], 0
+        elif len(split) == 2:
+            hh, mm, ss = 0, split[0], split[1]
+        elif len(split) == 3:
+            hh, mm, ss = split
+        else:
+            raise ValueError('Could not read Slurm time {}'.format(timestr))
+
+    return 24*3600*int(days) + 3600*hh + 60*mm + ss
 
-    elif len(split) == 4:
-        # D:HH:MM:SS or DD:HH:MM:SS
-        dd, hh, mm, ss = split
 
+def format_jobtime(seconds):
+    ''' Formats a number of seconds as a Slurm time request, D-HH:MM:SS '''
 
-    seconds = 24*3600*dd + 3600*hh + 60*mm + ss
-    delta = datetime.timedelta(seconds=int(factor*seconds))
+    delta = timedelta(seconds=int(round(seconds)))
+    hh, remainder = divmod(delta.seconds, 3600)
+    mm, ss = divmod(remainder, 60)
 
-    try:
-        d = str(delta).split(' days')[0]
-        if d>=7:
-            raise ValueError('Trying to launch a job of more than 7 days. Aborting,')
+    return '{}-{:02d}:{:02d}:{:02d}'.format(delta.days, hh, mm, ss)
+
+
+def increase_jobtime(timestr, factor=1.5, max_days=7):
+    ''' Increase the Slurm time request and format it correctly'''
 
-        h,m,s = str(delta).split(', ')[1].split(':')
-        h = '{0:02d}'.format(int(h))
-        time = '{}:{}:{}:{}'.format(d, h,m,s)
-    except:
-        h,m,s = str(delta).split(':')
-        time = '{}:{}:{}'.format(h,m,s)
+    seconds = factor*parse_jobtime(timestr)
+    if seconds > max_days*24*3600:
+        raise ValueError('Trying to launch a job of more than {} days. Aborting,'.format(max_days))
 
-    return time
+    return format_jobtime(seconds)
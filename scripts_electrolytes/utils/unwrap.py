@@ -0,0 +1,105 @@
+import numpy as np
+
+''' Vectorized unwrapping of periodic trajectories, for orthogonal or triclinic cells which can change during the run (NPT) '''
+
+
+def cell_from_parameters(lengths, angles):
+    ''' Converts cell lengths (angstrom) and angles (degrees) of shape (nframes, 3)
+        to cell matrices of shape (nframes, 3, 3), with lattice vectors as rows.
+        Same convention as LAMMPS and ASE: a along x, b in the xy plane.
+    '''
+
+    lengths = np.atleast_2d(np.asarray(lengths, dtype=float))
+    angles = np.radians(np.atleast_2d(np.asarray(angles, dtype=float)))
+
+    cos_alpha, cos_beta, cos_gamma = np.cos(angles).T
+    sin_gamma = np.sin(angles[:, 2])
+
+    cell = np.zeros((len(lengths), 3, 3))
+    cell[:, 0, 0] = 1.
+    cell[:, 1, 0] = cos_gamma
+    cell[:, 1, 1] = sin_gamma
+    cell[:, 2, 0] = cos_beta
+    cell[:, 2, 1] = (cos_alpha - cos_beta*cos_gamma)/sin_gamma
+    cell[:, 2, 2] = np.sqrt(1. - cos_beta**2 - cell[:, 2, 1]**2)
+
+    return cell*lengths[:, :, np.newaxis]
+
+
+def cartesian_to_fractional(positions, cells):
+    ''' Converts cartesian positions (nframes, natoms, 3) to fractional coordinates
+        using the cell matrices (nframes, 3, 3) of each frame '''
+
+    return np.einsum('fad, fdk -> fak', positions, np.linalg.inv(cells))
+
+
+class TrajectoryUnwrapper:
+
+    ''' Reconstructs continuous trajectories from wrapped fractional coordinates.
+
+        The jumps between consecutive frames are brought back to the minimum image
+        in fractional coordinates, converted to cartesian with the cell of the current frame
+        and accumulated. The last frame of each block is kept in memory, so a long trajectory
+        can be treated block by block and give the same result as a single call.
+
+        This assumes that no atom moves by more than half a cell vector between two frames.
+    '''
+
+    def __init__(self):
+
+        self.last_frac = None
+        self.last_positions = None
+
+
+    def unwrap(self, frac, cells):
+        ''' frac: wrapped fractional coordinates, shape (nframes, natoms, 3)
+            cells: cell matrices with lattice vectors as rows, shape (nframes, 3, 3) or (3, 3) for a fixed cell
+
+            Returns the unwrapped cartesian positions, shape (nframes, natoms, 3)
+        '''
+
+        frac = np.asarray(frac, dtype=float)
+        cells = np.asarray(cells, dtype=float)
+        if cells.ndim == 2:
+            cells = np.broadcast_to(cells, (len(frac), 3, 3))
+
+        if self.last_frac is None:
+            # First block: the trajectory starts at the wrapped position of the first frame
+            previous = frac[:1]
+            start = np.einsum('ad, dk -> ak', frac[0], cells[0])
+        else:
+            previous = self.last_frac[np.newaxis]
+            start = self.last_positions
+
+        jumps = np.diff(np.concatenate((previous, frac)), axis=0)
+        jumps -= np.round(jumps)
+        positions = start + np.cumsum(np.einsum('fad, fdk -> fak', jumps, cells), axis=0)
+
+        self.last_frac = frac[-1]
+        self.last_positions = positions[-1]
+
+        return positions
+
+
+def unwrap_positions(coordinates, cells, block_size=1000, cartesian=False):
+    ''' Unwraps a full trajectory by blocks of block_size frames.
+
+        coordinates: wrapped coordinates, shape (nframes, natoms, 3). Can be any array-like supporting
+                     slicing (i.e. a netCDF variable), so that only one block is loaded at a time.
+        cells: cell matrices, shape (nframes, 3, 3) or (3, 3)
+        cartesian: whether the coordinates are cartesian (True) or fractional (False)
+    '''
+
+    unwrapper = TrajectoryUnwrapper()
+    nframes = len(coordinates)
+    positions = np.zeros(np.shape(coordinates))
+
+    for start in range(0, nframes, block_size):
+        stop = min(start+block_size, nframes)
+        block_cells = np.broadcast_to(cells, (nframes, 3, 3))[start:stop]
+        block = np.asarray(coordinates[start:stop])
+        if cartesian:
+            block = cartesian_to_fractional(block, block_cells)
+        positions[start:stop] = unwrapper.unwrap(block, block_cells)
+
+    return positions
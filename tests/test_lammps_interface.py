@@ -0,0 +1,34 @@
+import pytest
+from scripts_electrolytes.interfaces.lammps_interface import dump_frame_is_complete, read_last_frame_from_dump
+
+
+def dump_frame(step, natoms=3):
+
+    lines = ['ITEM: TIMESTEP', str(step), 'ITEM: NUMBER OF ATOMS', str(natoms), 'ITEM: BOX BOUNDS pp pp pp',
+             '0.0 10.0', '0.0 10.0', '0.0 10.0', 'ITEM: ATOMS id type x y z']
+    lines += ['{} 1 {}.0 1.0 2.0'.format(i+1, i) for i in range(natoms)]
+    return '\n'.join(lines) + '\n'
+
+
+def test_dump_frame_is_complete():
+
+    frame = dump_frame(10)
+    assert dump_frame_is_complete(frame)
+    # Cut partway through the last atom line, or before its newline
+    assert not dump_frame_is_complete(frame[:-8])
+    assert not dump_frame_is_complete(frame[:-1])
+    # Missing atom
+    assert not dump_frame_is_complete(frame[:frame.rstrip('\n').rfind('\n')+1])
+
+
+def test_read_last_frame_truncated_tail(tmp_path):
+
+    fname = tmp_path / 'run.dump'
+    with open(fname, 'w') as f:
+        f.write(dump_frame(0) + dump_frame(10) + dump_frame(20)[:-8])
+    assert read_last_frame_from_dump(str(fname)) == dump_frame(10)
+
+    with open(fname, 'w') as f:
+        f.write(dump_frame(0)[:-8])
+    with pytest.raises(ValueError):
+        read_last_frame_from_dump(str(fname))
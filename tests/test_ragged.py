@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from scripts_electrolytes.database.ragged import RaggedArray
+
+
+def make_ragged():
+
+    arrays = [np.arange(6.).reshape(2, 3), np.arange(6., 15.).reshape(3, 3), np.zeros((0, 3)), np.arange(15., 18.).reshape(1, 3)]
+    return RaggedArray.from_arrays(arrays), arrays
+
+
+def test_getitem_and_setitem():
+
+    ragged, arrays = make_ragged()
+    assert len(ragged) == 4
+    for i, array in enumerate(arrays):
+        assert np.array_equal(ragged[i], array)
+    assert np.array_equal(ragged[-1], arrays[-1])
+    assert ragged[2].shape == (0, 3)
+
+    ragged[1] = -1.
+    assert np.all(ragged[1] == -1.)
+    assert np.array_equal(ragged[0], arrays[0])
+    assert np.array_equal(ragged[3], arrays[3])
+
+    with pytest.raises(IndexError):
+        ragged[4]
+    with pytest.raises(TypeError):
+        ragged[0:2] = 0.
+
+
+def test_take():
+
+    ragged, arrays = make_ragged()
+    indices = [3, 0, 2, 0]
+    subset = ragged.take(indices)
+    assert list(subset.counts) == [1, 2, 0, 2]
+    for k, i in enumerate(indices):
+        assert np.array_equal(subset[k], arrays[i])
+
+    # The subset is a copy
+    subset[1] = 100.
+    assert np.array_equal(ragged[0], arrays[0])
+
+    # Slices and index arrays go through take
+    assert [len(a) for a in ragged[1:]] == [3, 0, 1]
+    assert [len(a) for a in ragged[np.array([1, 3])]] == [3, 1]
+    assert len(ragged.take([])) == 0
+
+
+def test_integer_data():
+
+    ragged = RaggedArray([2, 1], dtype=int)
+    ragged[0] = [3, 8]
+    ragged[1] = [1]
+    assert ragged.data.dtype == int
+    assert list(ragged.data) == [3, 8, 1]
@@ -0,0 +1,103 @@
+import os
+import subprocess
+from scripts_electrolytes.interfaces.slurm_interface import SlurmBackend, SlurmWatcher, write_slurm_submitfile_loop
+
+
+def test_job_array_packing_non_multiple(tmp_path):
+
+    # 9 configurations packed by 4: the trainer maps configuration n to task n//4
+    indices = [3, 5, 6, 7, 10, 11, 12, 15, 20]
+    per_task = 4
+    njobs = -(-len(indices)//per_task)
+    for i in indices:
+        os.makedirs(tmp_path / 'config{}'.format(i))
+
+    fname = str(tmp_path / 'dft_array.sh')
+    write_slurm_submitfile_loop({'--time': '1:00:00'}, [], ['echo $i >> {}/task$SLURM_ARRAY_TASK_ID'.format(tmp_path)],
+                                len(indices), str(tmp_path), njobs=njobs, indices=indices, dirprefix='config',
+                                fname=fname, per_task=per_task)
+
+    for task in range(njobs):
+        subprocess.run(['bash', fname], check=True, env=dict(os.environ, SLURM_ARRAY_TASK_ID=str(task)))
+
+    for task in range(njobs):
+        with open(tmp_path / 'task{}'.format(task)) as f:
+            computed = [int(line) for line in f]
+        assert computed == [j for n, j in enumerate(indices) if n//per_task == task]
+
+
+def write_fake_command(path, output):
+
+    with open(path, 'w') as f:
+        f.write('#!/bin/bash\ncat <<EOF\n{}\nEOF\n'.format(output))
+    os.chmod(path, 0o755)
+    return str(path)
+
+
+def test_query_finished_array_tasks(tmp_path):
+
+    # Tasks 0 and 1 of array 100 left the queue, only task 2 is still running
+    squeue = write_fake_command(tmp_path / 'squeue', '100_2 RUNNING\n101 PENDING')
+    sacct = write_fake_command(tmp_path / 'sacct', '100_0|COMPLETED\n100_1|FAILED\n100_2|PENDING\n102|TIMEOUT')
+    backend = SlurmBackend(squeue=squeue, sacct=sacct)
+
+    states = backend.query(['100', '101', '102', '103'])
+    assert states == {'100_0': 'COMPLETED', '100_1': 'FAILED', '100_2': 'RUNNING', '101': 'PENDING',
+                      '102': 'TIMEOUT', '103': 'UNKNOWN'}
+
+
+class FakeBackend:
+
+    # Returns the given states at each query, as squeue/sacct would
+
+    def __init__(self, polls):
+        self.polls = list(polls)
+
+    def query(self, jobids):
+        states = self.polls.pop(0)
+        return {jobid: states.get(jobid, 'UNKNOWN') for jobid in jobids}
+
+    def is_listed(self, jobid, states):
+        return jobid in states
+
+
+def test_watcher_waits_for_just_submitted_jobs(tmp_path):
+
+    # Job 200 is not listed yet right after submission, then runs and completes
+    backend = FakeBackend([{}, {'200': 'PENDING'}, {'200': 'RUNNING'}, {'200': 'COMPLETED'}])
+    watcher = SlurmWatcher('test', 'user', jobids=['200'], backend=backend, status_file=str(tmp_path / 'status.txt'))
+    finished = []
+
+    assert watcher.poll(lambda jobid, state: finished.append((jobid, state))) == (1, 0)
+    assert watcher.poll(lambda jobid, state: finished.append((jobid, state))) == (1, 0)
+    assert watcher.poll(lambda jobid, state: finished.append((jobid, state))) == (1, 0)
+    assert watcher.poll(lambda jobid, state: finished.append((jobid, state))) == (0, 1)
+    assert finished == [('200', 'COMPLETED')]
+
+
+def test_watcher_missing_jobs(tmp_path):
+
+    # Job 300 is never listed, job 301 leaves the queue without accounting information
+    backend = FakeBackend([{'301': 'RUNNING'}, {}, {}])
+    watcher = SlurmWatcher('test', 'user', jobids=['300', '301'], backend=backend, status_file=str(tmp_path / 'status.txt'),
+                           max_missing=3)
+    finished = []
+
+    assert watcher.poll(lambda jobid, state: finished.append((jobid, state))) == (2, 0)
+    assert watcher.poll(lambda jobid, state: finished.append((jobid, state))) == (1, 1)
+    assert watcher.poll(lambda jobid, state: finished.append((jobid, state))) == (0, 1)
+    assert finished == [('301', 'UNKNOWN'), ('300', 'UNKNOWN')]
+
+
+def test_job_memory_from_steps(tmp_path):
+
+    sacct = write_fake_command(tmp_path / 'sacct', '\n'.join(['400|2024-03-01T12:00:00|2024-03-01T12:01:00|2024-03-01T13:00:00|',
+                                                              '400.batch|2024-03-01T12:01:00|2024-03-01T12:01:00|2024-03-01T13:00:00|2048K',
+                                                              '400.0|2024-03-01T12:01:05|2024-03-01T12:01:05|2024-03-01T13:00:00|1.5G',
+                                                              '401_0|2024-03-01T12:00:00|Unknown|Unknown|']))
+    backend = SlurmBackend(sacct=sacct)
+
+    assert backend.job_memory(['400', '401']) == {'400': 1536.}
+    times = backend.job_times(['400', '401'])
+    assert sorted(times) == ['400', '401_0']
+    assert times['401_0'][1:] == (None, None)